@@ -0,0 +1,87 @@
+"""
+Shared store of compressed content variants.
+
+LLM compression is the most expensive step of token reduction, and the same
+text comes back often: a window restored from disk and optimized again,
+boilerplate repeated across sessions, a system prompt shared by many
+windows. Compressed variants are therefore kept here, keyed by a hash of
+the exact content, the compression method and the target ratio, so a
+repeat costs a dict lookup instead of a model call.
+
+The store is bounded by entry count and by total stored characters; the
+least recently used variants are evicted first. It is shared by all
+optimization tasks of an optimizer and safe to use from several threads.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from content_fingerprint import content_hash
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_CHARS = 20_000_000
+
+VariantKey = Tuple[int, str, float]  # (content hash, method, ratio)
+
+
+def variant_key(content: str, method: str, ratio: float) -> VariantKey:
+    # Exact content, not the normalized form: the variant must fit this text
+    return content_hash(content), method, round(ratio, 2)
+
+
+class CompressionStore:
+    """LRU map from variant keys to compressed content"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_chars: int = DEFAULT_MAX_CHARS):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._variants: "OrderedDict[VariantKey, str]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._variants)
+
+    def get(self, key: VariantKey) -> Optional[str]:
+        with self._lock:
+            compressed = self._variants.get(key)
+            if compressed is None:
+                self.misses += 1
+                return None
+            self._variants.move_to_end(key)
+            self.hits += 1
+            return compressed
+
+    def put(self, key: VariantKey, compressed: str):
+        if len(compressed) > self.max_chars:
+            return
+        with self._lock:
+            previous = self._variants.pop(key, None)
+            if previous is not None:
+                self._chars -= len(previous)
+            self._variants[key] = compressed
+            self._chars += len(compressed)
+            while len(self._variants) > self.max_entries or self._chars > self.max_chars:
+                _, evicted = self._variants.popitem(last=False)
+                self._chars -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._variants.clear()
+            self._chars = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._variants),
+            "chars": self._chars,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
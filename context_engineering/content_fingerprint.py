@@ -0,0 +1,200 @@
+"""
+Content fingerprints for duplicate detection.
+
+content_hash() is a 128-bit BLAKE2b digest of the normalized content
+(lower-cased, whitespace runs collapsed), so exact duplicates are found by
+comparing integers instead of keeping whole strings around. simhash() is a
+64-bit SimHash over word bigrams: texts that differ in a few words get
+fingerprints a few bits apart.
+
+DuplicateDetector processes elements in order and keeps only a few integers
+per kept element. A later element is a duplicate when
+
+- its content hash equals a kept one (exact),
+- in near mode, its SimHash is within the Hamming-distance threshold of a
+  kept one (near). Fingerprints are indexed by threshold + 1 bit bands;
+  two fingerprints within the threshold share at least one band exactly
+  (pigeonhole), so only same-band candidates are compared. Each band
+  bucket keeps its MAX_BAND_CANDIDATES most recent fingerprints: with
+  narrow bands unrelated texts collide often, and an unbounded bucket would
+  make the pass quadratic. A near duplicate of an element that has been
+  pushed out of all its buckets is missed,
+- in near mode, it is a prefix or suffix of a kept element (contained),
+  such as a repeated message that was cut short. Candidates share the
+  first or last CONTAINMENT_WORDS words, and only then are the texts
+  compared.
+
+The work per element is bounded, so a pass over N elements is O(N).
+"""
+
+import hashlib
+from collections import deque
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+DEDUPE_EXACT = "exact"
+DEDUPE_NEAR = "near"
+DEDUPE_MODES = (DEDUPE_EXACT, DEDUPE_NEAR)
+
+MATCH_EXACT = "exact"
+MATCH_NEAR = "near"
+MATCH_CONTAINED = "contained"
+
+SIMHASH_BITS = 64
+DEFAULT_SIMHASH_THRESHOLD = 6     # differing bits still counted as a near duplicate
+MAX_SIMHASH_THRESHOLD = 15
+CONTAINMENT_WORDS = 8             # shorter texts are never treated as contained
+MAX_CONTAINMENT_CANDIDATES = 8    # kept texts compared per lookup, most recent first
+MAX_BAND_CANDIDATES = 16          # fingerprints kept per band bucket, most recent first
+
+_BIT_LANES = bytes.maketrans(b"01", b"\x00\x01")
+
+Match = Tuple[str, Hashable, int]  # (match kind, key of the kept element, Hamming distance)
+
+
+def normalize(text: str) -> str:
+    """Lower-cased, whitespace runs collapsed to single spaces"""
+    return " ".join(text.lower().split())
+
+
+def content_hash(normalized: str) -> int:
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest(), "big")
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(normalized: str) -> int:
+    words = normalized.split()
+    if len(words) > 1:
+        features = [words[i] + " " + words[i + 1] for i in range(len(words) - 1)]
+    else:
+        features = words
+    if not features:
+        return 0
+
+    # Bit counts without a per-bit loop: each feature hash is spread into one
+    # byte lane per bit and the lanes are summed as a single integer, up to
+    # 255 features at a time so no lane overflows
+    counts = [0] * SIMHASH_BITS
+    for start in range(0, len(features), 255):
+        lanes = sum(
+            int.from_bytes(format(_hash64(feature), "064b").encode().translate(_BIT_LANES), "big")
+            for feature in features[start:start + 255]
+        )
+        for bit, count in enumerate(lanes.to_bytes(SIMHASH_BITS, "big")):
+            counts[bit] += count
+
+    half = len(features) / 2
+    fingerprint = 0
+    for count in counts:
+        fingerprint = (fingerprint << 1) | (count > half)
+    return fingerprint
+
+
+def containment_keys(normalized: str) -> Optional[Tuple[int, int]]:
+    """Hashes of the first and last CONTAINMENT_WORDS words; None for shorter texts"""
+    words = normalized.split()
+    if len(words) < CONTAINMENT_WORDS:
+        return None
+    return _hash64(" ".join(words[:CONTAINMENT_WORDS])), _hash64(" ".join(words[-CONTAINMENT_WORDS:]))
+
+
+if hasattr(int, "bit_count"):  # Python 3.10+
+    def hamming_distance(a: int, b: int) -> int:
+        return (a ^ b).bit_count()
+else:
+    def hamming_distance(a: int, b: int) -> int:
+        return bin(a ^ b).count("1")
+
+
+class DuplicateDetector:
+    """Streaming duplicate check; see the module docstring for the match kinds
+
+    text_of(key) returns the normalized text of an element (kept or being
+    checked); it is only called to confirm a containment candidate.
+    """
+
+    def __init__(self,
+                 mode: str = DEDUPE_EXACT,
+                 threshold: int = DEFAULT_SIMHASH_THRESHOLD,
+                 text_of: Optional[Callable[[Hashable], str]] = None):
+        if mode not in DEDUPE_MODES:
+            raise ValueError(f"Unknown dedupe mode: {mode}")
+        if not 0 <= threshold <= MAX_SIMHASH_THRESHOLD:
+            raise ValueError(f"simhash_threshold must be between 0 and {MAX_SIMHASH_THRESHOLD}")
+        if mode == DEDUPE_NEAR and text_of is None:
+            raise ValueError("Near-duplicate detection needs text_of")
+        self.mode = mode
+        self.threshold = threshold
+        self.text_of = text_of
+
+        self._hashes: Dict[int, Hashable] = {}
+        band_count = threshold + 1
+        width = SIMHASH_BITS // band_count
+        # (shift, mask) per band; the last band takes the remaining bits
+        self._bands = [
+            (index * width, (1 << (width if index < band_count - 1 else SIMHASH_BITS - index * width)) - 1)
+            for index in range(band_count)
+        ]
+        self._band_index: List[Dict[int, "deque[Tuple[int, Hashable]]"]] = [{} for _ in self._bands]
+        self._prefixes: Dict[int, List[Hashable]] = {}
+        self._suffixes: Dict[int, List[Hashable]] = {}
+
+    def check(self, key: Hashable, digest: int,
+              fingerprint: Optional[int] = None, normalized: Optional[str] = None,
+              containment: Optional[Tuple[int, int]] = None) -> Optional[Match]:
+        """Match against the kept elements; a non-duplicate is kept under key
+
+        Near mode also needs the SimHash fingerprint, and either the normalized
+        text or its precomputed containment_keys() (the text is then fetched
+        with text_of only if a containment candidate turns up).
+        """
+        kept = self._hashes.get(digest)
+        if kept is not None:
+            return MATCH_EXACT, kept, 0
+        if self.mode == DEDUPE_EXACT:
+            self._hashes[digest] = key
+            return None
+
+        bands = [(fingerprint >> shift) & mask for shift, mask in self._bands]
+        for index, band in enumerate(bands):
+            for candidate, candidate_key in reversed(self._band_index[index].get(band, ())):
+                distance = hamming_distance(fingerprint, candidate)
+                if distance <= self.threshold:
+                    return MATCH_NEAR, candidate_key, distance
+
+        if containment is None and normalized is not None:
+            containment = containment_keys(normalized)
+        if containment is not None:
+            prefix, suffix = containment
+            prefix_candidates = self._prefixes.get(prefix)
+            suffix_candidates = self._suffixes.get(suffix)
+            if prefix_candidates or suffix_candidates:
+                if normalized is None:
+                    normalized = self.text_of(key)
+                kept = (self._contained(prefix_candidates, normalized, str.startswith)
+                        or self._contained(suffix_candidates, normalized, str.endswith))
+                if kept is not None:
+                    return MATCH_CONTAINED, kept, 0
+
+        self._hashes[digest] = key
+        for index, band in enumerate(bands):
+            bucket = self._band_index[index].get(band)
+            if bucket is None:
+                bucket = self._band_index[index][band] = deque(maxlen=MAX_BAND_CANDIDATES)
+            bucket.append((fingerprint, key))
+        if containment is not None:
+            self._prefixes.setdefault(prefix, []).append(key)
+            self._suffixes.setdefault(suffix, []).append(key)
+        return None
+
+    def _contained(self, candidates: Optional[List[Hashable]], normalized: str,
+                   test: Callable[[str, str], bool]) -> Optional[Hashable]:
+        if not candidates:
+            return None
+        for candidate_key in candidates[-MAX_CONTAINMENT_CANDIDATES:]:
+            text = self.text_of(candidate_key)
+            if len(text) > len(normalized) and test(text, normalized):
+                return candidate_key
+        return None
@@ -2,11 +2,13 @@ import logging
 import re
 import json
 from typing import Dict, List, Any, Optional, Tuple
+from dataclasses import replace
 from datetime import datetime
-import google.generativeai as genai
-from collections import Counter
 import statistics
 
+from context_gemini import LazyGenerativeModel
+from hierarchical_summary import CHUNK_TOKENS, MapReduceSummarizer, format_element
+from incremental_analysis import MAX_CACHED_WINDOWS, SEMANTIC_REFRESH_RATIO, AnalysisCache, WindowStats
 from context_models import (
     ContextWindow, ContextElement, ContextAnalysis, 
     ContextQuality, MultimodalContext, RAGContext
@@ -14,37 +16,69 @@ from context_models import (
 
 logger = logging.getLogger(__name__)
 
+# これを超えるウィンドウは1つのプロンプトに入れず、チャンクごとの要約（map-reduce）を分析する
+SEMANTIC_PROMPT_TOKENS = 2 * CHUNK_TOKENS
+
 class ContextAnalyzer:
     """コンテキスト分析エンジン"""
     
-    def __init__(self, gemini_api_key: str):
-        genai.configure(api_key=gemini_api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        
-    async def analyze_context_window(self, window: ContextWindow) -> ContextAnalysis:
-        """コンテキストウィンドウの包括的分析"""
+    def __init__(self,
+                 gemini_api_key: str,
+                 semantic_refresh_ratio: float = SEMANTIC_REFRESH_RATIO,
+                 max_cached_windows: int = MAX_CACHED_WINDOWS):
+        self.model = LazyGenerativeModel(gemini_api_key)
+        self.summarizer = MapReduceSummarizer(self.model)
+        # ウィンドウごとの集計と前回の分析結果（バージョンが同じなら再計算しない）
+        self.analysis_cache = AnalysisCache(max_cached_windows)
+        # 前回の意味分析以降に変更されたトークンがこの割合を超えたら意味分析をやり直す
+        self.semantic_refresh_ratio = semantic_refresh_ratio
+        
+    async def analyze_context_window(self, window: ContextWindow, force: bool = False) -> ContextAnalysis:
+        """コンテキストウィンドウの包括的分析（増分）
+        
+        前回と同じバージョンのウィンドウには前回の結果を返す。変更があった場合は
+        ローカルメトリクスを差分で更新し、意味分析は変更トークンが閾値を超えた
+        ときだけやり直す。force=True で意味分析も必ずやり直す。
+        """
+        with window.lock:
+            elements = list(window.elements)
+            version = window.version
+        
+        stats = self.analysis_cache.stats_for(window.id)
+        with stats.lock:
+            if force:
+                stats.semantic = None
+            elif stats.analysis is not None and stats.version == version:
+                return self._copy_analysis(stats.analysis)
+            
+            stats.sync(elements, version)
+            # 基本メトリクス・構造・トークン効率性（差分更新した集計から）
+            basic_metrics = stats.basic_metrics(window)
+            structure_analysis = stats.structure_metrics()
+            efficiency_analysis = stats.efficiency_metrics()
+            semantic_analysis = stats.semantic
+            stale_tokens = stats.stale_tokens
+            refresh_tokens = self.semantic_refresh_ratio * max(stats.total_tokens, 1)
+        
+        # 意味的一貫性分析（前回の結果が古くなった場合のみ）
+        if semantic_analysis is None or stale_tokens > refresh_tokens:
+            semantic_analysis = await self._analyze_semantic_consistency(window)
+            if "error" not in semantic_analysis:
+                with stats.lock:
+                    stats.semantic = semantic_analysis
+                    stats.stale_tokens = max(stats.stale_tokens - stale_tokens, 0)
+            stale_tokens = 0
         
         analysis = ContextAnalysis(
             context_id=window.id,
             analysis_type="comprehensive"
         )
-        
-        # 基本メトリクス計算
-        basic_metrics = self._calculate_basic_metrics(window)
         analysis.metrics.update(basic_metrics)
-        
-        # 構造分析
-        structure_analysis = self._analyze_structure(window)
         analysis.metrics.update(structure_analysis)
-        
-        # 意味的一貫性分析
-        semantic_analysis = await self._analyze_semantic_consistency(window)
         analysis.metrics.update(semantic_analysis["metrics"])
         analysis.insights.extend(semantic_analysis["insights"])
-        
-        # トークン効率性分析
-        efficiency_analysis = self._analyze_token_efficiency(window)
         analysis.metrics.update(efficiency_analysis)
+        analysis.metrics["semantic_stale_tokens"] = stale_tokens
         
         # 品質評価
         quality_assessment = await self._assess_quality(window, analysis.metrics)
@@ -53,55 +87,37 @@ class ContextAnalyzer:
         analysis.strengths.extend(quality_assessment["strengths"])
         analysis.recommendations.extend(quality_assessment["recommendations"])
         
-        return analysis
+        with stats.lock:
+            if stats.version == version:
+                stats.analysis = analysis
+        
+        window.quality_metrics = dict(analysis.metrics, quality_score=analysis.quality_score)
+        return self._copy_analysis(analysis)
+    
+    def _copy_analysis(self, analysis: ContextAnalysis) -> ContextAnalysis:
+        """キャッシュした結果を呼び出し側が変更しても影響しないようにコピー"""
+        return replace(
+            analysis,
+            metrics=dict(analysis.metrics),
+            insights=list(analysis.insights),
+            recommendations=list(analysis.recommendations),
+            issues=list(analysis.issues),
+            strengths=list(analysis.strengths)
+        )
     
     def _calculate_basic_metrics(self, window: ContextWindow) -> Dict[str, float]:
         """基本メトリクス計算"""
-        if not window.elements:
-            return {
-                "total_elements": 0,
-                "total_tokens": 0,
-                "avg_element_length": 0,
-                "token_utilization": 0
-            }
-        
-        element_lengths = [len(elem.content) for elem in window.elements]
-        
-        return {
-            "total_elements": len(window.elements),
-            "total_tokens": window.current_tokens,
-            "avg_element_length": statistics.mean(element_lengths),
-            "max_element_length": max(element_lengths),
-            "min_element_length": min(element_lengths),
-            "token_utilization": window.utilization_ratio,
-            "available_tokens": window.available_tokens
-        }
+        return self._full_stats(window).basic_metrics(window)
     
     def _analyze_structure(self, window: ContextWindow) -> Dict[str, float]:
         """構造分析"""
-        if not window.elements:
-            return {}
-        
-        # 要素タイプの分布
-        type_counts = Counter(elem.type.value for elem in window.elements)
-        total_elements = len(window.elements)
-        
-        # 優先度分析
-        priorities = [elem.priority for elem in window.elements]
-        
-        # 時系列分析
-        creation_times = [elem.created_at for elem in window.elements]
-        time_span = (max(creation_times) - min(creation_times)).total_seconds() if len(creation_times) > 1 else 0
-        
-        return {
-            "type_diversity": len(type_counts) / max(len(type_counts), 1),
-            "avg_priority": statistics.mean(priorities),
-            "priority_std": statistics.stdev(priorities) if len(priorities) > 1 else 0,
-            "time_span_hours": time_span / 3600,
-            "system_ratio": type_counts.get("system", 0) / total_elements,
-            "user_ratio": type_counts.get("user", 0) / total_elements,
-            "assistant_ratio": type_counts.get("assistant", 0) / total_elements
-        }
+        return self._full_stats(window).structure_metrics()
+    
+    def _full_stats(self, window: ContextWindow) -> WindowStats:
+        """キャッシュを使わない集計"""
+        stats = WindowStats()
+        stats.sync(window.elements, window.version)
+        return stats
     
     async def _analyze_semantic_consistency(self, window: ContextWindow) -> Dict[str, Any]:
         """意味的一貫性分析"""
@@ -109,11 +125,15 @@ class ContextAnalyzer:
             return {"metrics": {}, "insights": []}
         
         try:
-            # コンテキスト要素をテキストとして結合
-            context_text = "\n\n".join([
-                f"[{elem.type.value}] {elem.content}" 
-                for elem in window.elements
-            ])
+            summarized_chunks = 0
+            if window.current_tokens <= SEMANTIC_PROMPT_TOKENS:
+                # コンテキスト要素をテキストとして結合
+                context_text = "\n\n".join([format_element(elem) for elem in window.elements])
+            else:
+                # 長いウィンドウはチャンクごとに要約して統合（要約はキャッシュされ、追記分のみ再要約）
+                summary = await self.summarizer.summarize(window.elements)
+                context_text = f"（{summary.chunks}個のチャンクに分けて要約したコンテキスト全体の要約）\n{summary.text}"
+                summarized_chunks = summary.chunks
             
             prompt = f"""
             以下のコンテキストの意味的一貫性を分析してください:
@@ -150,6 +170,8 @@ class ContextAnalyzer:
             
             response = self.model.generate_content(prompt)
             result = json.loads(response.text)
+            if summarized_chunks:
+                result.setdefault("metrics", {})["summarized_chunks"] = summarized_chunks
             
             return result
             
@@ -163,49 +185,17 @@ class ContextAnalyzer:
                     "context_clarity": 0.5,
                     "goal_alignment": 0.5
                 },
-                "insights": [f"分析エラー: {str(e)}"]
+                "insights": [f"分析エラー: {str(e)}"],
+                "error": str(e)  # この結果はキャッシュしない
             }
     
     def _analyze_token_efficiency(self, window: ContextWindow) -> Dict[str, float]:
         """トークン効率性分析"""
-        if not window.elements:
-            return {}
-        
-        # 情報密度計算
-        total_chars = sum(len(elem.content) for elem in window.elements)
-        total_words = sum(len(elem.content.split()) for elem in window.elements)
-        
-        # 冗長性分析
-        redundancy_score = self._calculate_redundancy(window)
-        
-        return {
-            "chars_per_token": total_chars / max(window.current_tokens, 1),
-            "words_per_token": total_words / max(window.current_tokens, 1),
-            "information_density": total_words / max(total_chars, 1),
-            "redundancy_score": redundancy_score,
-            "efficiency_score": 1.0 - redundancy_score
-        }
+        return self._full_stats(window).efficiency_metrics()
     
     def _calculate_redundancy(self, window: ContextWindow) -> float:
-        """冗長性計算"""
-        if len(window.elements) < 2:
-            return 0.0
-        
-        contents = [elem.content.lower() for elem in window.elements]
-        
-        # 単語レベルでの重複計算
-        all_words = []
-        for content in contents:
-            words = re.findall(r'\w+', content)
-            all_words.extend(words)
-        
-        if not all_words:
-            return 0.0
-        
-        word_counts = Counter(all_words)
-        duplicate_words = sum(count - 1 for count in word_counts.values() if count > 1)
-        
-        return duplicate_words / len(all_words)
+        """冗長性計算（単語レベルでの重複）"""
+        return self._full_stats(window).redundancy()
     
     async def _assess_quality(self, window: ContextWindow, metrics: Dict[str, float]) -> Dict[str, Any]:
         """品質評価"""
@@ -272,8 +262,7 @@ class MultimodalAnalyzer:
     """マルチモーダルコンテキスト分析"""
     
     def __init__(self, gemini_api_key: str):
-        genai.configure(api_key=gemini_api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.model = LazyGenerativeModel(gemini_api_key)
     
     async def analyze_multimodal_context(self, context: MultimodalContext) -> ContextAnalysis:
         """マルチモーダルコンテキストの分析"""
@@ -353,8 +342,7 @@ class RAGAnalyzer:
     """RAGコンテキスト分析"""
     
     def __init__(self, gemini_api_key: str):
-        genai.configure(api_key=gemini_api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.model = LazyGenerativeModel(gemini_api_key)
     
     async def analyze_rag_context(self, rag_context: RAGContext) -> ContextAnalysis:
         """RAGコンテキストの分析"""
@@ -1,11 +1,11 @@
-import os
 import json
 import logging
-from typing import Dict, List, Any, Optional
+import tempfile
+from typing import Dict, Iterator, List, Any, Optional
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect, UploadFile, File
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import asyncio
 from contextlib import asynccontextmanager
@@ -17,10 +17,23 @@ from context_models import (
 from context_analyzer import ContextAnalyzer, MultimodalAnalyzer, RAGAnalyzer
 from template_manager import TemplateManager, ContextTemplateIntegrator
 from context_optimizer import ContextOptimizer
+from optimization_scheduler import DEFAULT_PRIORITY, DEFAULT_TENANT, QueueFullError
+from context_serialization import dumps, dumps_bytes
+from context_config import get_settings
+from template_engine import MissingVariableError
+from template_batch import BATCH_CHUNK_SIZE, ROW_FORMATS, read_rows
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+BATCH_BODY_MEMORY_LIMIT = 8 * 1024 * 1024  # 一括レンダリングのボディがこれを超えたら一時ファイルに退避
+
+class FastJSONResponse(JSONResponse):
+    """context_serialization で直接エンコードするレスポンス（jsonable_encoder を経由しない）"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
 # リクエスト・レスポンスモデル
 class ContextElementRequest(BaseModel):
     content: str
@@ -45,10 +58,14 @@ class TemplateRequest(BaseModel):
 class TemplateRenderRequest(BaseModel):
     template_id: str
     variables: Dict[str, Any]
+    missing: str = "keep"  # 未指定変数の扱い: keep / empty / error
 
 class OptimizationRequest(BaseModel):
     goals: List[str]
     constraints: Dict[str, Any] = {}
+    tenant: str = DEFAULT_TENANT
+    priority: int = DEFAULT_PRIORITY  # 1-10、大きいほど先に実行
+    timeout: Optional[float] = None  # 秒（未指定はスケジューラの既定値）
 
 class MultimodalContextRequest(BaseModel):
     text_content: str = ""
@@ -80,7 +97,7 @@ class WebSocketManager:
         disconnected = []
         for connection in self.active_connections:
             try:
-                await connection.send_json(message)
+                await connection.send_text(dumps(message))
             except:
                 disconnected.append(connection)
         
@@ -99,12 +116,15 @@ async def lifespan(app: FastAPI):
     yield
     # アプリケーション終了時
     logger.info("Context Engineering API Server shutting down...")
+    await context_optimizer.shutdown()
+    template_manager.close()
 
 app = FastAPI(
     title="Context Engineering API",
     description="Complete Context Engineering system with AI-powered analysis, optimization, and template management",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # コンポーネント初期化
@@ -112,13 +132,15 @@ async def initialize_components():
     global context_analyzer, template_manager, context_optimizer
     global multimodal_analyzer, rag_analyzer, template_integrator
     
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
+    gemini_api_key = get_settings().gemini_api_key
     if not gemini_api_key:
-        raise ValueError("GEMINI_API_KEY environment variable is required")
+        raise ValueError("GEMINI_API_KEY is required (environment, .env.local or .env)")
     
     context_analyzer = ContextAnalyzer(gemini_api_key)
     template_manager = TemplateManager(gemini_api_key)
     context_optimizer = ContextOptimizer(gemini_api_key)
+    # 最適化タスクの進捗をWebSocketに配信
+    context_optimizer.event_listeners.append(websocket_manager.broadcast)
     multimodal_analyzer = MultimodalAnalyzer(gemini_api_key)
     rag_analyzer = RAGAnalyzer(gemini_api_key)
     template_integrator = ContextTemplateIntegrator(template_manager)
@@ -171,6 +193,7 @@ async def dashboard():
                 <div class="endpoint">POST /api/templates</div>
                 <div class="endpoint">POST /api/templates/generate</div>
                 <div class="endpoint">POST /api/templates/{template_id}/render</div>
+                <div class="endpoint">POST /api/templates/{template_id}/render/batch</div>
             </div>
             
             <div class="feature">
@@ -178,6 +201,7 @@ async def dashboard():
                 <p>AI-powered context optimization</p>
                 <div class="endpoint">POST /api/contexts/{window_id}/optimize</div>
                 <div class="endpoint">GET /api/optimization/{task_id}</div>
+                <div class="endpoint">POST /api/optimization/{task_id}/cancel</div>
             </div>
             
             <div class="feature">
@@ -324,34 +348,35 @@ async def add_context_element(window_id: str, request: ContextElementRequest) ->
     }
 
 @app.get("/api/contexts/{window_id}")
-async def get_context_window(window_id: str) -> Dict[str, Any]:
+async def get_context_window(window_id: str) -> FastJSONResponse:
     """コンテキストウィンドウを取得"""
     window = find_window_by_id(window_id)
     if not window:
         raise HTTPException(status_code=404, detail="Context window not found")
     
-    return {
+    # 要素はコンパイル済みエンコーダで直接シリアライズ（to_dict を経由しない）
+    return FastJSONResponse({
         "id": window.id,
         "max_tokens": window.max_tokens,
         "current_tokens": window.current_tokens,
         "available_tokens": window.available_tokens,
         "utilization_ratio": window.utilization_ratio,
         "reserved_tokens": window.reserved_tokens,
-        "elements": [element.to_dict() for element in window.elements],
+        "elements": window.elements,
         "quality_metrics": window.quality_metrics,
-        "created_at": window.created_at.isoformat()
-    }
+        "created_at": window.created_at
+    })
 
 # コンテキスト分析
 @app.post("/api/contexts/{window_id}/analyze")
-async def analyze_context(window_id: str) -> Dict[str, Any]:
-    """コンテキスト分析を実行"""
+async def analyze_context(window_id: str, force: bool = False) -> FastJSONResponse:
+    """コンテキスト分析を実行（変更のないウィンドウは前回の結果を返す。force=true で再分析）"""
     window = find_window_by_id(window_id)
     if not window:
         raise HTTPException(status_code=404, detail="Context window not found")
     
     try:
-        analysis = await context_analyzer.analyze_context_window(window)
+        analysis = await context_analyzer.analyze_context_window(window, force=force)
         
         await websocket_manager.broadcast({
             "type": "analysis_completed",
@@ -359,7 +384,7 @@ async def analyze_context(window_id: str) -> Dict[str, Any]:
             "quality_score": analysis.quality_score
         })
         
-        return analysis.to_dict()
+        return FastJSONResponse(analysis)
         
     except Exception as e:
         logger.error(f"Context analysis failed: {str(e)}")
@@ -392,18 +417,18 @@ async def create_template(request: TemplateRequest) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/templates")
-async def list_templates(category: Optional[str] = None, tags: Optional[str] = None) -> Dict[str, Any]:
+async def list_templates(category: Optional[str] = None, tags: Optional[str] = None) -> FastJSONResponse:
     """テンプレート一覧を取得"""
     tag_list = tags.split(",") if tags else None
     templates = template_manager.list_templates(category, tag_list)
     
-    return {
+    return FastJSONResponse({
         "templates": [
             {
                 "id": t.id,
                 "name": t.name,
                 "description": t.description,
-                "type": t.type.value,
+                "type": t.type,
                 "category": t.category,
                 "tags": t.tags,
                 "usage_count": t.usage_count,
@@ -412,22 +437,84 @@ async def list_templates(category: Optional[str] = None, tags: Optional[str] = N
             }
             for t in templates
         ]
-    }
+    })
 
 @app.post("/api/templates/{template_id}/render")
 async def render_template(template_id: str, request: TemplateRenderRequest) -> Dict[str, Any]:
     """テンプレートをレンダリング"""
     try:
-        rendered = template_manager.render_template(template_id, request.variables)
+        rendered = template_manager.render_template(template_id, request.variables, request.missing)
         if not rendered:
             raise HTTPException(status_code=404, detail="Template not found")
         
         return {"rendered_content": rendered}
         
+    except MissingVariableError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Template rendering failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _spool_body(request: Request) -> tempfile.SpooledTemporaryFile:
+    """リクエストボディをレスポンス開始前に読み切る（上限を超えた分は一時ファイルへ）
+    
+    StreamingResponse の送信中に receive() を呼ぶと、切断監視の receive() と競合して
+    ボディのチャンクを取りこぼすことがあるため、送信開始前に受信を終える。
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=BATCH_BODY_MEMORY_LIMIT)
+    try:
+        async for chunk in request.stream():
+            body.write(chunk)
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return body
+
+def _iter_body_lines(body) -> Iterator[str]:
+    """退避したボディを行単位で読み出す（StreamingResponseのワーカースレッドから呼ぶ）"""
+    # バイト列の改行でのみ分割（splitlines() は JSON文字列中の U+2028 等で分割するため使わない）
+    for line in body:
+        yield line.decode("utf-8", errors="replace")
+
+@app.post("/api/templates/{template_id}/render/batch")
+async def render_template_batch(template_id: str,
+                                request: Request,
+                                format: str = "ndjson",
+                                missing: str = "keep",
+                                workers: int = 0) -> StreamingResponse:
+    """テンプレートを一括レンダリング（ボディを受信し終えてから、結果をNDJSONで逐次返す）"""
+    if format not in ROW_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(ROW_FORMATS)}")
+    
+    if template_manager.get_template(template_id) is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    
+    body = await _spool_body(request)
+    try:
+        results = template_manager.render_batch(template_id, read_rows(_iter_body_lines(body), format), missing, workers)
+    except ValueError as e:
+        body.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    if results is None:
+        body.close()
+        raise HTTPException(status_code=404, detail="Template not found")
+    
+    def encode():
+        try:
+            buffer = []
+            for result in results:
+                buffer.append(dumps(result.to_dict()))
+                if len(buffer) >= BATCH_CHUNK_SIZE:
+                    yield "\n".join(buffer) + "\n"
+                    buffer = []
+            if buffer:
+                yield "\n".join(buffer) + "\n"
+        finally:
+            body.close()
+    
+    return StreamingResponse(encode(), media_type="application/x-ndjson")
+
 @app.post("/api/templates/generate")
 async def generate_template(purpose: str, examples: List[str] = [], constraints: List[str] = []) -> Dict[str, Any]:
     """AIでテンプレートを自動生成"""
@@ -455,7 +542,8 @@ async def optimize_context(window_id: str, request: OptimizationRequest) -> Dict
     
     try:
         task = await context_optimizer.optimize_context_window(
-            window, request.goals, request.constraints
+            window, request.goals, request.constraints,
+            tenant=request.tenant, priority=request.priority, timeout=request.timeout
         )
         
         await websocket_manager.broadcast({
@@ -470,6 +558,8 @@ async def optimize_context(window_id: str, request: OptimizationRequest) -> Dict
             "goals": request.goals
         }
         
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         logger.error(f"Context optimization failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -516,6 +606,20 @@ async def get_optimization_task(task_id: str) -> Dict[str, Any]:
         "completed_at": task.completed_at.isoformat() if task.completed_at else None
     }
 
+@app.post("/api/optimization/{task_id}/cancel")
+async def cancel_optimization_task(task_id: str) -> Dict[str, Any]:
+    """待機中・実行中の最適化タスクをキャンセル"""
+    task = context_optimizer.get_optimization_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Optimization task not found")
+    
+    cancelled = await context_optimizer.cancel_optimization_task(task_id)
+    return {
+        "task_id": task_id,
+        "cancelled": cancelled,
+        "status": task.status.value
+    }
+
 # マルチモーダル機能
 @app.post("/api/multimodal")
 async def create_multimodal_context(request: MultimodalContextRequest) -> Dict[str, Any]:
@@ -597,7 +701,12 @@ async def get_stats() -> Dict[str, Any]:
             "avg_elements_per_window": total_elements / max(total_windows, 1)
         },
         "templates": template_stats,
-        "optimization_tasks": len(context_optimizer.optimization_tasks)
+        "optimization_tasks": len(context_optimizer.optimization_tasks),
+        "optimization_queue": {
+            "queued": context_optimizer.scheduler.queued,
+            "running": context_optimizer.scheduler.running
+        },
+        "compression_cache": context_optimizer.compression_store.stats()
     }
 
 # ヘルパー関数
@@ -611,4 +720,4 @@ def find_window_by_id(window_id: str) -> Optional[ContextWindow]:
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=9001)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=get_settings().api_port)
\ No newline at end of file
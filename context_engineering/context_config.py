@@ -0,0 +1,149 @@
+"""
+Settings shared by the CLI, the API server and the MCP server.
+
+Configuration is resolved once per project and cached. Precedence, highest
+first:
+
+    1. process environment
+    2. <project>/.env.local
+    3. <project>/.env
+    4. built-in defaults
+
+Env files are parsed here (KEY=VALUE lines, optional `export`, quotes and
+comments), so python-dotenv is not needed at startup and os.environ is left
+untouched. Placeholder API keys such as `your-api-key-here` count as unset.
+"""
+
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+
+ENV_FILES = (".env.local", ".env")  # highest precedence first
+DATA_DIR_NAME = ".context-engineering"
+PLACEHOLDER_PREFIX = "your-"
+
+_TRUE_VALUES = {"1", "true", "yes", "on"}
+
+
+def parse_env_file(path: Path) -> Dict[str, str]:
+    """Parse a dotenv-style file; missing files yield an empty dict"""
+    try:
+        text = path.read_text(encoding="utf-8")
+    except (FileNotFoundError, IsADirectoryError):
+        return {}
+
+    values: Dict[str, str] = {}
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("export "):
+            line = line[len("export "):].lstrip()
+
+        key, sep, value = line.partition("=")
+        key = key.strip()
+        if not sep or not key:
+            continue
+
+        value = value.strip()
+        if value[:1] in ("'", '"'):
+            quote = value[0]
+            end = value.find(quote, 1)
+            value = value[1:end] if end > 0 else value[1:]
+            if quote == '"':
+                value = value.replace("\\n", "\n")
+        else:
+            comment = value.find(" #")
+            if comment >= 0:
+                value = value[:comment].rstrip()
+        values[key] = value
+    return values
+
+
+def _is_placeholder(value: Optional[str]) -> bool:
+    return not value or value.startswith(PLACEHOLDER_PREFIX)
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Resolved, immutable configuration for one project"""
+    project_path: Path
+    gemini_api_key: Optional[str] = None
+    gemini_api_key_source: Optional[str] = None  # "environment", ".env.local" or ".env"
+    max_concurrency: int = 8
+    api_port: int = 9001
+    debug: bool = False
+    env_files: Tuple[Path, ...] = ()  # env files found, highest precedence first
+    values: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}), repr=False)
+
+    @property
+    def data_dir(self) -> Path:
+        """Per-project data directory (templates, persisted state)"""
+        return self.project_path / DATA_DIR_NAME
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Any merged setting, following the same precedence"""
+        return self.values.get(key, default)
+
+
+def load_settings(project_path: Optional[str] = None,
+                  environ: Optional[Mapping[str, str]] = None) -> Settings:
+    """Resolve settings for a project (no caching; see get_settings)"""
+    environ = os.environ if environ is None else environ
+    project = Path(project_path or environ.get("PROJECT_PATH") or os.getcwd()).resolve()
+
+    # Each env file is read once; layers are ordered highest precedence first
+    layers = [("environment", environ)]
+    found = []
+    for name in ENV_FILES:
+        path = project / name
+        if path.is_file():
+            found.append(path)
+            layers.append((name, parse_env_file(path)))
+
+    merged: Dict[str, str] = {}
+    for _, layer in reversed(layers):
+        merged.update(layer)
+
+    # A placeholder key in a higher-precedence layer must not hide a real one below it
+    api_key, api_key_source = None, None
+    for source, layer in layers:
+        value = layer.get("GEMINI_API_KEY")
+        if not _is_placeholder(value):
+            api_key, api_key_source = value, source
+            break
+
+    return Settings(
+        project_path=project,
+        gemini_api_key=api_key,
+        gemini_api_key_source=api_key_source,
+        max_concurrency=int(merged.get("MCP_MAX_CONCURRENCY") or 8),
+        api_port=int(merged.get("CONTEXT_API_PORT") or 9001),
+        debug=merged.get("DEBUG", "").lower() in _TRUE_VALUES,
+        env_files=tuple(found),
+        values=MappingProxyType(merged)
+    )
+
+
+_cache: Dict[Path, Settings] = {}
+_active: Optional[Settings] = None
+_cache_lock = threading.Lock()
+
+
+def get_settings(project_path: Optional[str] = None, reload: bool = False) -> Settings:
+    """Cached settings; without a project path, the active (last requested) project"""
+    global _active
+    with _cache_lock:
+        if project_path is None and _active is not None and not reload:
+            return _active
+
+        key = Path(project_path or os.environ.get("PROJECT_PATH") or os.getcwd()).resolve()
+        settings = None if reload else _cache.get(key)
+        if settings is None:
+            settings = load_settings(str(key))
+            _cache[key] = settings
+        _active = settings
+        return settings
@@ -0,0 +1,39 @@
+"""
+Lazily constructed Gemini models.
+
+google.generativeai takes a large share of startup time, so it is imported,
+configured and the model built on the first call that actually talks to
+Gemini rather than when an engine is constructed.
+"""
+
+import threading
+from typing import Any
+
+DEFAULT_MODEL = "gemini-2.0-flash-exp"
+
+
+class LazyGenerativeModel:
+    """Stand-in for genai.GenerativeModel that is built on first attribute access"""
+
+    def __init__(self, api_key: str, model_name: str = DEFAULT_MODEL):
+        self._api_key = api_key
+        self._model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self._api_key)
+                    self._model = genai.GenerativeModel(self._model_name)
+        return self._model
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not set in __init__ (generate_content, ...)
+        return getattr(self._load(), name)
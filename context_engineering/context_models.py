@@ -1,10 +1,14 @@
-from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Any, Union
+from dataclasses import dataclass, field, replace
+from typing import List, Dict, Optional, Any, Sequence, Set, Tuple, Union
 from enum import Enum
 from datetime import datetime
+import threading
 import uuid
 import json
 
+import content_fingerprint
+from template_engine import MISSING_KEEP, compile_template
+
 class ContextType(Enum):
     SYSTEM = "system"
     USER = "user"
@@ -33,6 +37,7 @@ class OptimizationStatus(Enum):
     IN_PROGRESS = "in_progress"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 @dataclass
 class ContextElement:
@@ -46,12 +51,43 @@ class ContextElement:
     priority: int = 5  # 1-10
     created_at: datetime = field(default_factory=datetime.now)
     updated_at: datetime = field(default_factory=datetime.now)
+    # 圧縮版を保持（content が元の内容のときに切り替え可能な短い形）
+    compressed_content: Optional[str] = None
+    # content が圧縮版のときの元の内容
+    original_content: Optional[str] = None
+    # 重複判定用のハッシュのキャッシュ [内容, ハッシュ, (SimHash, 包含判定キー)]。
+    # 内容が変わると作り直す（replace_element などで差し替えた要素には引き継がれない）
+    _fingerprints: Optional[List[Any]] = field(default=None, init=False, repr=False, compare=False,
+                                               metadata={"serialize": False})
     
     @property
     def token_count(self) -> int:
         """簡易トークン数推定"""
         return len(self.content.split()) * 1.3  # 概算
     
+    def content_hash(self) -> int:
+        """正規化した内容の128ビットハッシュ（内容ごとにキャッシュ）"""
+        cache = self._fingerprint_cache()
+        if cache[1] is None:
+            cache[1] = content_fingerprint.content_hash(content_fingerprint.normalize(self.content))
+        return cache[1]
+    
+    def near_fingerprint(self) -> Tuple[int, Optional[Tuple[int, int]]]:
+        """SimHash と包含判定用の先頭・末尾ハッシュ（内容ごとにキャッシュ）"""
+        cache = self._fingerprint_cache()
+        if cache[2] is None:
+            normalized = content_fingerprint.normalize(self.content)
+            if cache[1] is None:
+                cache[1] = content_fingerprint.content_hash(normalized)
+            cache[2] = (content_fingerprint.simhash(normalized), content_fingerprint.containment_keys(normalized))
+        return cache[2]
+    
+    def _fingerprint_cache(self) -> List[Any]:
+        cache = self._fingerprints
+        if cache is None or cache[0] is not self.content:
+            cache = self._fingerprints = [self.content, None, None]
+        return cache
+    
     def to_dict(self) -> Dict[str, Any]:
         return {
             "id": self.id,
@@ -62,7 +98,9 @@ class ContextElement:
             "tags": self.tags,
             "priority": self.priority,
             "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat()
+            "updated_at": self.updated_at.isoformat(),
+            "compressed_content": self.compressed_content,
+            "original_content": self.original_content
         }
 
 @dataclass
@@ -82,19 +120,25 @@ class PromptTemplate:
     created_at: datetime = field(default_factory=datetime.now)
     updated_at: datetime = field(default_factory=datetime.now)
     
-    def render(self, variables: Dict[str, Any]) -> str:
-        """テンプレートに変数を適用してレンダリング"""
-        rendered = self.template
-        for var, value in variables.items():
-            placeholder = f"{{{var}}}"
-            rendered = rendered.replace(placeholder, str(value))
-        return rendered
+    def render(self, variables: Dict[str, Any], missing: str = MISSING_KEEP) -> str:
+        """テンプレートに変数を適用してレンダリング（コンパイル結果はテンプレート文字列ごとにキャッシュ）"""
+        return compile_template(self.template).render(variables, missing)
     
     def extract_variables(self) -> List[str]:
-        """テンプレートから変数を抽出"""
-        import re
-        variables = re.findall(r'\{(\w+)\}', self.template)
-        return list(set(variables))
+        """テンプレートから変数を抽出（出現順）"""
+        return list(compile_template(self.template).variables)
+
+class SnapshotBase:
+    """スナップショット作成時のウィンドウの状態（commit_snapshot での競合検出用）"""
+    __slots__ = ("version", "elements", "template_id", "quality_metrics", "history_length")
+    
+    def __init__(self, window: "ContextWindow"):
+        self.version = window.version
+        # 要素は差し替えのみで変更されないため、オブジェクトの同一性で変更を検出できる
+        self.elements = tuple(window.elements)
+        self.template_id = window.template_id
+        self.quality_metrics = dict(window.quality_metrics)
+        self.history_length = len(window.optimization_history)
 
 @dataclass
 class ContextWindow:
@@ -107,6 +151,15 @@ class ContextWindow:
     quality_metrics: Dict[str, float] = field(default_factory=dict)
     optimization_history: List[Dict[str, Any]] = field(default_factory=list)
     created_at: datetime = field(default_factory=datetime.now)
+    version: int = 0  # 要素の追加・削除・最適化の反映ごとに加算
+    # 要素リストの変更を保護（バックグラウンド最適化の反映と並行する追加のため）
+    lock: Any = field(default_factory=threading.RLock, init=False, repr=False, compare=False,
+                      metadata={"serialize": False})
+    # スナップショットのみ: 作成時の状態と、重複として削除した要素ID -> 内容を残した要素ID
+    snapshot_base: Optional[SnapshotBase] = field(default=None, init=False, repr=False, compare=False,
+                                                  metadata={"serialize": False})
+    kept_in: Dict[str, str] = field(default_factory=dict, init=False, repr=False, compare=False,
+                                    metadata={"serialize": False})
     
     @property
     def current_tokens(self) -> int:
@@ -125,18 +178,221 @@ class ContextWindow:
     
     def add_element(self, element: ContextElement) -> bool:
         """要素追加（トークン制限チェック付き）"""
-        if self.current_tokens + element.token_count <= self.max_tokens - self.reserved_tokens:
+        with self.lock:
+            if self.current_tokens + element.token_count <= self.max_tokens - self.reserved_tokens:
+                self.elements.append(element)
+                self.version += 1
+                return True
+            return False
+    
+    def append_element(self, element: ContextElement):
+        """要素追加（トークン制限は呼び出し側が lock を保持したまま確認済みであること）"""
+        with self.lock:
             self.elements.append(element)
-            return True
-        return False
+            self.version += 1
     
-    def remove_element(self, element_id: str) -> bool:
-        """要素削除"""
-        for i, element in enumerate(self.elements):
-            if element.id == element_id:
-                del self.elements[i]
-                return True
-        return False
+    def remove_element(self, element_id: str, kept_in: Optional[str] = None) -> bool:
+        """要素削除
+        
+        kept_in: 削除する要素の内容を引き継いだ要素のID（重複の統合時）。
+        """
+        with self.lock:
+            for i, element in enumerate(self.elements):
+                if element.id == element_id:
+                    del self.elements[i]
+                    if kept_in is not None:
+                        self.kept_in[element_id] = kept_in
+                    self.version += 1
+                    return True
+            return False
+    
+    def remove_elements(self, element_ids: Set[str], kept_in: Optional[Dict[str, str]] = None) -> List[ContextElement]:
+        """複数要素を一括削除（要素リストの走査は1回）。削除した要素を返す
+        
+        kept_in: 削除する要素ID -> その内容を残した要素ID（重複除去時）。
+        """
+        with self.lock:
+            removed = [element for element in self.elements if element.id in element_ids]
+            if removed:
+                self.elements = [element for element in self.elements if element.id not in element_ids]
+                if kept_in:
+                    self.kept_in.update((element.id, kept_in[element.id]) for element in removed
+                                        if element.id in kept_in)
+                self.version += 1
+            return removed
+    
+    def snapshot(self) -> "ContextWindow":
+        """バックグラウンド処理用のスナップショット（コピーオンライト）
+        
+        要素リストのみ複製し、要素オブジェクトは共有する。スナップショット上で
+        要素を書き換える場合は replace_element で差し替えること（元の要素は変更しない）。
+        """
+        with self.lock:
+            snapshot = ContextWindow(
+                id=self.id,
+                elements=list(self.elements),
+                max_tokens=self.max_tokens,
+                reserved_tokens=self.reserved_tokens,
+                template_id=self.template_id,
+                quality_metrics=dict(self.quality_metrics),
+                optimization_history=list(self.optimization_history),
+                created_at=self.created_at,
+                version=self.version
+            )
+            snapshot.snapshot_base = SnapshotBase(self)
+            return snapshot
+    
+    def replace_element(self, index: int, **changes: Any) -> ContextElement:
+        """index の要素を変更済みのコピーに差し替える（元の要素オブジェクトは共有されうるため変更しない）"""
+        replacement = replace(self.elements[index], updated_at=datetime.now(), **changes)
+        self.elements[index] = replacement
+        return replacement
+    
+    def use_compressed(self, index: int, compressed_content: Optional[str] = None) -> ContextElement:
+        """index の要素を圧縮版に切り替える（元の内容は original_content に保持）
+        
+        compressed_content を省略した場合は要素が保持している圧縮版を使う。
+        """
+        element = self.elements[index]
+        return self.replace_element(
+            index,
+            content=compressed_content if compressed_content is not None else element.compressed_content,
+            original_content=element.original_content if element.original_content is not None else element.content,
+            compressed_content=None
+        )
+    
+    def restore_original(self, element_id: str) -> bool:
+        """圧縮済みの要素を元の内容に戻す（圧縮版は compressed_content に残す）"""
+        with self.lock:
+            for index, element in enumerate(self.elements):
+                if element.id == element_id:
+                    if element.original_content is None:
+                        return False
+                    self.replace_element(
+                        index,
+                        content=element.original_content,
+                        compressed_content=element.content,
+                        original_content=None
+                    )
+                    self.version += 1
+                    return True
+            return False
+    
+    def commit_snapshot(self, snapshot: "ContextWindow") -> Dict[str, Any]:
+        """スナップショット上の変更を楽観的に反映
+        
+        スナップショット作成時から変更がなければそのまま差し替える。並行して変更されていた
+        場合はリベースする:
+        - その間に追加された要素は末尾に残し、削除された要素は結果からも除く
+        - その間に差し替えられた要素（圧縮版への切り替え、元に戻す操作、他の最適化の反映など）は
+          ウィンドウ側の版を残す。スナップショット側でも変更・削除していた場合は競合として数える
+        - 重複として削除した要素は、内容を残した要素が並行して削除された（または競合で
+          スナップショット側の変更が捨てられた）場合、最初の1つを元の位置に戻す
+        ウィンドウ単位のフィールドはスナップショット側で変更されたものだけ反映する。
+        """
+        base = snapshot.snapshot_base
+        if base is None:
+            raise ValueError("commit_snapshot requires a window created by snapshot()")
+        
+        with self.lock:
+            rebased = self.version != base.version
+            appended: List[ContextElement] = []
+            removed: Set[str] = set()
+            conflicts: List[str] = []
+            restored: List[str] = []
+            if not rebased:
+                elements = snapshot.elements
+            else:
+                base_elements = {element.id: element for element in base.elements}
+                live = {element.id: element for element in self.elements}
+                for element in self.elements:
+                    if element.id not in base_elements:
+                        appended.append(element)
+                removed = base_elements.keys() - live.keys()
+                
+                elements = []
+                discarded: Set[str] = set()  # スナップショット側の変更を採用しなかった要素
+                for element in snapshot.elements:
+                    current = live.get(element.id)
+                    original = base_elements.get(element.id)
+                    if current is None:
+                        if original is None:
+                            elements.append(element)  # スナップショット側で追加された要素
+                        continue
+                    if current is original:
+                        elements.append(element)
+                        continue
+                    # ウィンドウ側で差し替えられた要素はその版を残す
+                    if element is not original:
+                        conflicts.append(element.id)
+                        discarded.add(element.id)
+                    elements.append(current)
+                
+                # スナップショット側で削除したが、ウィンドウ側で差し替えられていた要素は残す
+                kept = {element.id for element in elements}
+                reinstate = []
+                for element_id, original in base_elements.items():
+                    current = live.get(element_id)
+                    if element_id in kept or current is None:
+                        continue
+                    if current is not original:
+                        conflicts.append(element_id)
+                        reinstate.append(current)
+                kept.update(element.id for element in reinstate)
+                
+                # 内容を残した要素が並行して失われた重複は、グループごとに最初の1つを戻す
+                replacement: Dict[str, str] = {}
+                for element in base.elements:
+                    survivor = snapshot.kept_in.get(element.id)
+                    if survivor is None or element.id in kept or element.id not in live:
+                        continue
+                    survivor = replacement.get(survivor, survivor)
+                    if survivor not in discarded and (survivor in live or survivor not in base_elements):
+                        continue
+                    replacement[snapshot.kept_in[element.id]] = element.id
+                    reinstate.append(live[element.id])
+                    restored.append(element.id)
+                    kept.add(element.id)
+                
+                if reinstate:
+                    elements = self._reinsert(elements, reinstate, base.elements)
+            
+            self.elements = elements + appended if appended else elements
+            if snapshot.template_id != base.template_id:
+                self.template_id = snapshot.template_id
+            if snapshot.quality_metrics != base.quality_metrics:
+                self.quality_metrics = snapshot.quality_metrics
+            if len(snapshot.optimization_history) > base.history_length:
+                self.optimization_history = (self.optimization_history
+                                             + snapshot.optimization_history[base.history_length:])
+            self.version += 1
+            return {
+                "rebased": rebased,
+                "concurrent_appends": len(appended),
+                "concurrent_removals": len(removed),
+                "conflicts": len(conflicts),
+                "restored_duplicates": len(restored)
+            }
+    
+    @staticmethod
+    def _reinsert(elements: List[ContextElement],
+                  reinstate: List[ContextElement],
+                  base_order: Sequence[ContextElement]) -> List[ContextElement]:
+        """reinstate の要素を、スナップショット作成時の順序で直前にあった要素の後ろに戻す"""
+        pending = {element.id: element for element in reinstate}
+        after: Dict[Optional[str], List[ContextElement]] = {}
+        present = {element.id for element in elements}
+        previous: Optional[str] = None
+        for element in base_order:
+            if element.id in pending:
+                after.setdefault(previous, []).append(pending[element.id])
+            elif element.id in present:
+                previous = element.id
+        result = list(after.get(None, []))
+        for element in elements:
+            result.append(element)
+            result.extend(after.get(element.id, ()))
+        return result
     
     def optimize_for_tokens(self) -> Dict[str, Any]:
         """トークン制限に合わせた最適化"""
@@ -146,20 +402,37 @@ class ContextWindow:
             "tokens_saved": 0
         }
         
-        if self.current_tokens <= self.max_tokens - self.reserved_tokens:
+        with self.lock:
+            limit = self.max_tokens - self.reserved_tokens
+            current_tokens = self.current_tokens
+            if current_tokens <= limit:
+                return optimization_result
+            original_tokens = current_tokens
+            
+            # 圧縮版を持つ要素は削除せずに圧縮版へ切り替え（優先度の低い要素から）
+            compressible = sorted(
+                (index for index, element in enumerate(self.elements) if element.compressed_content is not None),
+                key=lambda index: self.elements[index].priority
+            )
+            for index in compressible:
+                if current_tokens <= limit:
+                    break
+                before = self.elements[index].token_count
+                compressed = self.use_compressed(index)
+                current_tokens += compressed.token_count - before
+                optimization_result["compressed_elements"].append(compressed.id)
+            
+            # 優先度の低い要素から削除
+            sorted_elements = sorted(self.elements, key=lambda x: x.priority)
+            
+            while self.current_tokens > limit and self.elements:
+                removed = sorted_elements.pop(0)
+                self.elements.remove(removed)
+                optimization_result["removed_elements"].append(removed.id)
+            
+            self.version += 1
+            optimization_result["tokens_saved"] = original_tokens - self.current_tokens
             return optimization_result
-        
-        # 優先度の低い要素から削除
-        sorted_elements = sorted(self.elements, key=lambda x: x.priority)
-        original_tokens = self.current_tokens
-        
-        while self.current_tokens > self.max_tokens - self.reserved_tokens and self.elements:
-            removed = sorted_elements.pop(0)
-            self.elements.remove(removed)
-            optimization_result["removed_elements"].append(removed.id)
-        
-        optimization_result["tokens_saved"] = original_tokens - self.current_tokens
-        return optimization_result
 
 @dataclass
 class ContextAnalysis:
@@ -201,6 +474,21 @@ class OptimizationTask:
     created_at: datetime = field(default_factory=datetime.now)
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "context_id": self.context_id,
+            "optimization_type": self.optimization_type,
+            "parameters": self.parameters,
+            "status": self.status.value,
+            "progress": self.progress,
+            "result": self.result,
+            "error_message": self.error_message,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None
+        }
 
 @dataclass
 class ContextSession:
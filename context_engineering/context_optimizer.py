@@ -1,12 +1,23 @@
 import logging
 import json
-import re
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Callable, Dict, List, Any, Optional, Tuple
 from datetime import datetime
-import google.generativeai as genai
 from collections import Counter
 import asyncio
 
+from compression_store import DEFAULT_MAX_ENTRIES, CompressionStore, variant_key
+from content_fingerprint import DEDUPE_EXACT, DEDUPE_NEAR, DEFAULT_SIMHASH_THRESHOLD, DuplicateDetector, normalize
+from context_gemini import LazyGenerativeModel
+from extractive_compression import DEFAULT_COMPRESSION_RATIO, ExtractiveCompressor
+from hierarchical_summary import MapReduceSummarizer
+from optimization_planner import (
+    CLARITY_MIN_LENGTH, COMPRESSION_HYBRID, COMPRESSION_MIN_LENGTH, GOAL_ENHANCE_RELEVANCE,
+    GOAL_IMPROVE_CLARITY, GOAL_IMPROVE_STRUCTURE, GOAL_REDUCE_TOKENS, GOAL_REMOVE_REDUNDANCY,
+    STAGE_CLARITY, STAGE_COMPRESSION, STAGE_DEDUPE, STAGE_EXTRACTIVE_COMPRESSION,
+    STAGE_PRIORITY_REMOVAL, STAGE_RELEVANCE, STAGE_SEMANTIC_MERGE, STAGE_STRUCTURE,
+    OptimizationPlan, WindowFeatures
+)
+from optimization_scheduler import DEFAULT_PRIORITY, DEFAULT_TENANT, OptimizationScheduler
 from context_models import (
     ContextWindow, ContextElement, ContextType, OptimizationTask, 
     OptimizationStatus, ContextAnalysis
@@ -14,19 +25,79 @@ from context_models import (
 
 logger = logging.getLogger(__name__)
 
+# 目標ごとの結果キーと主ステージ（トークン削減は複数ステージの集計）
+GOAL_RESULTS = {
+    GOAL_IMPROVE_CLARITY: ("clarity_improvement", STAGE_CLARITY),
+    GOAL_ENHANCE_RELEVANCE: ("relevance_enhancement", STAGE_RELEVANCE),
+    GOAL_REMOVE_REDUNDANCY: ("redundancy_removal", STAGE_SEMANTIC_MERGE),
+    GOAL_IMPROVE_STRUCTURE: ("structure_improvement", STAGE_STRUCTURE)
+}
+TOKEN_REDUCTION_STAGES = (STAGE_DEDUPE, STAGE_EXTRACTIVE_COMPRESSION, STAGE_PRIORITY_REMOVAL, STAGE_COMPRESSION)
+
 class ContextOptimizer:
     """コンテキスト最適化AI機能"""
     
-    def __init__(self, gemini_api_key: str):
-        genai.configure(api_key=gemini_api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+    def __init__(self,
+                 gemini_api_key: str,
+                 max_workers: int = 4,
+                 max_queued: int = 1000,
+                 task_timeout: Optional[float] = 600.0,
+                 task_ttl: float = 3600.0,
+                 compression_cache_size: int = DEFAULT_MAX_ENTRIES):
+        self.model = LazyGenerativeModel(gemini_api_key)
         self.optimization_tasks: Dict[str, OptimizationTask] = {}
+        # LLM による圧縮結果（内容のハッシュと圧縮率ごと、全タスク・セッションで共有）
+        self.compression_store = CompressionStore(compression_cache_size)
+        # 長いウィンドウの階層要約（チャンク要約も同じストアにキャッシュ）
+        self.summarizer = MapReduceSummarizer(self.model, store=self.compression_store)
+        # 最適化完了時（成功・失敗・キャンセルとも）に呼ばれるコールバック（イベントループ上で実行）
+        self.completion_callbacks: List[Callable[[OptimizationTask, ContextWindow], None]] = []
+        # タスクの状態変化イベント（queued / started / progress / completed / failed / cancelled）の受け取り先
+        # コルーチン関数も可（バックグラウンドで実行）
+        self.event_listeners: List[Callable[[Dict[str, Any]], Any]] = []
+        self._background: set = set()
+        
+        # 同時実行数を制限するジョブスケジューラ（完了タスクはTTL経過後に破棄）
+        self.scheduler = OptimizationScheduler(
+            self.optimization_tasks,
+            execute=self._execute_optimization,
+            on_interrupted=self._notify_completion,
+            emit=self._emit,
+            max_workers=max_workers,
+            max_queued=max_queued,
+            default_timeout=task_timeout,
+            task_ttl=task_ttl
+        )
+        
+        # 最適化パイプラインの各ステージ（window, features, plan を受け取る）
+        self._stage_runners = {
+            STAGE_DEDUPE: lambda window, features, plan: self._remove_duplicates(window, features, plan.constraints),
+            STAGE_STRUCTURE: lambda window, features, plan: self._optimize_for_structure(window),
+            STAGE_PRIORITY_REMOVAL: lambda window, features, plan: self._remove_low_priority_elements(
+                window, plan.target_tokens, plan.constraints.get("preserve_element_types", []), features
+            ),
+            STAGE_EXTRACTIVE_COMPRESSION: lambda window, features, plan: self._compress_content_locally(
+                window, plan.target_tokens, features, plan
+            ),
+            STAGE_COMPRESSION: lambda window, features, plan: self._compress_content(
+                window, plan.target_tokens, features, plan.constraints.get("compression_ratio", DEFAULT_COMPRESSION_RATIO)
+            ),
+            STAGE_RELEVANCE: lambda window, features, plan: self._optimize_for_relevance(window),
+            STAGE_SEMANTIC_MERGE: lambda window, features, plan: self._optimize_for_redundancy_removal(window, features),
+            STAGE_CLARITY: lambda window, features, plan: self._optimize_for_clarity(window, features)
+        }
     
     async def optimize_context_window(self, 
                                     window: ContextWindow, 
                                     optimization_goals: List[str],
-                                    constraints: Dict[str, Any] = None) -> OptimizationTask:
-        """コンテキストウィンドウの包括的最適化"""
+                                    constraints: Dict[str, Any] = None,
+                                    tenant: str = DEFAULT_TENANT,
+                                    priority: int = DEFAULT_PRIORITY,
+                                    timeout: Optional[float] = None) -> OptimizationTask:
+        """コンテキストウィンドウの包括的最適化（スケジューラのキューに登録して即座に返す）
+        
+        キューが満杯の場合は QueueFullError。
+        """
         
         task = OptimizationTask(
             context_id=window.id,
@@ -37,45 +108,75 @@ class ContextOptimizer:
             }
         )
         
-        self.optimization_tasks[task.id] = task
-        
-        # バックグラウンドで最適化を実行
-        asyncio.create_task(self._execute_optimization(task, window))
+        # 空いているワーカーがバックグラウンドで実行
+        self.scheduler.submit(task, window, tenant, priority, timeout)
         
         return task
     
-    async def _execute_optimization(self, task: OptimizationTask, window: ContextWindow):
-        """最適化タスクを実行"""
+    async def cancel_optimization_task(self, task_id: str) -> bool:
+        """待機中・実行中のタスクをキャンセル"""
+        return self.scheduler.cancel(task_id)
+    
+    async def shutdown(self):
+        """スケジューラを停止（未完了タスクはキャンセル）"""
+        await self.scheduler.shutdown()
+    
+    def _emit(self, event: str, task: OptimizationTask):
+        if not self.event_listeners:
+            return
+        message = {
+            "type": f"optimization_{event}",
+            "task_id": task.id,
+            "context_id": task.context_id,
+            "status": task.status.value,
+            "progress": task.progress,
+            "error_message": task.error_message
+        }
+        for listener in self.event_listeners:
+            try:
+                result = listener(message)
+                if asyncio.iscoroutine(result):
+                    background = asyncio.ensure_future(result)
+                    self._background.add(background)
+                    background.add_done_callback(self._background.discard)
+            except Exception as e:
+                logger.error(f"Optimization event listener failed: {str(e)}")
+    
+    def _notify_completion(self, task: OptimizationTask, window: ContextWindow):
+        for callback in self.completion_callbacks:
+            try:
+                callback(task, window)
+            except Exception as e:
+                logger.error(f"Optimization completion callback failed: {str(e)}")
+    
+    async def _execute_optimization(self, task: OptimizationTask, live_window: ContextWindow):
+        """最適化タスクを実行
+        
+        スナップショット上で最適化し、完了時にまとめて反映する（実行中も要素の追加は可能。
+        失敗・キャンセル時はウィンドウを変更しない）。
+        """
         task.status = OptimizationStatus.IN_PROGRESS
         task.started_at = datetime.now()
         
+        window = live_window.snapshot()
+        
         try:
-            result = {}
+            goals = task.parameters["goals"]
+            constraints = task.parameters["constraints"]
             
-            # 目標に応じた最適化を実行
-            for goal in task.parameters["goals"]:
-                if goal == "reduce_tokens":
-                    optimization_result = await self._optimize_for_token_reduction(window, task.parameters["constraints"])
-                    result["token_reduction"] = optimization_result
-                
-                elif goal == "improve_clarity":
-                    optimization_result = await self._optimize_for_clarity(window)
-                    result["clarity_improvement"] = optimization_result
-                
-                elif goal == "enhance_relevance":
-                    optimization_result = await self._optimize_for_relevance(window)
-                    result["relevance_enhancement"] = optimization_result
-                
-                elif goal == "remove_redundancy":
-                    optimization_result = await self._optimize_for_redundancy_removal(window)
-                    result["redundancy_removal"] = optimization_result
-                
-                elif goal == "improve_structure":
-                    optimization_result = await self._optimize_for_structure(window)
-                    result["structure_improvement"] = optimization_result
-                
-                task.progress += 1.0 / len(task.parameters["goals"])
+            # 目標に必要なステージをコスト順に計画し、目標達成済みのステージは飛ばす
+            features = WindowFeatures(window.elements)
+            plan = OptimizationPlan(goals, constraints, window, features)
+            
+            def stage_done():
+                task.progress += 1.0 / len(plan.stages)
+                self._emit("progress", task)
             
+            outcomes, pipeline = await plan.execute(window, features, self._stage_runners, stage_done)
+            result = self._summarize_goals(plan, outcomes, pipeline)
+            result["pipeline"] = pipeline
+            
+            result["commit"] = live_window.commit_snapshot(window)
             task.result = result
             task.status = OptimizationStatus.COMPLETED
             task.completed_at = datetime.now()
@@ -85,49 +186,45 @@ class ContextOptimizer:
             task.error_message = str(e)
             task.completed_at = datetime.now()
             logger.error(f"Optimization task {task.id} failed: {str(e)}")
-    
-    async def _optimize_for_token_reduction(self, 
-                                          window: ContextWindow, 
-                                          constraints: Dict[str, Any]) -> Dict[str, Any]:
-        """トークン削減最適化"""
-        
-        target_reduction = constraints.get("target_token_reduction", 0.2)  # 20%削減がデフォルト
-        min_tokens = constraints.get("min_tokens", 100)
-        preserve_elements = constraints.get("preserve_element_types", [])
-        
-        original_tokens = window.current_tokens
-        target_tokens = max(int(original_tokens * (1 - target_reduction)), min_tokens)
-        
-        optimization_strategies = []
-        
-        # 戦略1: 低優先度要素の削除
-        if window.current_tokens > target_tokens:
-            removal_result = await self._remove_low_priority_elements(window, target_tokens, preserve_elements)
-            optimization_strategies.append(removal_result)
         
-        # 戦略2: 内容の圧縮
-        if window.current_tokens > target_tokens:
-            compression_result = await self._compress_content(window, target_tokens)
-            optimization_strategies.append(compression_result)
-        
-        # 戦略3: 重複除去
-        if window.current_tokens > target_tokens:
-            deduplication_result = await self._remove_duplicates(window)
-            optimization_strategies.append(deduplication_result)
+        self._notify_completion(task, live_window)
+    
+    def _summarize_goals(self,
+                         plan: OptimizationPlan,
+                         outcomes: Dict[str, Dict[str, Any]],
+                         pipeline: Dict[str, Any]) -> Dict[str, Any]:
+        """ステージ結果を目標ごとの結果にまとめる"""
+        skipped = {report["stage"]: report.get("reason") for report in pipeline["stages"]}
+        result = {}
+        
+        for goal in plan.goals:
+            if goal == GOAL_REDUCE_TOKENS:
+                original_tokens = plan.original_tokens
+                final_tokens = pipeline["final_tokens"]
+                result["token_reduction"] = {
+                    "original_tokens": original_tokens,
+                    "final_tokens": final_tokens,
+                    "target_tokens": plan.target_tokens,
+                    "reduction_achieved": (original_tokens - final_tokens) / original_tokens if original_tokens else 0.0,
+                    "target_achieved": final_tokens <= plan.target_tokens,
+                    "strategies_applied": [outcomes[name] for name in TOKEN_REDUCTION_STAGES if name in outcomes]
+                }
+                continue
+            
+            key, stage_name = GOAL_RESULTS[goal]
+            summary = outcomes.get(stage_name) or {"strategy": key, "skipped": skipped.get(stage_name)}
+            if goal == GOAL_REMOVE_REDUNDANCY and STAGE_DEDUPE in outcomes:
+                summary = dict(summary, duplicates=outcomes[STAGE_DEDUPE])
+            result[key] = summary
         
-        return {
-            "original_tokens": original_tokens,
-            "final_tokens": window.current_tokens,
-            "reduction_achieved": (original_tokens - window.current_tokens) / original_tokens,
-            "target_achieved": window.current_tokens <= target_tokens,
-            "strategies_applied": optimization_strategies
-        }
+        return result
     
     async def _remove_low_priority_elements(self, 
                                           window: ContextWindow, 
                                           target_tokens: int,
-                                          preserve_types: List[str]) -> Dict[str, Any]:
-        """低優先度要素の削除"""
+                                          preserve_types: List[str],
+                                          features: WindowFeatures) -> Dict[str, Any]:
+        """低優先度要素の削除（削除対象を先に決め、一括で削除）"""
         
         removed_elements = []
         preserved_types = set(preserve_types)
@@ -139,18 +236,23 @@ class ContextOptimizer:
         ]
         sortable_elements.sort(key=lambda x: x.priority)
         
+        remaining_tokens = features.total_tokens
+        removal_ids = set()
         for element in sortable_elements:
-            if window.current_tokens <= target_tokens:
+            if remaining_tokens <= target_tokens:
                 break
-            
-            if window.remove_element(element.id):
-                removed_elements.append({
-                    "id": element.id,
-                    "type": element.type.value,
-                    "priority": element.priority,
-                    "tokens": element.token_count,
-                    "content_preview": element.content[:100] + "..." if len(element.content) > 100 else element.content
-                })
+            removal_ids.add(element.id)
+            remaining_tokens -= features.token_count(element)
+        
+        for element in window.remove_elements(removal_ids):
+            removed_elements.append({
+                "id": element.id,
+                "type": element.type.value,
+                "priority": element.priority,
+                "tokens": features.token_count(element),
+                "content_preview": element.content[:100] + "..." if len(element.content) > 100 else element.content
+            })
+            features.removed(element)
         
         return {
             "strategy": "low_priority_removal",
@@ -159,42 +261,129 @@ class ContextOptimizer:
             "tokens_saved": sum(elem["tokens"] for elem in removed_elements)
         }
     
-    async def _compress_content(self, window: ContextWindow, target_tokens: int) -> Dict[str, Any]:
-        """内容の圧縮"""
+    def _apply_compression(self,
+                           window: ContextWindow,
+                           index: int,
+                           compressed_content: Optional[str],
+                           features: WindowFeatures,
+                           source: str) -> Dict[str, Any]:
+        """圧縮版に切り替え、記録を返す（元の内容は要素の original_content に残る）
+        
+        compressed_content が None の場合は要素が保持している圧縮版を使う。
+        """
+        element = window.elements[index]
+        original_tokens = features.token_count(element)
+        # 要素はスナップショット元と共有のため、差し替えで変更（element は元の内容のまま）
+        replacement = window.use_compressed(index, compressed_content)
+        features.replaced(replacement)
+        features.compressed.add(replacement.id)
         
+        return {
+            "id": element.id,
+            "source": source,
+            "original_length": len(element.content),
+            "compressed_length": len(replacement.content),
+            "tokens_saved": original_tokens - features.token_count(replacement)
+        }
+    
+    def _needs_compression(self, element: ContextElement, features: WindowFeatures) -> bool:
+        """長いコンテンツのみ。圧縮済み（この実行または以前の最適化）の要素は対象外"""
+        return (len(element.content) > COMPRESSION_MIN_LENGTH
+                and element.original_content is None
+                and element.id not in features.compressed)
+    
+    async def _compress_content_locally(self,
+                                        window: ContextWindow,
+                                        target_tokens: int,
+                                        features: WindowFeatures,
+                                        plan: OptimizationPlan) -> Dict[str, Any]:
+        """抽出型の圧縮（ローカル処理、モデル呼び出しなし）
+        
+        hybrid モードでは目標の圧縮率に届かない要素は変更せず、後続の LLM 圧縮に回す。
+        """
+        
+        compressor = ExtractiveCompressor(plan.constraints.get("compression_ratio", DEFAULT_COMPRESSION_RATIO))
+        require_target = plan.compression_mode == COMPRESSION_HYBRID
         compressed_elements = []
+        deferred = 0
         
-        for element in window.elements[:]:  # コピーを作成して反復
-            if window.current_tokens <= target_tokens:
+        for index, element in enumerate(window.elements):
+            if features.total_tokens <= target_tokens:
                 break
             
-            if len(element.content) > 200:  # 長いコンテンツのみ圧縮
-                compressed_content = await self._compress_single_content(element.content)
-                
+            if not self._needs_compression(element, features):
+                continue
+            if element.compressed_content is not None:
+                # 保持している圧縮版への切り替えはコストなし
+                compressed_elements.append(self._apply_compression(window, index, None, features, "variant"))
+                continue
+            
+            compressed = compressor.compress(element.content)
+            if compressed is None or (require_target and not compressed.met):
+                # 使わない結果の文は以降の要素で重複扱いにしない
+                deferred += 1
+                continue
+            compressor.accept(compressed)
+            compressed_elements.append(self._apply_compression(window, index, compressed.content, features, "extractive"))
+        
+        return {
+            "strategy": "extractive_compression",
+            "compressed_count": len(compressed_elements),
+            "not_compressed_count": deferred,
+            "compressed_elements": compressed_elements,
+            "total_tokens_saved": sum(elem["tokens_saved"] for elem in compressed_elements)
+        }
+    
+    async def _compress_content(self,
+                                window: ContextWindow,
+                                target_tokens: int,
+                                features: WindowFeatures,
+                                ratio: float = DEFAULT_COMPRESSION_RATIO) -> Dict[str, Any]:
+        """内容の圧縮（LLM）
+        
+        要素が保持している圧縮版、共有ストアの圧縮結果の順に再利用し、
+        どちらもない場合のみモデルを呼び出す。
+        """
+        
+        compressed_elements = []
+        model_calls = 0
+        
+        for index, element in enumerate(window.elements):
+            if features.total_tokens <= target_tokens:
+                break
+            
+            if not self._needs_compression(element, features):
+                continue
+            if element.compressed_content is not None:
+                compressed_elements.append(self._apply_compression(window, index, None, features, "variant"))
+                continue
+            
+            key = variant_key(element.content, "llm", ratio)
+            compressed_content = self.compression_store.get(key)
+            source = "cache"
+            if compressed_content is None:
+                compressed_content = await self._compress_single_content(element.content, ratio)
+                model_calls += 1
+                source = "llm"
                 if compressed_content and len(compressed_content) < len(element.content):
-                    original_tokens = element.token_count
-                    element.content = compressed_content
-                    new_tokens = element.token_count
-                    
-                    compressed_elements.append({
-                        "id": element.id,
-                        "original_length": len(element.content),
-                        "compressed_length": len(compressed_content),
-                        "tokens_saved": original_tokens - new_tokens
-                    })
+                    self.compression_store.put(key, compressed_content)
+            
+            if compressed_content and len(compressed_content) < len(element.content):
+                compressed_elements.append(self._apply_compression(window, index, compressed_content, features, source))
         
         return {
             "strategy": "content_compression",
+            "model_calls": model_calls,
             "compressed_count": len(compressed_elements),
             "compressed_elements": compressed_elements,
             "total_tokens_saved": sum(elem["tokens_saved"] for elem in compressed_elements)
         }
     
-    async def _compress_single_content(self, content: str) -> Optional[str]:
+    async def _compress_single_content(self, content: str, ratio: float = DEFAULT_COMPRESSION_RATIO) -> Optional[str]:
         """単一コンテンツの圧縮"""
         try:
             prompt = f"""
-            以下のテキストを要点を保持しながら50%程度に圧縮してください。
+            以下のテキストを要点を保持しながら{ratio:.0%}程度に圧縮してください。
             重要な情報を失わないよう注意してください。
 
             元のテキスト:
@@ -216,45 +405,71 @@ class ContextOptimizer:
             logger.error(f"Content compression failed: {str(e)}")
             return None
     
-    async def _remove_duplicates(self, window: ContextWindow) -> Dict[str, Any]:
-        """重複除去"""
+    async def _remove_duplicates(self,
+                                 window: ContextWindow,
+                                 features: WindowFeatures,
+                                 constraints: Dict[str, Any]) -> Dict[str, Any]:
+        """重複除去（要素ごとのハッシュで判定し、1パスで処理）
+        
+        constraints の dedupe_mode が "near" の場合は SimHash による近似重複
+        （ハミング距離 simhash_threshold 以内）と、先頭・末尾一致による包含も除去する。
+        """
+        
+        mode = constraints.get("dedupe_mode", DEDUPE_EXACT)
+        elements = {element.id: element for element in window.elements}  # 包含判定の確認用
+        detector = DuplicateDetector(
+            mode,
+            constraints.get("simhash_threshold", DEFAULT_SIMHASH_THRESHOLD),
+            text_of=lambda element_id: normalize(elements[element_id].content)
+        )
         
         removed_duplicates = []
-        seen_content = set()
+        duplicates = {}  # 要素ID -> (一致の種類, 残した要素ID, ハミング距離)
         
-        for element in window.elements[:]:  # コピーを作成
-            # 内容の正規化（小文字化、空白除去）
-            normalized_content = re.sub(r'\s+', ' ', element.content.lower().strip())
-            
-            if normalized_content in seen_content:
-                if window.remove_element(element.id):
-                    removed_duplicates.append({
-                        "id": element.id,
-                        "type": element.type.value,
-                        "tokens": element.token_count,
-                        "content_preview": element.content[:100] + "..."
-                    })
+        for element in window.elements:
+            # ハッシュは要素にキャッシュされ、内容が変わらない限り再計算しない
+            if mode == DEDUPE_NEAR:
+                fingerprint, containment = element.near_fingerprint()
+                match = detector.check(element.id, element.content_hash(), fingerprint, containment=containment)
             else:
-                seen_content.add(normalized_content)
+                match = detector.check(element.id, element.content_hash())
+            
+            if match is not None:
+                duplicates[element.id] = match
+        
+        kept_in = {element_id: match[1] for element_id, match in duplicates.items()}
+        for element in window.remove_elements(set(duplicates), kept_in):
+            match_type, duplicate_of, distance = duplicates[element.id]
+            removed_duplicates.append({
+                "id": element.id,
+                "type": element.type.value,
+                "tokens": features.token_count(element),
+                "match": match_type,
+                "duplicate_of": duplicate_of,
+                "distance": distance,
+                "content_preview": element.content[:100] + "..."
+            })
+            features.removed(element)
         
         return {
             "strategy": "duplicate_removal",
+            "mode": mode,
             "removed_count": len(removed_duplicates),
             "removed_duplicates": removed_duplicates,
             "tokens_saved": sum(elem["tokens"] for elem in removed_duplicates)
         }
     
-    async def _optimize_for_clarity(self, window: ContextWindow) -> Dict[str, Any]:
+    async def _optimize_for_clarity(self, window: ContextWindow, features: WindowFeatures) -> Dict[str, Any]:
         """明確性向上最適化"""
         
         improved_elements = []
         
-        for element in window.elements:
-            if len(element.content) > 100:  # 長いコンテンツのみ
+        for index, element in enumerate(window.elements):
+            if len(element.content) > CLARITY_MIN_LENGTH:  # 長いコンテンツのみ
                 improved_content = await self._improve_content_clarity(element.content)
                 
                 if improved_content and improved_content != element.content:
-                    element.content = improved_content
+                    features.replaced(window.replace_element(index, content=improved_content))
                     improved_elements.append({
                         "id": element.id,
                         "type": element.type.value,
@@ -359,7 +574,7 @@ class ContextOptimizer:
             logger.error(f"Relevance scoring failed: {str(e)}")
             return 0.5
     
-    async def _optimize_for_redundancy_removal(self, window: ContextWindow) -> Dict[str, Any]:
+    async def _optimize_for_redundancy_removal(self, window: ContextWindow, features: WindowFeatures) -> Dict[str, Any]:
         """冗長性除去最適化"""
         
         # セマンティックな重複を検出
@@ -376,12 +591,18 @@ class ContextOptimizer:
                 
                 # 他の要素をマージ
                 merged_content = await self._merge_similar_contents([elem.content for elem in duplicate_group])
-                primary_element.content = merged_content
+                primary_index = next(
+                    (index for index, elem in enumerate(window.elements) if elem is primary_element), None
+                )
+                if primary_index is None:
+                    continue
+                features.replaced(window.replace_element(primary_index, content=merged_content))
                 
                 # 他の要素を削除
                 for elem in other_elements:
-                    if window.remove_element(elem.id):
+                    if window.remove_element(elem.id, kept_in=primary_element.id):
                         removed_elements.append(elem.id)
+                        features.removed(elem)
                 
                 merged_elements.append(primary_element.id)
         
@@ -533,6 +754,12 @@ class ContextOptimizer:
     async def auto_optimize_context(self, window: ContextWindow) -> Dict[str, Any]:
         """自動最適化（すべての最適化を適用）"""
         
+        # 先頭10要素の一覧に入らない部分は、ウィンドウ全体の階層要約で補う
+        overview = ""
+        if len(window.elements) > 10:
+            summary = await self.summarizer.summarize(window.elements)
+            overview = f"\n        全体の要約（{summary.chunks}チャンク）:\n        {summary.text}\n"
+        
         analysis_prompt = f"""
         以下のコンテキストを分析し、最適な最適化戦略を提案してください：
 
@@ -542,7 +769,7 @@ class ContextOptimizer:
 
         要素詳細:
         {self._format_elements_for_analysis(window.elements)}
-
+{overview}
         以下の最適化目標から最適なものを選択してください：
         - reduce_tokens: トークン数削減
         - improve_clarity: 明確性向上
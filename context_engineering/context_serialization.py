@@ -0,0 +1,108 @@
+"""
+Fast JSON serialization for API and MCP responses.
+
+orjson is used when it is installed, with the standard library json module
+as a fallback. Model dataclasses are encoded through per-class encoders that
+are compiled once from the dataclass fields, so responses no longer go
+through to_dict() and an extra nested dict copy on every call.
+"""
+
+import dataclasses
+import json
+from datetime import date, datetime
+from enum import Enum
+from operator import attrgetter
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+Encoder = Callable[[Any], Any]
+
+# type -> encoder (filled lazily on first sight of each type)
+_encoders: Dict[type, Encoder] = {}
+
+
+def _compile_dataclass_encoder(cls: type) -> Encoder:
+    """Build an encoder that reads the serializable fields of a dataclass.
+
+    Fields declared with ``field(metadata={"serialize": False})`` are skipped,
+    which keeps caches stored on model instances out of the wire format.
+    """
+    names = tuple(
+        f.name for f in dataclasses.fields(cls)
+        if f.metadata.get("serialize", True)
+    )
+    if not names:
+        return lambda obj: {}
+    if len(names) == 1:
+        name = names[0]
+        return lambda obj: {name: getattr(obj, name)}
+
+    getter = attrgetter(*names)
+    return lambda obj: dict(zip(names, getter(obj)))
+
+
+def _resolve_encoder(cls: type) -> Optional[Encoder]:
+    """Find (and cache) the encoder for a type that json cannot handle natively"""
+    encoder: Optional[Encoder] = None
+
+    if dataclasses.is_dataclass(cls):
+        encoder = _compile_dataclass_encoder(cls)
+    elif issubclass(cls, (datetime, date)):
+        encoder = cls.isoformat
+    elif issubclass(cls, Enum):
+        encoder = attrgetter("value")
+    elif issubclass(cls, (set, frozenset, tuple)):
+        encoder = list
+
+    if encoder is not None:
+        _encoders[cls] = encoder
+    return encoder
+
+
+def _default(obj: Any) -> Any:
+    encoder = _encoders.get(type(obj)) or _resolve_encoder(type(obj))
+    if encoder is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return encoder(obj)
+
+
+def register_encoder(cls: type, encoder: Encoder) -> None:
+    """Register a custom encoder for a type (overrides the compiled default)"""
+    _encoders[cls] = encoder
+
+
+if HAS_ORJSON:
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj: Any, pretty: bool = False) -> bytes:
+        """Serialize to UTF-8 JSON bytes (compact unless pretty=True)"""
+        options = _ORJSON_OPTIONS | orjson.OPT_INDENT_2 if pretty else _ORJSON_OPTIONS
+        return orjson.dumps(obj, default=_default, option=options)
+
+    def dumps(obj: Any, pretty: bool = False) -> str:
+        """Serialize to a JSON string (compact unless pretty=True)"""
+        return dumps_bytes(obj, pretty).decode("utf-8")
+
+    loads = orjson.loads
+
+else:
+    _compact_encoder = json.JSONEncoder(
+        ensure_ascii=False, separators=(",", ":"), default=_default
+    )
+    _pretty_encoder = json.JSONEncoder(ensure_ascii=False, indent=2, default=_default)
+
+    def dumps(obj: Any, pretty: bool = False) -> str:
+        """Serialize to a JSON string (compact unless pretty=True)"""
+        return (_pretty_encoder if pretty else _compact_encoder).encode(obj)
+
+    def dumps_bytes(obj: Any, pretty: bool = False) -> bytes:
+        """Serialize to UTF-8 JSON bytes (compact unless pretty=True)"""
+        return dumps(obj, pretty).encode("utf-8")
+
+    loads = json.loads
@@ -0,0 +1,215 @@
+"""
+Local extractive compression.
+
+Shortens text without a model call by keeping its most central sentences:
+
+1. The text is split into sentences (Western and Japanese sentence
+   punctuation, and line breaks).
+2. Discourse fillers ("Basically, ...", "It is worth noting that ...")
+   are stripped where they are set off from the sentence, "in order to"
+   becomes "to", and sentences repeated earlier in the same text, or kept
+   in an earlier accepted result of the same run (boilerplate), are
+   dropped. A caller that uses a result calls accept() with it; results
+   that are discarded do not hide their sentences from later texts.
+3. The remaining sentences are scored by TF-IDF centrality: the sum of
+   their cosine similarity to every other sentence, computed through an
+   inverted index so only sentences sharing a term are compared.
+4. The best-scoring sentences are kept, in their original order, until the
+   budget (ratio of the original length) is spent. Budgets are counted in
+   characters, like the LLM compressor's reduction check, so text without
+   spaces between words (Japanese) is compressed as well.
+
+Text containing code fences is left alone, since dropping lines would
+break the code. The result is deterministic and cheap, but purely
+extractive; callers that
+need the target ratio can fall back to the LLM compressor when
+CompressionResult.met is False.
+"""
+
+import math
+import re
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+DEFAULT_COMPRESSION_RATIO = 0.5
+MIN_REDUCTION = 0.1          # results that save less than this are not used
+BOILERPLATE_MIN_LENGTH = 20  # shorter sentences are never dropped as repeats
+MAX_RANKED_SENTENCES = 400   # longer texts are ranked in windows of this many sentences
+
+_BOUNDARY = re.compile(r"(?<=[.!?])\s+|(?<=[。！？])\s*|\s*\n\s*")
+_TERM = re.compile(r"\w+")
+_CJK = re.compile(r"[぀-ヿ㐀-鿿]")
+_FILLER_PHRASES = (r"(?:basically|essentially|obviously|simply put|needless to say"
+                   r"|as a matter of fact|at the end of the day)")
+# Only discourse fillers set off from the sentence: at its start before a comma, or between commas
+_FILLER = re.compile(
+    rf"^{_FILLER_PHRASES},\s*|,\s*{_FILLER_PHRASES},(?=\s)"
+    r"|^(?:it is (?:worth noting|important to note)|please note) that\s+"
+    r"|(?:^|(?<=[、,]))(?:基本的に|ちなみに|実際のところ|言うまでもなく|えーと|まあ)[、,]",
+    re.IGNORECASE
+)
+_IN_ORDER_TO = re.compile(r"\bin order to\b", re.IGNORECASE)
+_SPACES = re.compile(r"[ \t]{2,}")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in is it its of on or so that the "
+    "their there this to was we were will with you your".split()
+)
+
+
+class CompressionResult(NamedTuple):
+    content: str
+    original_length: int
+    length: int
+    met: bool  # within the budget for the requested ratio
+    repeat_keys: FrozenSet[str] = frozenset()  # kept sentences that later texts may drop as repeats
+
+
+class _Sentence:
+    __slots__ = ("index", "text", "separator", "length", "key")
+
+    def __init__(self, index: int, text: str, separator: str, key: Optional[str]):
+        self.index = index
+        self.text = text
+        self.separator = separator  # what followed the sentence in the text
+        self.length = len(text) + 1  # with its separator
+        self.key = key  # normalized text, for sentences long enough to count as boilerplate
+
+
+def split_sentences(text: str) -> List[Tuple[str, str]]:
+    """(sentence, separator) pairs; the separator is "\\n" for a line break, " " for other
+    whitespace and "" when none followed (Japanese punctuation)"""
+    sentences = []
+    start = 0
+    for match in _BOUNDARY.finditer(text):
+        sentence = text[start:match.start()].strip()
+        if sentence:
+            gap = match.group()
+            sentences.append((sentence, "\n" if "\n" in gap else " " if gap else ""))
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append((tail, " "))
+    return sentences
+
+
+def strip_fillers(sentence: str) -> str:
+    """Removes discourse fillers and shortens "in order to" to "to" (see _FILLER)"""
+    stripped = _SPACES.sub(" ", _IN_ORDER_TO.sub("to", _FILLER.sub("", sentence))).strip()
+    if stripped != sentence:
+        stripped = stripped[:1].upper() + stripped[1:]
+    return stripped
+
+
+def _terms(sentence: str) -> List[str]:
+    terms = []
+    for word in _TERM.findall(sentence.lower()):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 2 and _CJK.search(word):
+            # Japanese has no spaces between words: use character bigrams
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            terms.append(word)
+    return terms
+
+
+def _centrality(sentences: List[_Sentence]) -> List[float]:
+    """Sum of TF-IDF cosine similarities to the other sentences"""
+    document_frequency: Dict[str, int] = {}
+    counts = []
+    for sentence in sentences:
+        term_counts: Dict[str, int] = {}
+        for term in _terms(sentence.text):
+            term_counts[term] = term_counts.get(term, 0) + 1
+        counts.append(term_counts)
+        for term in term_counts:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+
+    total = len(sentences)
+    postings: Dict[str, List[Tuple[int, float]]] = {}
+    for position, term_counts in enumerate(counts):
+        weights = {
+            term: count * math.log((1 + total) / (1 + document_frequency[term])) + 1e-9
+            for term, count in term_counts.items()
+        }
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        for term, weight in weights.items():
+            postings.setdefault(term, []).append((position, weight / norm))
+
+    scores = [0.0] * total
+    for entries in postings.values():
+        if len(entries) < 2:
+            continue
+        term_total = sum(weight for _, weight in entries)
+        for position, weight in entries:
+            scores[position] += weight * (term_total - weight)
+    return scores
+
+
+class ExtractiveCompressor:
+    """Compresses texts one by one; sentences of accepted results are tracked across calls"""
+
+    def __init__(self, ratio: float = DEFAULT_COMPRESSION_RATIO):
+        if not 0 < ratio < 1:
+            raise ValueError("compression_ratio must be between 0 and 1")
+        self.ratio = ratio
+        self._seen: Set[str] = set()  # normalized sentences kept in accepted results
+
+    def compress(self, text: str) -> Optional[CompressionResult]:
+        """None when the text cannot be shortened by at least MIN_REDUCTION
+
+        Pass a result that is used to accept(), so later texts drop its sentences as repeats.
+        """
+        original_length = len(text)
+        if not text.strip() or "```" in text:
+            return None
+
+        sentences: List[_Sentence] = []
+        repeats: Set[str] = set()
+        for original, separator in split_sentences(text):
+            sentence = strip_fillers(original)
+            if not sentence:
+                continue
+            key = " ".join(sentence.lower().split())
+            if len(key) >= BOILERPLATE_MIN_LENGTH:
+                if key in self._seen or key in repeats:
+                    continue
+                repeats.add(key)
+            else:
+                key = None
+            sentences.append(_Sentence(len(sentences), sentence, separator, key))
+        if not sentences:
+            return None
+
+        budget = max(1, int(original_length * self.ratio))
+        selected = self._select(sentences, budget)
+        if sum(sentence.length for sentence in selected) - 1 > original_length * (1 - MIN_REDUCTION):
+            return None
+
+        pieces = [selected[0].text]
+        for previous, sentence in zip(selected, selected[1:]):
+            pieces.append(previous.separator)
+            pieces.append(sentence.text)
+        content = "".join(pieces)
+        repeat_keys = frozenset(sentence.key for sentence in selected if sentence.key is not None)
+        return CompressionResult(content, original_length, len(content), len(content) <= budget, repeat_keys)
+
+    def accept(self, result: CompressionResult):
+        """Record that result is used: its sentences are dropped from later texts"""
+        self._seen.update(result.repeat_keys)
+
+    def _select(self, sentences: List[_Sentence], budget: int) -> List[_Sentence]:
+        scores: List[float] = []
+        for start in range(0, len(sentences), MAX_RANKED_SENTENCES):
+            scores.extend(_centrality(sentences[start:start + MAX_RANKED_SENTENCES]))
+
+        ranked = sorted(sentences, key=lambda sentence: (-scores[sentence.index], sentence.index))
+        selected = []
+        remaining = budget
+        for sentence in ranked:
+            if sentence.length <= remaining:
+                selected.append(sentence)
+                remaining -= sentence.length
+        if not selected:
+            selected.append(ranked[0])  # keep the most central sentence even if it is too long
+        selected.sort(key=lambda sentence: sentence.index)
+        return selected
@@ -0,0 +1,169 @@
+"""
+Map-reduce summarization of long context windows.
+
+A window that does not fit one prompt is split into chunks of consecutive
+elements, each within a token budget (an element larger than the budget is
+split on word boundaries). Every chunk is summarized on its own; the model
+calls run in parallel, bounded by max_concurrency. The summaries are then
+reduced in groups of fan_in until a single summary is left.
+
+Chunk and group summaries are cached by a hash of their exact input text in
+a CompressionStore. Chunking is greedy from the start of the window, so
+appending elements only changes the last chunk: re-summarizing a grown
+window makes model calls for the new tail (and the reduce groups above it)
+only. The cache is shared by all summarizers unless one is passed in.
+
+A chunk whose summary call fails (or comes back empty) is represented by
+its leading words, and that fallback is not cached.
+"""
+
+import asyncio
+import logging
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+from compression_store import CompressionStore, variant_key
+from context_models import ContextElement
+
+logger = logging.getLogger(__name__)
+
+TOKENS_PER_WORD = 1.3  # same estimate as ContextElement.token_count
+CHUNK_TOKENS = 4000
+FAN_IN = 8
+MAX_CONCURRENCY = 4
+FALLBACK_WORDS = 200  # words kept from a chunk whose summary failed
+
+MAP_PROMPT = """
+以下はコンテキストの一部です。話題、重要な事実、指示、未解決の点を漏らさず、
+元の順序を保って簡潔に要約してください。
+
+{text}
+
+要約:
+"""
+
+REDUCE_PROMPT = """
+以下はコンテキストを前から順に区切って要約したものです。
+全体として重要な話題、事実、指示、未解決の点を保ち、1つの要約に統合してください。
+
+{text}
+
+統合された要約:
+"""
+
+_shared_store = CompressionStore()
+
+
+class Summary(NamedTuple):
+    text: str
+    chunks: int
+    levels: int         # reduce levels above the chunk summaries
+    model_calls: int
+    cache_hits: int
+
+
+def format_element(element: ContextElement) -> str:
+    return f"[{element.type.value}] {element.content}"
+
+
+def chunk_elements(elements: Sequence[ContextElement], budget_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """Chunk texts of consecutive elements, each within budget_tokens"""
+    budget_words = max(1, int(budget_tokens / TOKENS_PER_WORD))
+    chunks: List[str] = []
+    current: List[str] = []
+    current_words = 0
+
+    for element in elements:
+        text = format_element(element)
+        words = len(text.split())
+        if words > budget_words:
+            # Too large for any chunk: close the current one and split the element
+            if current:
+                chunks.append("\n\n".join(current))
+                current, current_words = [], 0
+            parts = text.split()
+            for start in range(0, len(parts), budget_words):
+                chunks.append(" ".join(parts[start:start + budget_words]))
+            continue
+        if current and current_words + words > budget_words:
+            chunks.append("\n\n".join(current))
+            current, current_words = [], 0
+        current.append(text)
+        current_words += words
+
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class _Run:
+    __slots__ = ("model_calls", "cache_hits")
+
+    def __init__(self):
+        self.model_calls = 0
+        self.cache_hits = 0
+
+
+class MapReduceSummarizer:
+    """Summarizes element sequences of any length with a bounded prompt size"""
+
+    def __init__(self,
+                 model: Any,
+                 chunk_tokens: int = CHUNK_TOKENS,
+                 fan_in: int = FAN_IN,
+                 max_concurrency: int = MAX_CONCURRENCY,
+                 store: Optional[CompressionStore] = None):
+        if fan_in < 2:
+            raise ValueError("fan_in must be at least 2")
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self.fan_in = fan_in
+        self.max_concurrency = max_concurrency
+        self.store = store if store is not None else _shared_store
+
+    async def summarize(self, elements: Sequence[ContextElement]) -> Summary:
+        chunks = chunk_elements(elements, self.chunk_tokens)
+        if not chunks:
+            return Summary("", 0, 0, 0, 0)
+
+        run = _Run()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        summaries = await asyncio.gather(*(
+            self._summarize(MAP_PROMPT, "summary-map", chunk, semaphore, run) for chunk in chunks
+        ))
+
+        levels = 0
+        while len(summaries) > 1:
+            groups = [
+                "\n\n".join(f"({index}) {summary}" for index, summary in enumerate(summaries[start:start + self.fan_in], start + 1))
+                for start in range(0, len(summaries), self.fan_in)
+            ]
+            summaries = await asyncio.gather(*(
+                self._summarize(REDUCE_PROMPT, "summary-reduce", group, semaphore, run) for group in groups
+            ))
+            levels += 1
+
+        return Summary(summaries[0], len(chunks), levels, run.model_calls, run.cache_hits)
+
+    async def _summarize(self, template: str, method: str, text: str,
+                         semaphore: asyncio.Semaphore, run: _Run) -> str:
+        key = variant_key(text, method, 0.0)
+        cached = self.store.get(key)
+        if cached is not None:
+            run.cache_hits += 1
+            return cached
+
+        async with semaphore:
+            run.model_calls += 1
+            try:
+                # generate_content blocks; run it on the default executor so chunks overlap
+                loop = asyncio.get_running_loop()
+                response = await loop.run_in_executor(None, self.model.generate_content, template.format(text=text))
+                summary = response.text.strip()
+            except Exception as e:
+                logger.error(f"Chunk summarization failed: {str(e)}")
+                summary = ""
+
+        if not summary:
+            return " ".join(text.split()[:FALLBACK_WORDS])
+        self.store.put(key, summary)
+        return summary
@@ -0,0 +1,207 @@
+"""
+Incremental analysis of context windows.
+
+A window is analyzed again far more often than it changes substantially:
+the dashboard polls, and most edits append one element. WindowStats keeps
+running aggregates of the last analyzed state of a window (lengths, word
+and token totals, the word multiset behind the redundancy score, type and
+priority distributions), so the local metrics of a new version cost a diff
+instead of a rescan of every element's content.
+
+The diff goes by element id. Elements are replaced, never modified in
+place (see ContextWindow.replace_element), so an element that is the same
+object as last time is unchanged without looking at its content; others are
+compared by content, type, priority and creation time. The tokens of added,
+removed and changed elements accumulate in stale_tokens, which the analyzer
+compares with its refresh threshold before paying for a new semantic
+analysis. Reordering elements does not count as a change.
+
+AnalysisCache holds one WindowStats per window id, least recently used
+first out.
+"""
+
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Optional, Sequence
+
+from context_models import ContextAnalysis, ContextElement, ContextWindow
+
+SEMANTIC_REFRESH_RATIO = 0.1  # share of the window's tokens that must change before semantic re-analysis
+MAX_CACHED_WINDOWS = 1000
+
+_WORD = re.compile(r'\w+')
+
+
+class _ElementStats:
+    __slots__ = ("element", "length", "words", "tokens", "terms")
+
+    def __init__(self, element: ContextElement):
+        self.element = element
+        self.length = len(element.content)
+        self.words = len(element.content.split())
+        self.tokens = element.token_count
+        self.terms = Counter(_WORD.findall(element.content.lower()))
+
+
+def _same(a: ContextElement, b: ContextElement) -> bool:
+    return (a.content == b.content and a.type == b.type
+            and a.priority == b.priority and a.created_at == b.created_at)
+
+
+class WindowStats:
+    """Running aggregates of one window, updated by element diffs"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version: Optional[int] = None  # window version the aggregates reflect
+        self.analysis: Optional[ContextAnalysis] = None  # last full result, for self.version
+        self.semantic: Optional[Dict[str, Any]] = None  # last successful semantic analysis
+        self.stale_tokens = 0  # tokens changed since self.semantic was computed
+        self._entries: Dict[str, _ElementStats] = {}
+        self.total_chars = 0
+        self.total_words = 0
+        self.total_tokens = 0
+        self._terms: Counter = Counter()
+        self._term_total = 0
+        self._types: Counter = Counter()
+        self._priority_sum = 0
+        self._priority_squares = 0
+
+    def sync(self, elements: Sequence[ContextElement], version: int) -> int:
+        """Bring the aggregates to the given elements; returns the tokens changed"""
+        changed = 0
+        seen = set()
+        for element in elements:
+            seen.add(element.id)
+            entry = self._entries.get(element.id)
+            if entry is not None:
+                if entry.element is element or _same(entry.element, element):
+                    entry.element = element
+                    continue
+                self._remove(entry)
+            added = self._add(element)
+            changed += max(added.tokens, entry.tokens) if entry is not None else added.tokens
+
+        if len(seen) != len(self._entries):
+            for element_id in [element_id for element_id in self._entries if element_id not in seen]:
+                entry = self._entries.pop(element_id)
+                self._remove(entry)
+                changed += entry.tokens
+
+        self.version = version
+        self.stale_tokens += changed
+        return changed
+
+    def _add(self, element: ContextElement) -> _ElementStats:
+        entry = self._entries[element.id] = _ElementStats(element)
+        self.total_chars += entry.length
+        self.total_words += entry.words
+        self.total_tokens += entry.tokens
+        self._terms.update(entry.terms)
+        self._term_total += sum(entry.terms.values())
+        self._types[element.type.value] += 1
+        self._priority_sum += element.priority
+        self._priority_squares += element.priority * element.priority
+        return entry
+
+    def _remove(self, entry: _ElementStats):
+        element = entry.element
+        self.total_chars -= entry.length
+        self.total_words -= entry.words
+        self.total_tokens -= entry.tokens
+        for term, count in entry.terms.items():
+            remaining = self._terms[term] - count
+            if remaining > 0:
+                self._terms[term] = remaining
+            else:
+                del self._terms[term]
+        self._term_total -= sum(entry.terms.values())
+        remaining = self._types[element.type.value] - 1
+        if remaining > 0:
+            self._types[element.type.value] = remaining
+        else:
+            del self._types[element.type.value]
+        self._priority_sum -= element.priority
+        self._priority_squares -= element.priority * element.priority
+
+    # --- metrics (same definitions as ContextAnalyzer's full computation) ---
+
+    def basic_metrics(self, window: ContextWindow) -> Dict[str, float]:
+        count = len(self._entries)
+        if not count:
+            return {
+                "total_elements": 0,
+                "total_tokens": 0,
+                "avg_element_length": 0,
+                "token_utilization": 0
+            }
+        lengths = [entry.length for entry in self._entries.values()]
+        return {
+            "total_elements": count,
+            "total_tokens": self.total_tokens,
+            "avg_element_length": self.total_chars / count,
+            "max_element_length": max(lengths),
+            "min_element_length": min(lengths),
+            "token_utilization": self.total_tokens / window.max_tokens,
+            "available_tokens": window.max_tokens - self.total_tokens - window.reserved_tokens
+        }
+
+    def structure_metrics(self) -> Dict[str, float]:
+        count = len(self._entries)
+        if not count:
+            return {}
+        created = [entry.element.created_at for entry in self._entries.values()]
+        time_span = (max(created) - min(created)).total_seconds() if count > 1 else 0
+        variance = (self._priority_squares - self._priority_sum * self._priority_sum / count) / (count - 1) if count > 1 else 0
+        return {
+            "type_diversity": len(self._types) / max(len(self._types), 1),
+            "avg_priority": self._priority_sum / count,
+            "priority_std": math.sqrt(max(variance, 0)),
+            "time_span_hours": time_span / 3600,
+            "system_ratio": self._types.get("system", 0) / count,
+            "user_ratio": self._types.get("user", 0) / count,
+            "assistant_ratio": self._types.get("assistant", 0) / count
+        }
+
+    def redundancy(self) -> float:
+        """Share of words that repeat an earlier word of the window"""
+        if len(self._entries) < 2 or not self._term_total:
+            return 0.0
+        return (self._term_total - len(self._terms)) / self._term_total
+
+    def efficiency_metrics(self) -> Dict[str, float]:
+        if not self._entries:
+            return {}
+        redundancy_score = self.redundancy()
+        return {
+            "chars_per_token": self.total_chars / max(self.total_tokens, 1),
+            "words_per_token": self.total_words / max(self.total_tokens, 1),
+            "information_density": self.total_words / max(self.total_chars, 1),
+            "redundancy_score": redundancy_score,
+            "efficiency_score": 1.0 - redundancy_score
+        }
+
+
+class AnalysisCache:
+    """WindowStats per window id, bounded LRU"""
+
+    def __init__(self, max_windows: int = MAX_CACHED_WINDOWS):
+        self.max_windows = max_windows
+        self._windows: "OrderedDict[str, WindowStats]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def stats_for(self, window_id: str) -> WindowStats:
+        with self._lock:
+            stats = self._windows.get(window_id)
+            if stats is None:
+                stats = self._windows[window_id] = WindowStats()
+                while len(self._windows) > self.max_windows:
+                    self._windows.popitem(last=False)
+            else:
+                self._windows.move_to_end(window_id)
+            return stats
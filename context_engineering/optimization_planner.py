@@ -0,0 +1,257 @@
+"""
+Cost-ordered planning of context optimization stages.
+
+Each optimization goal is served by one or more stages. Instead of running
+the goals in the order they were requested, the planner collects the stages
+they need and runs each stage once, cheapest first: the local stages
+(hash-based dedupe, structure, extractive compression, low-priority
+removal) before any stage that calls the LLM, and LLM stages by their
+estimated number of calls.
+
+Token reduction compresses with the LLM by default. The
+"compression_mode" constraint selects "extractive" (local only) or
+"hybrid" (local first; the LLM only gets the elements the local compressor
+could not bring within the ratio).
+
+Before every stage the goal predicates are checked again. Token reduction
+is met as soon as the window is at or below its target, so the LLM
+compressor never runs when dedupe and low-priority removal were enough.
+Stages with nothing to work on (too few elements, no element long enough)
+are skipped as well.
+
+Word counts are computed once per run in WindowFeatures and kept in sync by
+the stages, so no stage has to rescan the window to know its token count.
+Content hashes and SimHash fingerprints are cached on the elements
+themselves (ContextElement.content_hash / near_fingerprint), so they carry
+over from one run to the next and only new or rewritten elements are
+hashed again.
+"""
+
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from context_models import ContextElement, ContextWindow
+
+TOKENS_PER_WORD = 1.3  # same estimate as ContextElement.token_count
+
+GOAL_REDUCE_TOKENS = "reduce_tokens"
+GOAL_IMPROVE_CLARITY = "improve_clarity"
+GOAL_ENHANCE_RELEVANCE = "enhance_relevance"
+GOAL_REMOVE_REDUNDANCY = "remove_redundancy"
+GOAL_IMPROVE_STRUCTURE = "improve_structure"
+
+STAGE_DEDUPE = "dedupe"
+STAGE_STRUCTURE = "structure"
+STAGE_EXTRACTIVE_COMPRESSION = "extractive_compression"
+STAGE_PRIORITY_REMOVAL = "priority_removal"
+STAGE_COMPRESSION = "compression"
+STAGE_RELEVANCE = "relevance"
+STAGE_SEMANTIC_MERGE = "semantic_merge"
+STAGE_CLARITY = "clarity"
+
+COMPRESSION_LLM = "llm"
+COMPRESSION_EXTRACTIVE = "extractive"
+COMPRESSION_HYBRID = "hybrid"
+COMPRESSION_MODES = (COMPRESSION_LLM, COMPRESSION_EXTRACTIVE, COMPRESSION_HYBRID)
+
+COMPRESSION_MIN_LENGTH = 200  # characters; shorter content is not compressed
+CLARITY_MIN_LENGTH = 100
+
+
+class Stage(NamedTuple):
+    name: str
+    goals: Tuple[str, ...]  # goals this stage works towards
+    uses_llm: bool
+    rank: int  # order among the local stages
+
+
+STAGES = (
+    Stage(STAGE_DEDUPE, (GOAL_REDUCE_TOKENS, GOAL_REMOVE_REDUNDANCY), False, 0),
+    Stage(STAGE_STRUCTURE, (GOAL_IMPROVE_STRUCTURE,), False, 1),
+    Stage(STAGE_EXTRACTIVE_COMPRESSION, (GOAL_REDUCE_TOKENS,), False, 2),
+    Stage(STAGE_PRIORITY_REMOVAL, (GOAL_REDUCE_TOKENS,), False, 3),
+    Stage(STAGE_COMPRESSION, (GOAL_REDUCE_TOKENS,), True, 4),
+    Stage(STAGE_RELEVANCE, (GOAL_ENHANCE_RELEVANCE,), True, 5),
+    Stage(STAGE_SEMANTIC_MERGE, (GOAL_REMOVE_REDUNDANCY,), True, 6),
+    Stage(STAGE_CLARITY, (GOAL_IMPROVE_CLARITY,), True, 7),
+)
+GOALS = (GOAL_REDUCE_TOKENS, GOAL_IMPROVE_CLARITY, GOAL_ENHANCE_RELEVANCE,
+         GOAL_REMOVE_REDUNDANCY, GOAL_IMPROVE_STRUCTURE)
+
+StageRunner = Callable[[ContextWindow, "WindowFeatures", "OptimizationPlan"], Awaitable[Dict[str, Any]]]
+
+
+class WindowFeatures:
+    """Per-element features, computed once per optimization run
+
+    Keyed by element id. Stages that remove or rewrite elements report it
+    through removed() / replaced() so the totals stay exact.
+    """
+
+    def __init__(self, elements: Sequence[ContextElement]):
+        self.words: Dict[str, int] = {}
+        self.total_words = 0
+        self.compressed: Set[str] = set()  # ids compressed in this run (not compressed again)
+        for element in elements:
+            self._add(element)
+
+    @property
+    def total_tokens(self) -> float:
+        return self.total_words * TOKENS_PER_WORD
+
+    def token_count(self, element: ContextElement) -> float:
+        return self.words[element.id] * TOKENS_PER_WORD
+
+    def removed(self, element: ContextElement):
+        self.total_words -= self.words.pop(element.id, 0)
+
+    def replaced(self, element: ContextElement):
+        """The element's content changed (same id)"""
+        self.removed(element)
+        self._add(element)
+
+    def _add(self, element: ContextElement):
+        words = len(element.content.split())
+        self.words[element.id] = words
+        self.total_words += words
+
+
+class OptimizationPlan:
+    """Stages for a set of goals, cheapest first, with the goal predicates"""
+
+    def __init__(self,
+                 goals: Sequence[str],
+                 constraints: Dict[str, Any],
+                 window: ContextWindow,
+                 features: WindowFeatures):
+        self.goals = [goal for goal in GOALS if goal in goals]  # unknown goals are ignored
+        self.constraints = constraints
+        self.original_tokens = features.total_tokens
+        self.target_tokens: Optional[int] = None
+        if GOAL_REDUCE_TOKENS in self.goals:
+            target_reduction = constraints.get("target_token_reduction", 0.2)  # 20%削減がデフォルト
+            min_tokens = constraints.get("min_tokens", 100)
+            self.target_tokens = max(int(self.original_tokens * (1 - target_reduction)), min_tokens)
+
+        self.compression_mode = constraints.get("compression_mode", COMPRESSION_LLM)
+        if self.compression_mode not in COMPRESSION_MODES:
+            raise ValueError(f"Unknown compression mode: {self.compression_mode}")
+        excluded = set()
+        if self.compression_mode == COMPRESSION_LLM:
+            excluded.add(STAGE_EXTRACTIVE_COMPRESSION)
+        elif self.compression_mode == COMPRESSION_EXTRACTIVE:
+            excluded.add(STAGE_COMPRESSION)
+
+        requested = set(self.goals)
+        stages = [stage for stage in STAGES
+                  if requested.intersection(stage.goals) and stage.name not in excluded]
+        # Local stages in their fixed order, then LLM stages by estimated calls
+        stages.sort(key=lambda stage: (stage.uses_llm,
+                                       estimate_llm_calls(stage, window, features) if stage.uses_llm else 0,
+                                       stage.rank))
+        self.stages: List[Stage] = stages
+
+    def goal_met(self, goal: str, features: WindowFeatures) -> bool:
+        """Only token reduction can be met early; the other goals need their stages"""
+        if goal == GOAL_REDUCE_TOKENS:
+            return features.total_tokens <= self.target_tokens
+        return False
+
+    def skip_reason(self, stage: Stage, window: ContextWindow, features: WindowFeatures) -> Optional[str]:
+        if all(self.goal_met(goal, features) for goal in stage.goals if goal in self.goals):
+            return "goal already met"
+        elements = window.elements
+        if stage.name in (STAGE_DEDUPE, STAGE_STRUCTURE, STAGE_SEMANTIC_MERGE) and len(elements) < 2:
+            return "fewer than two elements"
+        if stage.name == STAGE_RELEVANCE and not elements:
+            return "no elements"
+        if stage.name == STAGE_PRIORITY_REMOVAL:
+            preserved = set(self.constraints.get("preserve_element_types", []))
+            if all(element.type.value in preserved for element in elements):
+                return "no removable elements"
+        if (stage.name in (STAGE_COMPRESSION, STAGE_EXTRACTIVE_COMPRESSION)
+                and not _count_compressible(elements, features)):
+            return "no uncompressed element long enough"
+        if stage.name == STAGE_CLARITY and not _count_longer(elements, CLARITY_MIN_LENGTH):
+            return "no element long enough to rewrite"
+        return None
+
+    async def execute(self,
+                      window: ContextWindow,
+                      features: WindowFeatures,
+                      runners: Dict[str, StageRunner],
+                      on_stage: Optional[Callable[[], None]] = None) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+        """Run the planned stages on the window
+
+        Returns (stage results by stage name, pipeline report). The report
+        lists every planned stage with its status, latency, token change and
+        estimated LLM calls; on_stage is called after each stage.
+        """
+        outcomes: Dict[str, Dict[str, Any]] = {}
+        reports = []
+        started = time.perf_counter()
+        for stage in self.stages:
+            report = {
+                "stage": stage.name,
+                "goals": [goal for goal in stage.goals if goal in self.goals],
+                "uses_llm": stage.uses_llm
+            }
+            reason = self.skip_reason(stage, window, features)
+            if reason is not None:
+                report.update(status="skipped", reason=reason, estimated_llm_calls=0, latency_ms=0.0)
+            else:
+                tokens_before = features.total_tokens
+                report["estimated_llm_calls"] = estimate_llm_calls(stage, window, features)
+                stage_started = time.perf_counter()
+                outcomes[stage.name] = await runners[stage.name](window, features, self)
+                report.update(
+                    status="completed",
+                    latency_ms=round((time.perf_counter() - stage_started) * 1000, 3),
+                    tokens_before=tokens_before,
+                    tokens_after=features.total_tokens
+                )
+            reports.append(report)
+            if on_stage is not None:
+                on_stage()
+
+        pipeline = {
+            "stages": reports,
+            "stages_run": sum(1 for report in reports if report["status"] == "completed"),
+            "stages_skipped": sum(1 for report in reports if report["status"] == "skipped"),
+            "estimated_llm_calls": sum(report["estimated_llm_calls"] for report in reports),
+            "total_latency_ms": round((time.perf_counter() - started) * 1000, 3),
+            "original_tokens": self.original_tokens,
+            "final_tokens": features.total_tokens,
+            "target_tokens": self.target_tokens
+        }
+        return outcomes, pipeline
+
+
+def estimate_llm_calls(stage: Stage, window: ContextWindow, features: WindowFeatures) -> int:
+    """Upper bound of model calls the stage makes on the window as it is now"""
+    elements = window.elements
+    count = len(elements)
+    if stage.name == STAGE_COMPRESSION:
+        # Elements holding a compressed variant switch to it without a call
+        return _count_compressible(elements, features, with_variant=False)
+    if stage.name == STAGE_CLARITY:
+        return _count_longer(elements, CLARITY_MIN_LENGTH)
+    if stage.name == STAGE_RELEVANCE:
+        return count + 1 if count else 0  # topics, then one score per element
+    if stage.name == STAGE_SEMANTIC_MERGE:
+        return count * (count - 1) + count // 2  # pairwise similarity, then merges
+    return 0
+
+
+def _count_compressible(elements: Sequence[ContextElement], features: WindowFeatures,
+                        with_variant: bool = True) -> int:
+    """Long elements not compressed yet (in this run or an earlier one)"""
+    return sum(1 for element in elements
+               if len(element.content) > COMPRESSION_MIN_LENGTH
+               and element.original_content is None
+               and element.id not in features.compressed
+               and (with_variant or element.compressed_content is None))
+
+
+def _count_longer(elements: Sequence[ContextElement], length: int) -> int:
+    return sum(1 for element in elements if len(element.content) > length)
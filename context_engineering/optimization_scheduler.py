@@ -0,0 +1,219 @@
+"""
+Job scheduler for context optimization tasks.
+
+Optimization jobs are queued per tenant and run by at most `max_workers`
+worker coroutines on the event loop (started on demand; they exit when the
+queue is empty). Within a tenant, higher priority (1-10, like
+ContextElement.priority) runs first, then submission order; tenants with
+queued jobs are served round robin so one busy tenant cannot starve the rest.
+
+Jobs can be cancelled while queued or running and are failed when they
+exceed their timeout. Finished tasks stay retrievable for `task_ttl`
+seconds (and at most `max_finished` of them are kept), so the task table
+stays bounded. Every state change is reported through `emit`.
+
+All methods must be called on the event loop thread.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from context_models import ContextWindow, OptimizationStatus, OptimizationTask
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+DEFAULT_PRIORITY = 5
+
+class QueueFullError(ValueError):
+    """Raised when submitting while max_queued jobs are already waiting"""
+
+
+class _Job:
+    __slots__ = ("task", "window", "tenant", "timeout", "runner", "cancel_requested")
+
+    def __init__(self, task: OptimizationTask, window: ContextWindow, tenant: str, timeout: Optional[float]):
+        self.task = task
+        self.window = window
+        self.tenant = tenant
+        self.timeout = timeout
+        self.runner: Optional[asyncio.Future] = None
+        self.cancel_requested = False
+
+
+class OptimizationScheduler:
+    """Bounded worker pool with per-tenant priority queues"""
+
+    def __init__(self,
+                 tasks: Dict[str, OptimizationTask],
+                 execute: Callable[[OptimizationTask, ContextWindow], Awaitable[None]],
+                 on_interrupted: Callable[[OptimizationTask, ContextWindow], None],
+                 emit: Callable[[str, OptimizationTask], None],
+                 max_workers: int = 4,
+                 max_queued: int = 1000,
+                 default_timeout: Optional[float] = 600.0,
+                 task_ttl: float = 3600.0,
+                 max_finished: int = 10000):
+        self.tasks = tasks  # shared with the optimizer; finished tasks are evicted from it
+        self.execute = execute
+        self.on_interrupted = on_interrupted
+        self.emit = emit
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.default_timeout = default_timeout
+        self.task_ttl = task_ttl
+        self.max_finished = max_finished
+
+        self._queues: Dict[str, List[Tuple[int, int, _Job]]] = {}  # tenant -> heap
+        self._tenants: Deque[str] = deque()  # tenants with queued jobs, round robin
+        self._jobs: Dict[str, _Job] = {}  # queued or running, by task id
+        self._queued = 0
+        self._sequence = itertools.count()
+        self._finished: Deque[Tuple[float, str]] = deque()  # (finished at, task id)
+        self._workers: Set[asyncio.Task] = set()
+        self._worker_count = 0  # updated synchronously, unlike the task set
+        self._closing = False
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        return len(self._jobs) - self._queued
+
+    def submit(self,
+               task: OptimizationTask,
+               window: ContextWindow,
+               tenant: str = DEFAULT_TENANT,
+               priority: int = DEFAULT_PRIORITY,
+               timeout: Optional[float] = None):
+        """Queue a task; it starts when a worker is free"""
+        if self._queued >= self.max_queued:
+            raise QueueFullError(f"Optimization queue is full ({self.max_queued} jobs waiting)")
+        self._evict()
+
+        job = _Job(task, window, tenant, timeout if timeout is not None else self.default_timeout)
+        queue = self._queues.get(tenant)
+        if queue is None:
+            queue = self._queues[tenant] = []
+            self._tenants.append(tenant)
+        heapq.heappush(queue, (-priority, next(self._sequence), job))
+        self.tasks[task.id] = task
+        self._jobs[task.id] = job
+        self._queued += 1
+        self.emit("queued", task)
+
+        if self._worker_count < self.max_workers:
+            self._worker_count += 1
+            worker = asyncio.ensure_future(self._worker())
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+
+    def cancel(self, task_id: str) -> bool:
+        """Cancel a queued or running task; False if it is unknown or already finished"""
+        job = self._jobs.get(task_id)
+        if job is None or job.cancel_requested:
+            return False
+        if job.runner is None:
+            # Still queued: the heap entry is skipped when a worker reaches it
+            job.cancel_requested = True
+            self._queued -= 1
+            del self._jobs[task_id]
+            self._finish(job, OptimizationStatus.CANCELLED, "Cancelled before start")
+            return True
+        if not job.runner.cancel():
+            return False  # already done; the worker is about to record it
+        job.cancel_requested = True
+        return True
+
+    async def shutdown(self):
+        """Stop the workers; running and queued tasks end up cancelled"""
+        self._closing = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        for job in list(self._jobs.values()):
+            self._finish(job, OptimizationStatus.CANCELLED, "Scheduler shut down")
+        self._jobs.clear()
+        self._queues.clear()
+        self._tenants.clear()
+        self._queued = 0
+
+    # --- workers ---
+
+    def _pop(self) -> _Job:
+        tenant = self._tenants.popleft()
+        queue = self._queues[tenant]
+        _, _, job = heapq.heappop(queue)
+        if queue:
+            self._tenants.append(tenant)
+        else:
+            del self._queues[tenant]
+        return job
+
+    async def _worker(self):
+        try:
+            while self._tenants and not self._closing:
+                job = self._pop()
+                if job.cancel_requested:
+                    continue
+                self._queued -= 1
+                await self._run(job)
+        finally:
+            # No await between the empty-queue check and here, so submit()
+            # never sees a stale count and leaves a job without a worker
+            self._worker_count -= 1
+
+    async def _run(self, job: _Job):
+        job.runner = asyncio.ensure_future(self.execute(job.task, job.window))
+        self.emit("started", job.task)
+        try:
+            await asyncio.wait_for(job.runner, job.timeout)
+        except asyncio.TimeoutError:
+            self._interrupt(job, OptimizationStatus.FAILED, f"Timed out after {job.timeout:g} seconds")
+        except asyncio.CancelledError:
+            if self._closing or not job.cancel_requested:
+                # The worker itself is being shut down
+                self._interrupt(job, OptimizationStatus.CANCELLED, "Scheduler shut down")
+                raise
+            self._interrupt(job, OptimizationStatus.CANCELLED, "Cancelled while running")
+        except Exception as e:
+            self._interrupt(job, OptimizationStatus.FAILED, str(e))
+        else:
+            self._finish(job)
+        finally:
+            self._jobs.pop(job.task.id, None)
+
+    def _interrupt(self, job: _Job, status: OptimizationStatus, message: str):
+        self._finish(job, status, message)
+        # The window may have been partially rewritten; let the owner react
+        try:
+            self.on_interrupted(job.task, job.window)
+        except Exception as e:
+            logger.error(f"Optimization interruption handler failed: {str(e)}")
+
+    def _finish(self, job: _Job, status: Optional[OptimizationStatus] = None, message: Optional[str] = None):
+        task = job.task
+        if status is not None:
+            task.status = status
+            task.error_message = message
+            task.completed_at = datetime.now()
+        self._finished.append((time.monotonic(), task.id))
+        self._evict()
+        self.emit(task.status.value, task)
+
+    def _evict(self):
+        """Drop finished tasks past their TTL or beyond max_finished (oldest first)"""
+        expired_before = time.monotonic() - self.task_ttl
+        finished = self._finished
+        while finished and (finished[0][0] < expired_before or len(finished) > self.max_finished):
+            _, task_id = finished.popleft()
+            self.tasks.pop(task_id, None)
@@ -0,0 +1,155 @@
+"""
+Batch rendering of one prompt template over many variable sets.
+
+Rows (variable dicts) are consumed lazily and rendered in chunks with the
+compiled template, so a batch of any size is processed with memory bounded
+by a few chunks. Rows may come from any iterable of mappings, or from NDJSON
+or CSV lines via read_rows().
+
+With workers > 1 chunks are rendered in a process pool (rendering is CPU
+bound, so threads would not help). At most two chunks per worker are in
+flight and results are still yielded in input order. The pool has a startup
+cost; it only pays off for very large batches or long templates. The pool
+is capped at the CPU count.
+
+A row that cannot be rendered (malformed line, not an object, missing
+variables with missing="error") yields an error result; the batch goes on.
+"""
+
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+from template_engine import MISSING_KEEP, MISSING_POLICIES, MissingVariableError, compile_template
+
+BATCH_CHUNK_SIZE = 500
+ROW_FORMATS = ("ndjson", "csv")
+
+
+class RenderResult(NamedTuple):
+    """Outcome for one row; index is the row's position in the input"""
+    index: int
+    content: Optional[str] = None
+    error: Optional[str] = None
+    missing: Tuple[str, ...] = ()
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self.error is None:
+            return {"index": self.index, "rendered_content": self.content}
+        result = {"index": self.index, "error": self.error}
+        if self.missing:
+            result["missing"] = list(self.missing)
+        return result
+
+
+class InvalidRow:
+    """Placeholder for an input line that could not be parsed"""
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+# --- input formats ---
+
+def read_ndjson(lines: Iterable[str]) -> Iterator[Any]:
+    """One JSON object per line; blank lines are skipped"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield InvalidRow(f"Invalid JSON on line {number}: {e}")
+
+
+def read_csv(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """CSV with a header row naming the variables; values stay strings"""
+    return iter(csv.DictReader(lines))
+
+
+def read_rows(lines: Iterable[str], format: str = "ndjson") -> Iterator[Any]:
+    if format == "ndjson":
+        return read_ndjson(lines)
+    if format == "csv":
+        return read_csv(lines)
+    raise ValueError(f"Unknown row format: {format}")
+
+
+# --- rendering ---
+
+def render_chunk(source: str, missing: str, start: int, rows: List[Any]) -> List[RenderResult]:
+    """Render consecutive rows; module level so a process pool can run it"""
+    compiled = compile_template(source)
+    results = []
+    for index, row in enumerate(rows, start):
+        if isinstance(row, InvalidRow):
+            results.append(RenderResult(index, error=row.error))
+        elif not isinstance(row, Mapping):
+            results.append(RenderResult(index, error="Row is not an object"))
+        else:
+            try:
+                results.append(RenderResult(index, compiled.render(row, missing)))
+            except MissingVariableError as e:
+                results.append(RenderResult(index, error=str(e), missing=tuple(e.missing)))
+    return results
+
+
+class BatchRenderer:
+    """Renders one template over a stream of rows, chunk by chunk"""
+
+    def __init__(self, source: str, missing: str = MISSING_KEEP,
+                 workers: int = 0, chunk_size: int = BATCH_CHUNK_SIZE):
+        if missing not in MISSING_POLICIES:
+            raise ValueError(f"Unknown missing-variable policy: {missing}")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        self.source = source
+        self.missing = missing
+        self.workers = min(workers, os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.rendered = 0
+        self.failed = 0
+        compile_template(source)  # compile once up front (and fail early on bad input)
+
+    def render(self, rows: Iterable[Any]) -> Iterator[RenderResult]:
+        chunks = self._render_parallel(rows) if self.workers > 1 else self._render_serial(rows)
+        for results in chunks:
+            for result in results:
+                if result.error is None:
+                    self.rendered += 1
+                else:
+                    self.failed += 1
+                yield result
+
+    def _chunks(self, rows: Iterable[Any]) -> Iterator[Tuple[int, List[Any]]]:
+        start, chunk = 0, []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                yield start, chunk
+                start, chunk = start + len(chunk), []
+        if chunk:
+            yield start, chunk
+
+    def _render_serial(self, rows: Iterable[Any]) -> Iterator[List[RenderResult]]:
+        for start, chunk in self._chunks(rows):
+            yield render_chunk(self.source, self.missing, start, chunk)
+
+    def _render_parallel(self, rows: Iterable[Any]) -> Iterator[List[RenderResult]]:
+        in_flight = deque()
+        max_in_flight = self.workers * 2
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                for start, chunk in self._chunks(rows):
+                    in_flight.append(pool.submit(render_chunk, self.source, self.missing, start, chunk))
+                    if len(in_flight) >= max_in_flight:
+                        yield in_flight.popleft().result()
+                while in_flight:
+                    yield in_flight.popleft().result()
+            finally:
+                # Abandoned early: don't render chunks nobody will read
+                for future in in_flight:
+                    future.cancel()
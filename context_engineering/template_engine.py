@@ -0,0 +1,157 @@
+"""
+Compiled prompt template rendering.
+
+A template is parsed once into a list of literal segments and variable
+slots. Rendering fills the slots and joins the list, so the cost is linear in
+the output size regardless of how many variables there are, and substituted
+values are never scanned for placeholders again.
+
+Syntax and semantics:
+    {name}      a variable slot (name: letters, digits, underscore)
+    {{name}}    escape: renders the literal text "{name}"
+    any other brace is literal text (JSON, code blocks, ...)
+
+Missing variables are handled according to `missing`:
+    "keep"   leave the placeholder in the output (default, historical behaviour)
+    "empty"  substitute an empty string
+    "error"  raise MissingVariableError
+Values are converted with str(); variables not used by the template are ignored.
+
+word_count() gives the whitespace word count of a rendering (the basis of the
+token estimates in context_models) from per-segment counts, without building
+the rendered string.
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+MISSING_KEEP = "keep"
+MISSING_EMPTY = "empty"
+MISSING_ERROR = "error"
+MISSING_POLICIES = (MISSING_KEEP, MISSING_EMPTY, MISSING_ERROR)
+
+_PLACEHOLDER = re.compile(r"\{\{(\w+)\}\}|\{(\w+)\}")
+
+
+class MissingVariableError(ValueError):
+    """Raised when rendering with missing="error" and variables are absent"""
+
+    def __init__(self, missing: List[str]):
+        super().__init__(f"Missing template variables: {', '.join(missing)}")
+        self.missing = missing
+
+
+def text_stats(text: str) -> Optional[Tuple[int, bool, bool]]:
+    """(word count, starts inside a word, ends inside a word); None for empty text"""
+    if not text:
+        return None
+    return len(text.split()), not text[0].isspace(), not text[-1].isspace()
+
+
+class CompiledTemplate:
+    """Template source compiled to literal segments and variable slots"""
+
+    __slots__ = ("source", "parts", "slots", "variables", "_part_stats")
+
+    def __init__(self, source: str):
+        self.source = source
+        parts: List[str] = []
+        slots: List[Tuple[int, str]] = []
+        literal: List[str] = []
+        position = 0
+
+        for match in _PLACEHOLDER.finditer(source):
+            literal.append(source[position:match.start()])
+            escaped, name = match.groups()
+            if escaped is not None:
+                literal.append("{" + escaped + "}")
+            else:
+                parts.append("".join(literal))
+                literal = []
+                slots.append((len(parts), name))
+                parts.append("{" + name + "}")  # placeholder text, kept when missing
+            position = match.end()
+        literal.append(source[position:])
+        parts.append("".join(literal))
+
+        self.parts = parts
+        self.slots = slots
+        # Unique names in order of first appearance
+        self.variables: Tuple[str, ...] = tuple(dict.fromkeys(name for _, name in slots))
+        self._part_stats: Optional[List[Optional[Tuple[int, bool, bool]]]] = None
+
+    def render(self, variables: Mapping[str, Any], missing: str = MISSING_KEEP) -> str:
+        """Fill the slots and join the segments"""
+        if missing not in MISSING_POLICIES:
+            raise ValueError(f"Unknown missing-variable policy: {missing}")
+        if not self.slots:
+            return self.parts[0]
+
+        parts = self.parts.copy()
+        absent = None
+        for index, name in self.slots:
+            if name in variables:
+                parts[index] = str(variables[name])
+            elif missing == MISSING_EMPTY:
+                parts[index] = ""
+            elif missing == MISSING_ERROR:
+                absent = absent or []
+                if name not in absent:
+                    absent.append(name)
+
+        if absent:
+            raise MissingVariableError(absent)
+        return "".join(parts)
+
+    def word_count(self, variables: Mapping[str, Any], missing: str = MISSING_KEEP,
+                   values: Optional[Mapping[str, str]] = None) -> int:
+        """len(self.render(variables, missing).split()) without rendering
+
+        values optionally overrides the str() of individual variables.
+        """
+        if missing not in MISSING_POLICIES:
+            raise ValueError(f"Unknown missing-variable policy: {missing}")
+        if self._part_stats is None:
+            self._part_stats = [text_stats(part) for part in self.parts]
+
+        stats = self._part_stats.copy()
+        absent = None
+        for index, name in self.slots:
+            if values is not None and name in values:
+                stats[index] = text_stats(values[name])
+            elif name in variables:
+                stats[index] = text_stats(str(variables[name]))
+            elif missing == MISSING_EMPTY:
+                stats[index] = None
+            elif missing == MISSING_ERROR:
+                absent = absent or []
+                if name not in absent:
+                    absent.append(name)
+        if absent:
+            raise MissingVariableError(absent)
+
+        # Adjacent segments that touch without whitespace form a single word
+        total, previous_ends = 0, False
+        for segment in stats:
+            if segment is None:
+                continue
+            words, starts, ends = segment
+            if starts and previous_ends:
+                total -= 1
+            total += words
+            previous_ends = ends
+        return total
+
+    def missing_variables(self, variables: Mapping[str, Any]) -> List[str]:
+        return [name for name in self.variables if name not in variables]
+
+
+@lru_cache(maxsize=1024)
+def compile_template(source: str) -> CompiledTemplate:
+    """Compile a template; cached by source text, so each version compiles once"""
+    return CompiledTemplate(source)
+
+
+def render(source: str, variables: Dict[str, Any], missing: str = MISSING_KEEP) -> str:
+    return compile_template(source).render(variables, missing)
@@ -0,0 +1,239 @@
+"""
+Template extraction from context windows.
+
+Each element is tokenized once with a single precompiled pattern that also
+classifies typed values (URLs, e-mail addresses, dates, numbers). Elements
+of the same type and role are then clustered: elements whose token skeleton
+(typed values abstracted) is identical share a cluster via a dict lookup,
+and the rest are compared with a token-level diff against a bounded number
+of cluster representatives. Within a cluster, representative token positions
+that are not matched in every member, or whose text differs, become variable
+slots; whitespace-separated runs of them form a single slot.
+
+Each cluster contributes its pattern once, in order of first appearance.
+Elements that match nothing are kept as they are, with every distinct typed
+value turned into a slot. The work per element is bounded, so extraction is
+linear in the number of elements.
+"""
+
+import re
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Sequence, Tuple
+
+_TOKEN = re.compile(
+    r"(?P<url>https?://\S+)"
+    r"|(?P<email>\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b)"
+    r"|(?P<date>\b\d{4}-\d{2}-\d{2}\b|\b\d{1,2}/\d{1,2}/\d{4}\b)"
+    r"|(?P<number>\b\d+(?:\.\d+)?\b)"
+    r"|(?P<word>\w+)"
+    r"|(?P<space>\s+)"
+    r"|(?P<symbol>.)",
+    re.DOTALL
+)
+_LITERAL_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+TYPED_KINDS = ("url", "email", "date", "number")
+SIMILARITY_THRESHOLD = 0.6
+MAX_CLUSTERS_PER_GROUP = 8    # representatives compared per (type, role) group
+MAX_ALIGN_TOKENS = 2000       # longer elements are not diffed
+
+Token = Tuple[str, str]  # (kind, text)
+
+
+def tokenize(text: str) -> List[Token]:
+    """Single pass over the text; concatenating the token texts gives it back"""
+    return [(match.lastgroup, match.group()) for match in _TOKEN.finditer(text)]
+
+
+def _skeleton(tokens: Sequence[Token]) -> Tuple[Tuple[int, ...], Tuple[str, ...]]:
+    """(positions, keys) of the non-whitespace tokens
+
+    Whitespace is left out of the alignment (it would make every element
+    look alike and slow the diff down); typed values compare equal
+    regardless of their text.
+    """
+    positions = []
+    keys = []
+    for position, (kind, text) in enumerate(tokens):
+        if kind == "space":
+            continue
+        positions.append(position)
+        keys.append("\0" + kind if kind in TYPED_KINDS else text)
+    return tuple(positions), tuple(keys)
+
+
+def _escape(text: str) -> str:
+    """Keep literal {name} text from being read as a slot"""
+    return _LITERAL_PLACEHOLDER.sub(r"{{\1}}", text)
+
+
+class _Cluster:
+    def __init__(self, tokens: List[Token], positions: Tuple[int, ...], keys: Tuple[str, ...]):
+        self.tokens = tokens
+        self.positions = positions
+        self.matcher = SequenceMatcher(None, autojunk=False)
+        self.matcher.set_seq2(keys)  # seq2 is the side SequenceMatcher indexes
+        self.varies = [False] * len(tokens)
+        self.members = 1
+
+    def absorb(self, tokens: List[Token], positions: Tuple[int, ...], blocks=None):
+        """Mark representative positions that this member does not share"""
+        if blocks is None:  # identical skeleton: positions line up one to one
+            blocks = [(0, 0, len(positions))]
+        matched = [False] * len(self.positions)
+        for member_start, rep_start, size in blocks:
+            for offset in range(size):
+                matched[rep_start + offset] = True
+                position = self.positions[rep_start + offset]
+                if tokens[positions[member_start + offset]][1] != self.tokens[position][1]:
+                    self.varies[position] = True
+        for index, is_matched in enumerate(matched):
+            if not is_matched:
+                self.varies[self.positions[index]] = True
+        self.members += 1
+
+    def match_blocks(self, keys: Tuple[str, ...]):
+        """Matching blocks when similar enough, else None"""
+        matcher = self.matcher
+        matcher.set_seq1(keys)
+        if (matcher.real_quick_ratio() < SIMILARITY_THRESHOLD
+                or matcher.quick_ratio() < SIMILARITY_THRESHOLD
+                or matcher.ratio() < SIMILARITY_THRESHOLD):
+            return None
+        return matcher.get_matching_blocks()
+
+
+class _Builder:
+    """Template text from literal runs (escaped as a whole) and slots"""
+
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.pending: List[str] = []
+
+    def literal(self, text: str):
+        self.pending.append(text)
+
+    def slot(self, name: str):
+        self._flush()
+        self.pieces.append("{" + name + "}")
+
+    def build(self) -> str:
+        self._flush()
+        return "".join(self.pieces)
+
+    def _flush(self):
+        if self.pending:
+            self.pieces.append(_escape("".join(self.pending)))
+            self.pending = []
+
+
+class _SlotNamer:
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+
+    def new(self, base: str) -> str:
+        count = self.counts.get(base, 0) + 1
+        self.counts[base] = count
+        return base if count == 1 else f"{base}_{count}"
+
+
+def extract_template(elements: Sequence[Tuple[str, Optional[str], str]]) -> Tuple[str, List[str], Dict[str, int]]:
+    """Build a template from (type, role, content) triples
+
+    Returns (template text, variables in order, stats).
+    """
+    sections: List[object] = []  # _Cluster or token list, in order of first appearance
+    groups: Dict[Tuple[str, Optional[str]], List[_Cluster]] = {}
+    exact: Dict[Tuple[str, Optional[str], Tuple[str, ...]], _Cluster] = {}
+
+    for element_type, role, content in elements:
+        tokens = tokenize(content)
+        positions, keys = _skeleton(tokens)
+
+        cluster = exact.get((element_type, role, keys))
+        if cluster is not None:
+            cluster.absorb(tokens, positions)
+            continue
+
+        clusters = groups.setdefault((element_type, role), [])
+        absorbed = False
+        if len(keys) <= MAX_ALIGN_TOKENS:
+            for index, cluster in enumerate(clusters):
+                blocks = cluster.match_blocks(keys)
+                if blocks is not None:
+                    cluster.absorb(tokens, positions, blocks)
+                    # Most recently matched first: repeated turns tend to alternate
+                    if index:
+                        clusters.insert(0, clusters.pop(index))
+                    absorbed = True
+                    break
+        if absorbed:
+            continue
+
+        if len(clusters) < MAX_CLUSTERS_PER_GROUP and len(keys) <= MAX_ALIGN_TOKENS:
+            cluster = _Cluster(tokens, positions, keys)
+            clusters.insert(0, cluster)
+            exact[(element_type, role, keys)] = cluster
+            sections.append(cluster)
+        else:
+            sections.append(tokens)
+
+    namer = _SlotNamer()
+    variables: List[str] = []
+    typed_slots: Dict[Tuple[str, str], str] = {}  # (kind, value) -> slot, for unmatched elements
+    parts: List[str] = []
+    stats = {"elements": len(elements), "clusters": 0, "unmatched": 0}
+
+    for section in sections:
+        if isinstance(section, _Cluster) and section.members > 1:
+            stats["clusters"] += 1
+            parts.append(_render_cluster(section, namer, variables))
+            continue
+
+        tokens = section.tokens if isinstance(section, _Cluster) else section
+        stats["unmatched"] += 1
+        builder = _Builder()
+        for kind, text in tokens:
+            if kind in TYPED_KINDS:
+                name = typed_slots.get((kind, text))
+                if name is None:
+                    name = typed_slots[(kind, text)] = namer.new(kind)
+                    variables.append(name)
+                builder.slot(name)
+            else:
+                builder.literal(text)
+        parts.append(builder.build())
+
+    return "\n\n".join(parts), variables, stats
+
+
+def _render_cluster(cluster: _Cluster, namer: _SlotNamer, variables: List[str]) -> str:
+    tokens, varies = cluster.tokens, cluster.varies
+    builder = _Builder()
+    position = 0
+    while position < len(tokens):
+        if not varies[position]:
+            builder.literal(tokens[position][1])
+            position += 1
+            continue
+
+        # Extend the slot over following varying tokens, bridging constant whitespace
+        end = position + 1
+        while end < len(tokens):
+            if varies[end]:
+                end += 1
+            elif tokens[end][0] == "space" and end + 1 < len(tokens) and varies[end + 1]:
+                end += 2
+            else:
+                break
+        run = [kind for kind, _ in tokens[position:end] if kind != "space"]
+        if not run:  # only whitespace differs
+            builder.literal("".join(text for _, text in tokens[position:end]))
+            position = end
+            continue
+        base = run[0] if len(run) == 1 and run[0] in TYPED_KINDS else "value"
+        name = namer.new(base)
+        variables.append(name)
+        builder.slot(name)
+        position = end
+    return builder.build()
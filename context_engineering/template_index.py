@@ -0,0 +1,272 @@
+"""
+In-memory search index for prompt templates.
+
+Keeps an inverted token index over name, description, tags and category
+(weighted 3/2/2/1 like the original substring scoring), postings lists for
+category and tag filters, the (usage_count, quality_score) ranking and the
+aggregates behind get_template_stats, all maintained incrementally, so
+searches, listings and stats never scan or re-sort the whole template set.
+
+Tokens are lowercased words for alphabetic scripts and character bigrams for
+CJK runs (Japanese names have no word boundaries). Search scores documents
+with BM25 over the weighted term frequencies; each query token also matches
+index terms it is a prefix of, at a discount.
+"""
+
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from context_models import PromptTemplate
+
+FIELD_WEIGHTS = (("name", 3.0), ("description", 2.0), ("tags", 2.0), ("category", 1.0))
+PREFIX_DISCOUNT = 0.5
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"  # kana, CJK ideographs
+_TOKEN = re.compile(f"[{_CJK_RANGES}]+|[^\\W{_CJK_RANGES}]+")
+_CJK = re.compile(f"[{_CJK_RANGES}]")
+
+RankKey = Tuple[float, float, int]
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; CJK runs become character bigrams"""
+    tokens = []
+    for run in _TOKEN.findall(text.lower()):
+        if _CJK.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def _field_text(template: PromptTemplate, name: str) -> str:
+    value = getattr(template, name)
+    return " ".join(value) if isinstance(value, list) else value
+
+
+class TemplateIndex:
+    """Inverted index, filter postings and maintained ranking for templates"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[str, float]] = defaultdict(dict)  # term -> id -> weighted tf
+        self._doc_terms: Dict[str, Dict[str, float]] = {}
+        self._doc_length: Dict[str, float] = {}
+        self._total_length = 0.0
+        self._sorted_terms: Optional[List[str]] = None  # rebuilt lazily for prefix lookups
+
+        self._by_category: Dict[str, Set[str]] = defaultdict(set)
+        self._by_tag: Dict[str, Set[str]] = defaultdict(set)
+        self._filters: Dict[str, Tuple[str, List[str], str]] = {}  # id -> (category, tags, type)
+
+        # Aggregates for stats()
+        self._category_counts: Counter = Counter()
+        self._type_counts: Counter = Counter()
+        self._total_usage = 0
+        self._quality_sum = 0.0
+        self._quality_order: List[Tuple[float, int, str]] = []  # templates with quality_score > 0
+
+        self._sequence: Dict[str, int] = {}  # insertion order breaks ranking ties
+        self._next_sequence = 0
+        self._rank_keys: Dict[str, RankKey] = {}
+        self._order: Optional[List[Tuple[RankKey, str]]] = None  # built lazily, then maintained
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def __contains__(self, template_id: str) -> bool:
+        return template_id in self._doc_terms
+
+    # --- maintenance ---
+
+    def add(self, template: PromptTemplate):
+        """Index a template, replacing any previous version"""
+        with self._lock:
+            if template.id in self._doc_terms:
+                self._remove_text(template.id)
+                self._remove_filters(template.id)
+            else:
+                self._sequence[template.id] = self._next_sequence
+                self._next_sequence += 1
+
+            terms: Dict[str, float] = defaultdict(float)
+            for field_name, weight in FIELD_WEIGHTS:
+                for token in tokenize(_field_text(template, field_name)):
+                    terms[token] += weight
+            for term, tf in terms.items():
+                if term not in self._postings:
+                    self._sorted_terms = None
+                self._postings[term][template.id] = tf
+            self._doc_terms[template.id] = terms
+            length = sum(terms.values())
+            self._doc_length[template.id] = length
+            self._total_length += length
+
+            tags = list(template.tags)
+            self._by_category[template.category].add(template.id)
+            for tag in tags:
+                self._by_tag[tag].add(template.id)
+            self._filters[template.id] = (template.category, tags, template.type.value)
+            self._category_counts[template.category] += 1
+            self._type_counts[template.type.value] += 1
+
+            self.update_rank(template)
+
+    def add_many(self, templates: Iterable[PromptTemplate]):
+        for template in templates:
+            self.add(template)
+
+    def remove(self, template_id: str):
+        with self._lock:
+            if template_id not in self._doc_terms:
+                return
+            self._remove_text(template_id)
+            self._remove_filters(template_id)
+            key = self._rank_keys.pop(template_id)
+            if self._order is not None:
+                del self._order[bisect_left(self._order, (key, template_id))]
+            self._update_aggregates(template_id, key, None)
+            del self._sequence[template_id]
+
+    def update_rank(self, template: PromptTemplate):
+        """Re-position a template after usage_count or quality_score changed"""
+        with self._lock:
+            key = (-template.usage_count, -template.quality_score, self._sequence[template.id])
+            old_key = self._rank_keys.get(template.id)
+            if old_key == key:
+                return
+            self._rank_keys[template.id] = key
+            if self._order is not None:
+                if old_key is not None:
+                    del self._order[bisect_left(self._order, (old_key, template.id))]
+                insort(self._order, (key, template.id))
+            self._update_aggregates(template.id, old_key, key)
+
+    def _update_aggregates(self, template_id: str, old_key: Optional[RankKey], new_key: Optional[RankKey]):
+        # Rank keys hold negated usage/quality; None means absent
+        for key, sign in ((old_key, -1), (new_key, 1)):
+            if key is None:
+                continue
+            usage, quality, sequence = -key[0], -key[1], key[2]
+            self._total_usage += sign * usage
+            if quality > 0:
+                self._quality_sum += sign * quality
+                entry = (-quality, sequence, template_id)
+                if sign > 0:
+                    insort(self._quality_order, entry)
+                else:
+                    del self._quality_order[bisect_left(self._quality_order, entry)]
+
+    def _remove_text(self, template_id: str):
+        for term in self._doc_terms.pop(template_id):
+            posting = self._postings[term]
+            del posting[template_id]
+            if not posting:
+                del self._postings[term]
+                self._sorted_terms = None
+        self._total_length -= self._doc_length.pop(template_id)
+
+    def _remove_filters(self, template_id: str):
+        category, tags, type_value = self._filters.pop(template_id)
+        self._discard(self._by_category, category, template_id)
+        for tag in tags:
+            self._discard(self._by_tag, tag, template_id)
+        for counts, key in ((self._category_counts, category), (self._type_counts, type_value)):
+            counts[key] -= 1
+            if not counts[key]:
+                del counts[key]
+
+    @staticmethod
+    def _discard(postings: Dict[str, Set[str]], key: str, template_id: str):
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(template_id)
+            if not ids:
+                del postings[key]
+
+    # --- queries ---
+
+    def stats(self) -> Dict[str, Any]:
+        """Maintained aggregates; cost is independent of the number of templates"""
+        with self._lock:
+            count = len(self._doc_terms)
+            if self._order is None:
+                self.ordered()
+            quality_count = len(self._quality_order)
+            return {
+                "total_templates": count,
+                "categories": dict(self._category_counts),
+                "types": dict(self._type_counts),
+                "total_usage": self._total_usage,
+                "avg_usage_per_template": self._total_usage / count if count else 0,
+                "avg_quality_score": self._quality_sum / quality_count if quality_count else 0,
+                "most_used_id": self._order[0][1] if self._order else None,
+                "highest_quality_id": self._quality_order[0][2] if quality_count else None
+            }
+
+    def ordered(self, category: Optional[str] = None, tags: Optional[List[str]] = None) -> List[str]:
+        """Template ids by (usage_count, quality_score) desc, optionally filtered
+
+        category must match exactly; with tags, a template needs any one of them.
+        """
+        with self._lock:
+            if self._order is None:
+                self._order = sorted((key, template_id) for template_id, key in self._rank_keys.items())
+
+            candidates = None
+            if category:
+                candidates = set(self._by_category.get(category, ()))
+            if tags:
+                tagged = set().union(*(self._by_tag.get(tag, ()) for tag in tags))
+                candidates = tagged if candidates is None else candidates & tagged
+
+            if candidates is None:
+                return [template_id for _, template_id in self._order]
+            # Small result sets are cheaper to sort than to filter the full order
+            if len(candidates) * 8 < len(self._order):
+                return sorted(candidates, key=self._rank_keys.__getitem__)
+            return [template_id for _, template_id in self._order if template_id in candidates]
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """BM25-ranked (template id, score) pairs for a free-text query"""
+        with self._lock:
+            tokens = tokenize(query)
+            if not tokens or not self._doc_terms:
+                return []
+
+            doc_count = len(self._doc_terms)
+            average_length = self._total_length / doc_count or 1.0
+            scores: Dict[str, float] = defaultdict(float)
+
+            for token in dict.fromkeys(tokens):
+                for term, boost in self._expand(token):
+                    posting = self._postings[term]
+                    idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                    for template_id, tf in posting.items():
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_length[template_id] / average_length)
+                        scores[template_id] += boost * idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], self._sequence[item[0]]))
+            return ranked[:limit] if limit else ranked
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        """The exact term plus every indexed term the token is a prefix of"""
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        terms = self._sorted_terms
+        matches = []
+        position = bisect_left(terms, token)
+        while position < len(terms) and terms[position].startswith(token):
+            term = terms[position]
+            matches.append((term, 1.0 if term == token else PREFIX_DISCOUNT))
+            position += 1
+        return matches
@@ -1,48 +1,130 @@
+import atexit
 import logging
 import json
 import re
-from typing import Dict, List, Any, Optional, Tuple
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Tuple
 from datetime import datetime
-import google.generativeai as genai
 from pathlib import Path
 
-from context_models import PromptTemplate, PromptTemplateType, ContextElement, ContextWindow
+from context_gemini import LazyGenerativeModel
+from template_batch import BATCH_CHUNK_SIZE, BatchRenderer, RenderResult
+from template_engine import MISSING_KEEP, compile_template
+from template_extraction import extract_template
+from context_models import PromptTemplate, PromptTemplateType, ContextElement, ContextType, ContextWindow
+from template_index import TemplateIndex
+from template_store import DB_FILE_NAME, TemplateStore
 
 logger = logging.getLogger(__name__)
 
+# apply_template_to_context で容量を超える場合の扱い
+FIT_FAIL = "fail"          # レンダリングせずにエラー
+FIT_TRUNCATE = "truncate"  # 指定した変数を切り詰めて収める
+FIT_MODES = (FIT_FAIL, FIT_TRUNCATE)
+
+TOKENS_PER_WORD = 1.3  # ContextElement.token_count と同じ概算
+
 class TemplateManager:
     """プロンプトテンプレート管理システム"""
     
-    def __init__(self, gemini_api_key: str, storage_path: str = "templates"):
-        genai.configure(api_key=gemini_api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+    def __init__(self,
+                 gemini_api_key: Optional[str] = None,
+                 storage_path: str = "templates",
+                 usage_flush_interval: float = 5.0):
+        # APIキーがなくてもテンプレート管理は利用可能（AI生成・最適化のみ不可）
+        self.model = None
+        if gemini_api_key:
+            self.model = LazyGenerativeModel(gemini_api_key)
         self.storage_path = Path(storage_path)
-        self.storage_path.mkdir(exist_ok=True)
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+        # テンプレートは1つのSQLiteファイルに保存（本文は初回アクセス時に読み込み）
+        self.store = TemplateStore(self.storage_path / DB_FILE_NAME)
         self.templates: Dict[str, PromptTemplate] = {}
+        self.index = TemplateIndex()
+        
+        # 使用回数はメモリ上で集計し、一定間隔（または終了時）にまとめて書き込む
+        self.usage_flush_interval = usage_flush_interval
+        self._usage_lock = threading.Lock()
+        self._dirty_usage: set = set()
+        self._flush_stop = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
+        
         self._load_templates()
         self._initialize_default_templates()
+        atexit.register(self.flush_usage)
     
     def _load_templates(self):
-        """保存されたテンプレートを読み込み"""
-        template_files = self.storage_path.glob("*.json")
-        for file_path in template_files:
+        """保存されたテンプレートを読み込み（メタデータのみ）"""
+        if self.store.get_meta("json_imported_at") is None:
+            self._import_json_templates()
+        for template in self.store.load_all():
+            self.templates[template.id] = template
+        self.index.add_many(self.templates.values())
+    
+    def _import_json_templates(self):
+        """旧形式（templates/<id>.json）からの一回限りのインポート"""
+        templates = []
+        for file_path in self.storage_path.glob("*.json"):
             try:
                 with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    template = self._dict_to_template(data)
-                    self.templates[template.id] = template
+                    templates.append(self._dict_to_template(json.load(f)))
             except Exception as e:
-                logger.error(f"Failed to load template from {file_path}: {str(e)}")
+                logger.error(f"Failed to import template from {file_path}: {str(e)}")
+        
+        # インポートと完了フラグの記録（JSONファイルはそのまま残す）
+        if templates:
+            self.store.save_many(templates)
+            logger.info(f"Imported {len(templates)} templates from {self.storage_path} into {self.store.path.name}")
+        self.store.set_meta("json_imported_at", datetime.now().isoformat())
     
     def _save_template(self, template: PromptTemplate):
-        """テンプレートを保存"""
-        file_path = self.storage_path / f"{template.id}.json"
+        """テンプレートを保存（1トランザクションのアトミック書き込み）"""
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(self._template_to_dict(template), f, ensure_ascii=False, indent=2)
+            self.store.save(template)
         except Exception as e:
             logger.error(f"Failed to save template {template.id}: {str(e)}")
     
+    def _record_usage(self, template: PromptTemplate, count: int = 1):
+        """使用回数をメモリ上で加算（ファイル書き込みはflush_usageでまとめて行う）"""
+        with self._usage_lock:
+            template.usage_count += count
+            template.updated_at = datetime.now()
+            self._dirty_usage.add(template.id)
+            self.index.update_rank(template)
+            if self._flush_thread is None and self.usage_flush_interval > 0:
+                self._flush_thread = threading.Thread(
+                    target=self._flush_loop, name="template-usage-flush", daemon=True
+                )
+                self._flush_thread.start()
+    
+    def _flush_loop(self):
+        while not self._flush_stop.wait(self.usage_flush_interval):
+            self.flush_usage()
+    
+    def flush_usage(self) -> int:
+        """未保存の使用回数をまとめて書き込み、書き込んだテンプレート数を返す"""
+        with self._usage_lock:
+            dirty, self._dirty_usage = self._dirty_usage, set()
+        
+        templates = [self.templates[t] for t in dirty if t in self.templates]
+        if templates:
+            try:
+                self.store.save_usage(templates)
+            except Exception as e:
+                logger.error(f"Failed to save template usage: {str(e)}")
+        return len(templates)
+    
+    def close(self):
+        """バックグラウンド書き込みを停止し、未保存の使用回数を書き込んでストアを閉じる"""
+        self._flush_stop.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+            self._flush_thread = None
+        self.flush_usage()
+        atexit.unregister(self.flush_usage)
+        self.store.close()
+    
     def _template_to_dict(self, template: PromptTemplate) -> Dict[str, Any]:
         """テンプレートを辞書に変換"""
         return {
@@ -144,6 +226,7 @@ class TemplateManager:
         template.updated_at = datetime.now()
         
         self.templates[template.id] = template
+        self.index.add(template)
         self._save_template(template)
         
         logger.info(f"Created template: {template.name} ({template.id})")
@@ -154,49 +237,12 @@ class TemplateManager:
         return self.templates.get(template_id)
     
     def list_templates(self, category: Optional[str] = None, tags: Optional[List[str]] = None) -> List[PromptTemplate]:
-        """テンプレート一覧を取得"""
-        templates = list(self.templates.values())
-        
-        if category:
-            templates = [t for t in templates if t.category == category]
-        
-        if tags:
-            templates = [t for t in templates if any(tag in t.tags for tag in tags)]
-        
-        # 使用回数と品質スコアでソート
-        templates.sort(key=lambda t: (t.usage_count, t.quality_score), reverse=True)
-        return templates
+        """テンプレート一覧を取得（使用回数・品質スコア順はインデックスで維持）"""
+        return [self.templates[template_id] for template_id in self.index.ordered(category, tags)]
     
-    def search_templates(self, query: str) -> List[PromptTemplate]:
-        """テンプレートを検索"""
-        query_lower = query.lower()
-        matching_templates = []
-        
-        for template in self.templates.values():
-            score = 0
-            
-            # 名前での一致
-            if query_lower in template.name.lower():
-                score += 3
-            
-            # 説明での一致
-            if query_lower in template.description.lower():
-                score += 2
-            
-            # タグでの一致
-            if any(query_lower in tag.lower() for tag in template.tags):
-                score += 2
-            
-            # カテゴリでの一致
-            if query_lower in template.category.lower():
-                score += 1
-            
-            if score > 0:
-                matching_templates.append((template, score))
-        
-        # スコア順にソート
-        matching_templates.sort(key=lambda x: x[1], reverse=True)
-        return [template for template, score in matching_templates]
+    def search_templates(self, query: str, limit: Optional[int] = None) -> List[PromptTemplate]:
+        """テンプレートを検索（名前・説明・タグ・カテゴリの転置インデックス、BM25スコア順、前方一致対応）"""
+        return [self.templates[template_id] for template_id, score in self.index.search(query, limit)]
     
     def update_template(self, template_id: str, **updates) -> bool:
         """テンプレートを更新"""
@@ -213,6 +259,7 @@ class TemplateManager:
         if 'template' in updates:
             template.variables = template.extract_variables()
         
+        self.index.add(template)
         self._save_template(template)
         return True
     
@@ -227,32 +274,60 @@ class TemplateManager:
             return False
         
         del self.templates[template_id]
+        self.index.remove(template_id)
         
-        # ファイルも削除
-        file_path = self.storage_path / f"{template_id}.json"
-        if file_path.exists():
-            file_path.unlink()
+        # ストアからも削除
+        self.store.delete(template_id)
         
         return True
     
-    def render_template(self, template_id: str, variables: Dict[str, Any]) -> Optional[str]:
-        """テンプレートをレンダリング"""
+    def render_template(self, template_id: str, variables: Dict[str, Any], missing: str = MISSING_KEEP) -> Optional[str]:
+        """テンプレートをレンダリング（missing: 未指定変数の扱い keep / empty / error）"""
         template = self.get_template(template_id)
         if not template:
             return None
         
-        # 使用回数を増加
-        template.usage_count += 1
-        template.updated_at = datetime.now()
-        self._save_template(template)
+        # 変数不足（missing="error"）の場合は使用回数を増やさない
+        rendered = template.render(variables, missing)
         
-        return template.render(variables)
+        # 使用回数を増加（ファイルへの反映はバッファリング）
+        self._record_usage(template)
+        
+        return rendered
+    
+    def render_batch(self,
+                     template_id: str,
+                     rows: Iterable[Dict[str, Any]],
+                     missing: str = MISSING_KEEP,
+                     workers: int = 0,
+                     chunk_size: int = BATCH_CHUNK_SIZE) -> Optional[Iterator[RenderResult]]:
+        """複数の変数セットで一括レンダリング（rowsは逐次消費、結果も逐次返す）
+        
+        workers > 1 でプロセスプールを使用。使用回数はバッチ単位で成功件数分を一度に加算。
+        """
+        template = self.get_template(template_id)
+        if not template:
+            return None
+        
+        renderer = BatchRenderer(template.template, missing, workers, chunk_size)
+        return self._iter_batch(template, renderer, rows)
+    
+    def _iter_batch(self, template: PromptTemplate, renderer: BatchRenderer,
+                    rows: Iterable[Dict[str, Any]]) -> Iterator[RenderResult]:
+        try:
+            yield from renderer.render(rows)
+        finally:
+            # 途中で打ち切られた場合もレンダリング済みの件数は加算
+            if renderer.rendered:
+                self._record_usage(template, renderer.rendered)
     
     async def generate_template(self, 
                               purpose: str, 
                               examples: List[str] = None,
                               constraints: List[str] = None) -> PromptTemplate:
         """AIでテンプレートを自動生成"""
+        if self.model is None:
+            raise ValueError("GEMINI_API_KEY is required for template generation")
         
         examples_text = ""
         if examples:
@@ -307,6 +382,8 @@ class TemplateManager:
         template = self.get_template(template_id)
         if not template:
             raise ValueError(f"Template {template_id} not found")
+        if self.model is None:
+            raise ValueError("GEMINI_API_KEY is required for template optimization")
         
         prompt = f"""
         以下のプロンプトテンプレートを分析し、改善提案を行ってください:
@@ -347,6 +424,7 @@ class TemplateManager:
             scores = result["current_score"]
             overall_score = sum(scores.values()) / len(scores)
             template.quality_score = overall_score
+            self.index.update_rank(template)
             self._save_template(template)
             
             return result
@@ -356,41 +434,16 @@ class TemplateManager:
             raise
     
     def get_template_stats(self) -> Dict[str, Any]:
-        """テンプレート統計情報を取得"""
+        """テンプレート統計情報を取得（インデックスで増分管理している集計値を返す）"""
         if not self.templates:
             return {}
         
-        templates = list(self.templates.values())
-        
-        # カテゴリ別集計
-        categories = {}
-        for template in templates:
-            if template.category not in categories:
-                categories[template.category] = 0
-            categories[template.category] += 1
-        
-        # タイプ別集計
-        types = {}
-        for template in templates:
-            type_name = template.type.value
-            if type_name not in types:
-                types[type_name] = 0
-            types[type_name] += 1
-        
-        # 使用統計
-        usage_counts = [t.usage_count for t in templates]
-        quality_scores = [t.quality_score for t in templates if t.quality_score > 0]
-        
-        return {
-            "total_templates": len(templates),
-            "categories": categories,
-            "types": types,
-            "total_usage": sum(usage_counts),
-            "avg_usage_per_template": sum(usage_counts) / len(templates) if templates else 0,
-            "avg_quality_score": sum(quality_scores) / len(quality_scores) if quality_scores else 0,
-            "most_used_template": max(templates, key=lambda t: t.usage_count).name if templates else None,
-            "highest_quality_template": max(templates, key=lambda t: t.quality_score).name if quality_scores else None
-        }
+        stats = self.index.stats()
+        most_used_id = stats.pop("most_used_id")
+        highest_quality_id = stats.pop("highest_quality_id")
+        stats["most_used_template"] = self.templates[most_used_id].name if most_used_id else None
+        stats["highest_quality_template"] = self.templates[highest_quality_id].name if highest_quality_id else None
+        return stats
 
 class ContextTemplateIntegrator:
     """コンテキストとテンプレートの統合"""
@@ -401,59 +454,121 @@ class ContextTemplateIntegrator:
     def apply_template_to_context(self, 
                                 context_window: ContextWindow, 
                                 template_id: str, 
-                                variables: Dict[str, Any]) -> ContextWindow:
-        """テンプレートをコンテキストウィンドウに適用"""
-        
-        rendered = self.template_manager.render_template(template_id, variables)
-        if not rendered:
+                                variables: Dict[str, Any],
+                                fit: str = FIT_FAIL,
+                                truncatable: Optional[List[str]] = None) -> ContextWindow:
+        """テンプレートをコンテキストウィンドウに適用
+        
+        レンダリング前にコンパイル済みテンプレートと変数のサイズからトークン数を見積もる。
+        残り容量を超える場合、fit="fail" はレンダリングせずにエラー、
+        fit="truncate" は truncatable の変数を指定順に末尾から切り詰めて収める。
+        """
+        if fit not in FIT_MODES:
+            raise ValueError(f"Unknown fit mode: {fit}")
+        template = self.template_manager.get_template(template_id)
+        if not template:
             raise ValueError(f"Failed to render template {template_id}")
+        compiled = compile_template(template.template)
+        
+        # 見積もりから追加までの間に他の追加が割り込まないようロックを保持
+        with context_window.lock:
+            # ウィンドウの集計はここで一度だけ（追加時に再集計しない）
+            used = context_window.current_tokens
+            limit = context_window.max_tokens - context_window.reserved_tokens
+            applied = dict(variables)
+            truncated: Dict[str, int] = {}
+        
+            words = compiled.word_count(applied)
+            if not self._fits(used, words, limit) and fit == FIT_TRUNCATE:
+                words = self._truncate_to_fit(compiled, applied, truncatable or [], used, limit, truncated)
+            if not self._fits(used, words, limit):
+                raise ValueError(
+                    f"Failed to add template to context window (token limit exceeded: "
+                    f"needs {words * TOKENS_PER_WORD:.0f} tokens, {max(limit - used, 0):.0f} available)"
+                )
+        
+            rendered = self.template_manager.render_template(template_id, applied)
+            if not rendered:
+                raise ValueError(f"Failed to render template {template_id}")
         
-        # 新しいコンテキスト要素を作成
-        template_element = ContextElement(
-            content=rendered,
-            type=ContextType.SYSTEM,
-            role="template",
-            metadata={
+            # 新しいコンテキスト要素を作成
+            metadata = {
                 "template_id": template_id,
-                "variables": variables,
+                "variables": applied,
                 "applied_at": datetime.now().isoformat()
-            },
-            tags=["template", "generated"],
-            priority=8  # テンプレートは高優先度
-        )
-        
-        # コンテキストウィンドウに追加
-        success = context_window.add_element(template_element)
-        if not success:
-            raise ValueError("Failed to add template to context window (token limit exceeded)")
+            }
+            if truncated:
+                metadata["truncated_variables"] = truncated  # 変数名 -> 削除した単語数
+            template_element = ContextElement(
+                content=rendered,
+                type=ContextType.SYSTEM,
+                role="template",
+                metadata=metadata,
+                tags=["template", "generated"],
+                priority=8  # テンプレートは高優先度
+            )
         
-        context_window.template_id = template_id
+            # 見積もりは token_count と一致するため、add_element を通さず直接追加
+            context_window.append_element(template_element)
+            context_window.template_id = template_id
         return context_window
     
+    @staticmethod
+    def _fits(used: float, words: int, limit: int) -> bool:
+        # ContextWindow.add_element と同じ判定
+        return used + words * TOKENS_PER_WORD <= limit
+    
+    def _truncate_to_fit(self,
+                         compiled,
+                         applied: Dict[str, Any],
+                         truncatable: List[str],
+                         used: float,
+                         limit: int,
+                         truncated: Dict[str, int]) -> int:
+        """truncatable の変数を順に切り詰め、切り詰め後の単語数を返す
+        
+        テンプレート中に複数回現れる変数は、超過分を出現回数で割った単語数だけ削る。
+        """
+        words = compiled.word_count(applied)
+        max_words = max(int((limit - used) / TOKENS_PER_WORD), 0)
+        while self._fits(used, max_words + 1, limit):
+            max_words += 1
+        occurrences = Counter(name for _, name in compiled.slots)
+        
+        for name in truncatable:
+            if self._fits(used, words, limit):
+                break
+            if name not in applied or not occurrences[name]:
+                continue
+            value = str(applied[name])
+            value_words = len(value.split())
+            excess = -(-(words - max_words) // occurrences[name])  # 切り上げ
+            keep = max(value_words - excess, 0)
+            applied[name] = _truncate_words(value, keep)
+            truncated[name] = value_words - keep
+            words = compiled.word_count(applied)
+        return words
+    
     def extract_template_from_context(self, context_window: ContextWindow) -> Optional[PromptTemplate]:
-        """コンテキストウィンドウからテンプレートを抽出"""
+        """コンテキストウィンドウからテンプレートを抽出
+        
+        同じ種類・ロールの要素をトークン単位で整列し、要素間で異なる位置を変数にする
+        （詳細は template_extraction）。
+        """
         if len(context_window.elements) < 2:
             return None
         
-        # 要素の内容を分析してパターンを抽出
-        contents = [elem.content for elem in context_window.elements]
-        
-        # 共通パターンを見つけて変数化
-        # 実装は簡略化
-        template_content = "\n\n".join(contents)
-        
-        # 自動的に変数を検出（数値、固有名詞等を変数化）
-        variables_detected = self._detect_variables(template_content)
-        
-        for var_name, var_values in variables_detected.items():
-            # 最初の値を変数プレースホルダーに置換
-            if var_values:
-                template_content = template_content.replace(var_values[0], f"{{{var_name}}}")
+        template_content, variables, stats = extract_template(
+            [(elem.type.value, elem.role, elem.content) for elem in context_window.elements]
+        )
+        logger.info(f"Extracted template: {len(variables)} variables, "
+                    f"{stats['clusters']} clusters, {stats['unmatched']} unmatched elements")
         
         template = PromptTemplate(
             name="Extracted Template",
             description="コンテキストから抽出されたテンプレート",
             template=template_content,
+            variables=variables,
             type=PromptTemplateType.COMPLETION,
             category="extracted",
             tags=["extracted", "auto_generated"],
@@ -461,29 +576,13 @@ class ContextTemplateIntegrator:
         )
         
         return template
-    
-    def _detect_variables(self, content: str) -> Dict[str, List[str]]:
-        """コンテンツから変数候補を検出"""
-        variables = {}
-        
-        # 数値パターン
-        numbers = re.findall(r'\b\d+(?:\.\d+)?\b', content)
-        if numbers:
-            variables["number"] = numbers
-        
-        # 日付パターン
-        dates = re.findall(r'\b\d{4}-\d{2}-\d{2}\b|\b\d{1,2}/\d{1,2}/\d{4}\b', content)
-        if dates:
-            variables["date"] = dates
-        
-        # メールアドレス
-        emails = re.findall(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', content)
-        if emails:
-            variables["email"] = emails
-        
-        # URL
-        urls = re.findall(r'https?://[^\s]+', content)
-        if urls:
-            variables["url"] = urls
-        
-        return variables
\ No newline at end of file
+
+
+def _truncate_words(text: str, keep: int) -> str:
+    """先頭から keep 単語までを残す（元の空白・改行は保持）"""
+    if keep <= 0:
+        return ""
+    for count, match in enumerate(re.finditer(r"\S+", text), 1):
+        if count == keep:
+            return text[:match.end()]
+    return text
@@ -0,0 +1,179 @@
+"""
+Single-file SQLite store for prompt templates.
+
+All templates live in one indexed database file instead of one JSON file per
+template. Every write is a transaction, so a crash can never leave a torn
+template behind. Startup reads only the metadata columns; a template body is
+fetched the first time its `template` attribute is used.
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+
+from context_models import PromptTemplate, PromptTemplateType
+
+DB_FILE_NAME = "templates.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    id            TEXT PRIMARY KEY,
+    name          TEXT NOT NULL,
+    description   TEXT NOT NULL,
+    variables     TEXT NOT NULL,
+    type          TEXT NOT NULL,
+    category      TEXT NOT NULL,
+    tags          TEXT NOT NULL,
+    usage_count   INTEGER NOT NULL,
+    quality_score REAL NOT NULL,
+    created_by    TEXT NOT NULL,
+    created_at    TEXT NOT NULL,
+    updated_at    TEXT NOT NULL,
+    body          TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS templates_category ON templates (category);
+CREATE INDEX IF NOT EXISTS templates_popularity ON templates (usage_count DESC, quality_score DESC);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_METADATA_COLUMNS = (
+    "id, name, description, variables, type, category, tags, "
+    "usage_count, quality_score, created_by, created_at, updated_at"
+)
+
+_UNLOADED = object()
+
+
+class StoredPromptTemplate(PromptTemplate):
+    """PromptTemplate whose body is loaded from the store on first access"""
+
+    _body_loader: Optional[Callable[[str], str]] = None
+
+    @property
+    def template(self) -> str:
+        body = self.__dict__.get("_body", _UNLOADED)
+        if body is _UNLOADED:
+            body = self._body_loader(self.id)
+            self.__dict__["_body"] = body
+        return body
+
+    @template.setter
+    def template(self, value: str):
+        self.__dict__["_body"] = value
+
+    @property
+    def body_loaded(self) -> bool:
+        return self.__dict__.get("_body", _UNLOADED) is not _UNLOADED
+
+
+class TemplateStore:
+    """Prompt templates in a single SQLite file"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    # --- reads ---
+
+    def load_all(self) -> List[PromptTemplate]:
+        """All templates with metadata only; bodies load lazily"""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {_METADATA_COLUMNS} FROM templates").fetchall()
+        return [self._row_to_template(row) for row in rows]
+
+    def load_body(self, template_id: str) -> str:
+        with self._lock:
+            row = self._conn.execute("SELECT body FROM templates WHERE id = ?", (template_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Template {template_id} not found in store")
+        return row[0]
+
+    def _row_to_template(self, row) -> PromptTemplate:
+        template = StoredPromptTemplate(
+            id=row[0],
+            name=row[1],
+            description=row[2],
+            template=_UNLOADED,
+            variables=json.loads(row[3]),
+            type=PromptTemplateType(row[4]),
+            category=row[5],
+            tags=json.loads(row[6]),
+            usage_count=row[7],
+            quality_score=row[8],
+            created_by=row[9],
+            created_at=datetime.fromisoformat(row[10]),
+            updated_at=datetime.fromisoformat(row[11])
+        )
+        template._body_loader = self.load_body
+        return template
+
+    # --- writes (each call is one transaction) ---
+
+    def save(self, template: PromptTemplate):
+        self.save_many([template])
+
+    def save_many(self, templates: Iterable[PromptTemplate]):
+        rows = [(
+            t.id, t.name, t.description,
+            json.dumps(t.variables, ensure_ascii=False),
+            t.type.value, t.category,
+            json.dumps(t.tags, ensure_ascii=False),
+            t.usage_count, t.quality_score, t.created_by,
+            t.created_at.isoformat(), t.updated_at.isoformat(),
+            t.template
+        ) for t in templates]
+        with self._lock, self._transaction():
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO templates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def save_usage(self, templates: Iterable[PromptTemplate]):
+        """Write usage counters only (bodies stay unloaded)"""
+        rows = [(t.usage_count, t.updated_at.isoformat(), t.id) for t in templates]
+        with self._lock, self._transaction():
+            self._conn.executemany(
+                "UPDATE templates SET usage_count = ?, updated_at = ? WHERE id = ?", rows
+            )
+
+    def delete(self, template_id: str):
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM templates WHERE id = ?", (template_id,))
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock, self._transaction():
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -5,15 +5,17 @@ Provides command-line interface for starting the MCP server
 """
 
 import argparse
-import asyncio
 import json
 import logging
 import os
 import sys
-import subprocess
+import time
 from pathlib import Path
 from typing import Optional
 
+# Reference point for --profile-startup
+_IMPORT_STARTED = time.perf_counter()
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -44,14 +46,23 @@ def find_mcp_server() -> Optional[Path]:
 
     return None
 
-def start_mcp_server(project_path: Optional[str] = None, port: Optional[int] = None) -> None:
+def start_mcp_server(project_path: Optional[str] = None,
+                     port: Optional[int] = None,
+                     profile_startup: bool = False) -> None:
     """
     Start the Context Engineering MCP server (Pure Python version)
 
     Args:
         project_path: Path to the project directory (defaults to current directory)
         port: Port for the API servers (not used in pure Python version)
+        profile_startup: Report startup timings on stderr once initialize is answered
     """
+    profile = None
+    if profile_startup:
+        from .startup_profile import StartupProfile
+        profile = StartupProfile(started=_IMPORT_STARTED)
+        profile.mark("start-mcp-server")
+
     # Set project path
     if project_path:
         os.chdir(project_path)
@@ -60,56 +71,26 @@ def start_mcp_server(project_path: Optional[str] = None, port: Optional[int] = N
 
     logger.info(f"Starting Context Engineering MCP server for project: {project_path}")
 
-    # Load .env.local or .env file from project directory
-    env_local_file = Path(project_path) / ".env.local"
-    env_file = Path(project_path) / ".env"
+    # Resolve settings once (environment > .env.local > .env > defaults);
+    # the in-process server reads the same cached Settings object
+    from .engine_path import ensure_engine_path
+    ensure_engine_path()
+    from context_config import get_settings
+    settings = get_settings(project_path)
 
-    if env_local_file.exists():
-        logger.info(f"Loading environment from: {env_local_file}")
-        try:
-            from dotenv import load_dotenv
-            load_dotenv(env_local_file)
-        except ImportError:
-            logger.warning("python-dotenv not installed, loading env manually")
-    elif env_file.exists():
-        logger.info(f"Loading environment from: {env_file}")
-        try:
-            from dotenv import load_dotenv
-            load_dotenv(env_file)
-        except ImportError:
-            logger.warning("python-dotenv not installed, loading env manually")
+    for env_file in settings.env_files:
+        logger.info(f"Loaded environment from: {env_file}")
+    if port:
+        logger.info(f"--port {port} is ignored by the pure Python MCP server")
 
     # Use Pure Python MCP Server (no Node.js required)
     logger.info("Starting Pure Python MCP Server (no Node.js dependencies)")
 
-    # Set environment variables
-    env = os.environ.copy()
-    env["PROJECT_PATH"] = project_path
-
-    if port:
-        env["CONTEXT_API_PORT"] = str(port)
-        env["AI_GUIDES_API_PORT"] = str(port - 1)  # Use port-1 for AI guides
-
-    # Check for GEMINI_API_KEY
-    if not env.get("GEMINI_API_KEY"):
-        # Try to load from project .env.local or .env file
-        for env_file_name in [".env.local", ".env"]:
-            env_file = Path(project_path) / env_file_name
-            if env_file.exists():
-                with open(env_file) as f:
-                    for line in f:
-                        if line.startswith("GEMINI_API_KEY="):
-                            key = line.strip().split("=", 1)[1].strip('"').strip("'")
-                            if key and key != "" and not key.startswith("your-"):
-                                env["GEMINI_API_KEY"] = key
-                                logger.info(f"GEMINI_API_KEY loaded from {env_file_name}")
-                                break
-                if env.get("GEMINI_API_KEY"):
-                    break
-
-        if not env.get("GEMINI_API_KEY"):
-            logger.warning("GEMINI_API_KEY not found. Create a .env.local file with GEMINI_API_KEY=your-key")
-            logger.warning("Some features may be limited without the API key.")
+    if settings.gemini_api_key:
+        logger.info(f"GEMINI_API_KEY loaded from {settings.gemini_api_key_source}")
+    else:
+        logger.warning("GEMINI_API_KEY not found. Create a .env.local file with GEMINI_API_KEY=your-key")
+        logger.warning("Some features may be limited without the API key.")
 
     # Import and run the pure Python MCP server (V2 with fixed stdio)
     try:
@@ -117,13 +98,20 @@ def start_mcp_server(project_path: Optional[str] = None, port: Optional[int] = N
         try:
             from .pure_mcp_server_v2 import PurePythonMCPServer
             logger.info("Pure Python MCP Server V2 imported successfully")
+            # Sessions and windows are persisted under <project>/.context-engineering/state
+            server_options = {"persist": True, "startup_profile": profile}
         except ImportError:
             # Fallback to original
             from .pure_mcp_server import PurePythonMCPServer
             logger.info("Pure Python MCP Server imported successfully")
+            server_options = {}
 
         # Create and run the server
-        server = PurePythonMCPServer()
+        if profile:
+            profile.mark("server modules imported")
+        server = PurePythonMCPServer(**server_options)
+        if profile:
+            profile.mark("server initialized")
         logger.info("Starting MCP server in stdio mode...")
         server.run()
 
@@ -153,6 +141,8 @@ def setup_services(install_deps: bool = True) -> None:
 
     logger.info("Setting up Context Engineering services...")
 
+    import subprocess
+
     # Install Python dependencies if needed
     if install_deps:
         logger.info("Installing Python dependencies...")
@@ -217,6 +207,11 @@ def main():
         default=None,
         help="Port for API servers (defaults to 9001)"
     )
+    start_parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report import and startup timings on stderr after the first initialize request"
+    )
 
     # Setup command
     setup_parser = subparsers.add_parser(
@@ -257,7 +252,7 @@ def main():
 
     # Execute command
     if args.command == "start-mcp-server":
-        start_mcp_server(args.project, args.port)
+        start_mcp_server(args.project, args.port, args.profile_startup)
 
     elif args.command == "setup":
         setup_services(not args.no_deps)
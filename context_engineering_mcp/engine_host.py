@@ -0,0 +1,178 @@
+"""
+In-process host for the context engineering engines.
+
+The MCP server keeps ContextSession/ContextWindow objects here and calls
+TemplateManager, ContextAnalyzer and ContextOptimizer directly instead of
+going through the HTTP API. Engines are constructed on first use. Their
+coroutines run on a dedicated engine event loop thread, so background
+optimization tasks outlive the tool call that started them and blocking
+Gemini calls never stall the stdio loop.
+
+With a StateStore opened, every state mutation is also recorded in the
+write-ahead log so sessions and windows survive server restarts (templates
+are already persisted by TemplateManager under the same data directory).
+"""
+
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import Any, ContextManager, Coroutine, Dict, Optional
+
+from .engine_path import ensure_engine_path
+from .persistence import StateStore
+
+ensure_engine_path()
+from context_config import Settings, get_settings  # noqa: E402
+from context_models import ContextSession, ContextWindow  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+class EngineHost:
+    """Owns context state and the engine instances for the MCP server"""
+
+    def __init__(self,
+                 gemini_api_key: Optional[str] = None,
+                 data_dir: Optional[Path] = None,
+                 settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+        self.gemini_api_key = gemini_api_key if gemini_api_key is not None else self.settings.gemini_api_key
+        self.data_dir = Path(data_dir) if data_dir else self.settings.data_dir
+
+        self.sessions: Dict[str, ContextSession] = {}
+        self.windows: Dict[str, ContextWindow] = {}
+
+        self._template_manager = None
+        self._analyzer = None
+        self._optimizer = None
+        self._init_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.store: Optional[StateStore] = None
+        self._state_lock: Optional[ContextManager] = None
+
+    # --- engines (constructed on first use) ---
+
+    @property
+    def template_manager(self):
+        if self._template_manager is None:
+            with self._init_lock:
+                if self._template_manager is None:
+                    from template_manager import TemplateManager
+                    self._template_manager = TemplateManager(
+                        self.gemini_api_key, storage_path=str(self.data_dir / "templates")
+                    )
+        return self._template_manager
+
+    @property
+    def analyzer(self):
+        if self._analyzer is None:
+            with self._init_lock:
+                if self._analyzer is None:
+                    from context_analyzer import ContextAnalyzer
+                    self._analyzer = ContextAnalyzer(self._require_api_key("context analysis"))
+        return self._analyzer
+
+    @property
+    def optimizer(self):
+        if self._optimizer is None:
+            with self._init_lock:
+                if self._optimizer is None:
+                    from context_optimizer import ContextOptimizer
+                    self._optimizer = ContextOptimizer(self._require_api_key("context optimization"))
+                    self._optimizer.completion_callbacks.append(self._on_optimization_done)
+        return self._optimizer
+
+    def _require_api_key(self, feature: str) -> str:
+        if not self.gemini_api_key:
+            raise ValueError(f"GEMINI_API_KEY is required for {feature}")
+        return self.gemini_api_key
+
+    # --- context state ---
+
+    def get_session(self, session_id: str) -> ContextSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ValueError(f"Session {session_id} not found")
+        return session
+
+    def get_window(self, window_id: str) -> ContextWindow:
+        window = self.windows.get(window_id)
+        if window is None:
+            raise ValueError(f"Window {window_id} not found")
+        return window
+
+    def snapshot_window(self, window_id: str) -> ContextWindow:
+        """Copy-on-write snapshot of a window for read-only work outside the state lock
+
+        Must be called with the state lock held.
+        """
+        return self.get_window(window_id).snapshot()
+
+    @property
+    def total_elements(self) -> int:
+        """Must be read with the state lock held (mutating tools change windows concurrently)"""
+        windows = list(self.windows.values())
+        return sum(len(window.elements) for window in windows)
+
+    # --- persistence ---
+
+    def open_store(self, state_lock: ContextManager, **options: Any) -> StateStore:
+        """Recover persisted state from data_dir/state and log mutations from now on
+
+        state_lock must be the lock mutations (and their record() calls) run under.
+        """
+        store = StateStore(self.data_dir / "state", **options)
+        self.sessions, self.windows = store.recover()
+        store.attach(state_lock, lambda: list(self.sessions.values()))
+        self.store = store
+        self._state_lock = state_lock
+        return store
+
+    def record(self, op: str, **fields: Any):
+        """Log a state mutation (no-op without a store)"""
+        if self.store is not None:
+            self.store.append(op, **fields)
+
+    def _on_optimization_done(self, task, window: ContextWindow):
+        # Runs on the engine loop; a tool call may hold the state lock while
+        # waiting on this loop, so the window is logged from a worker thread
+        if self.store is not None:
+            asyncio.get_running_loop().run_in_executor(None, self._record_window, window)
+
+    def _record_window(self, window: ContextWindow):
+        with self._state_lock:
+            # Copy under the window lock: a later commit may land while the record is encoded
+            self.record("update_window", window=window.snapshot())
+
+    # --- engine event loop ---
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Run an engine coroutine on the engine loop and wait for its result"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        return future.result(timeout)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._init_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="engine-loop", daemon=True
+                ).start()
+        return self._loop
+
+    def close(self):
+        """Stop the engine loop, flush template usage and close the state store"""
+        if self._template_manager is not None:
+            self._template_manager.close()
+        if self._optimizer is not None and self._loop is not None:
+            # Cancel queued/running optimizations so no worker is left pending
+            try:
+                self.run(self._optimizer.shutdown(), timeout=5)
+            except Exception as e:
+                logger.error(f"Optimizer shutdown failed: {str(e)}")
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
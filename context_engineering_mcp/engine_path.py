@@ -0,0 +1,28 @@
+"""
+Locate the context_engineering engine modules.
+
+The engine modules (context_models, context_serialization, ...) are shipped
+as a flat directory next to this package rather than as a package, both in a
+source checkout and in the installed wheel. ensure_engine_path() puts that
+directory on sys.path so they can be imported by module name.
+"""
+
+import sys
+from pathlib import Path
+from typing import Optional
+
+
+def find_engine_dir() -> Optional[Path]:
+    """Find the context_engineering directory"""
+    candidate = Path(__file__).resolve().parent.parent / "context_engineering"
+    if (candidate / "context_models.py").exists():
+        return candidate
+    return None
+
+
+def ensure_engine_path() -> Optional[Path]:
+    """Add the engine directory to sys.path (idempotent)"""
+    engine_dir = find_engine_dir()
+    if engine_dir is not None and str(engine_dir) not in sys.path:
+        sys.path.insert(0, str(engine_dir))
+    return engine_dir
@@ -0,0 +1,342 @@
+"""
+Durable MCP server state: compacted snapshots plus an append-only WAL.
+
+Every state mutation is appended to the write-ahead log as one CRC-checked
+NDJSON record and handed to the OS immediately, so a crashed server loses
+nothing. fsync is batched on a background thread (group commit), which
+bounds what a power loss can drop to one fsync interval. Once enough records
+pile up, the state is compacted into a snapshot and WAL segments covered by
+it are deleted. Recovery loads the snapshot and replays only the WAL tail.
+
+Layout under the state directory:
+    snapshot.json        {"version", "seq", "sessions": [...]}
+    wal-<start_seq>.log  "<crc32 hex> <json record>\\n" per mutation
+"""
+
+import dataclasses
+import gc
+import logging
+import os
+import threading
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+
+from .engine_path import ensure_engine_path
+
+ensure_engine_path()
+from context_models import ContextElement, ContextSession, ContextType, ContextWindow  # noqa: E402
+from context_serialization import dumps_bytes, loads  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FILE = "snapshot.json"
+WAL_PREFIX = "wal-"
+WAL_SUFFIX = ".log"
+
+# Enum value lookup; ContextType(value) is several times slower per element
+_CONTEXT_TYPES = {context_type.value: context_type for context_type in ContextType}
+_parse_datetime = datetime.fromisoformat
+
+
+# --- model decoding (snapshot / WAL payload -> dataclasses) ---
+
+def element_from_dict(data: Dict[str, Any]) -> ContextElement:
+    return ContextElement(
+        id=data["id"],
+        content=data["content"],
+        type=_CONTEXT_TYPES[data["type"]],
+        role=data.get("role"),
+        metadata=data.get("metadata", {}),
+        tags=data.get("tags", []),
+        priority=data.get("priority", 5),
+        created_at=_parse_datetime(data["created_at"]),
+        updated_at=_parse_datetime(data["updated_at"]),
+        compressed_content=data.get("compressed_content"),
+        original_content=data.get("original_content")
+    )
+
+
+def window_from_dict(data: Dict[str, Any]) -> ContextWindow:
+    return ContextWindow(
+        id=data["id"],
+        elements=[element_from_dict(e) for e in data.get("elements", [])],
+        max_tokens=data["max_tokens"],
+        reserved_tokens=data["reserved_tokens"],
+        template_id=data.get("template_id"),
+        quality_metrics=data.get("quality_metrics", {}),
+        optimization_history=data.get("optimization_history", []),
+        created_at=datetime.fromisoformat(data["created_at"]),
+        version=data.get("version", 0)
+    )
+
+
+def session_from_dict(data: Dict[str, Any]) -> ContextSession:
+    return ContextSession(
+        id=data["id"],
+        name=data.get("name", ""),
+        description=data.get("description", ""),
+        windows=[window_from_dict(w) for w in data.get("windows", [])],
+        active_window_id=data.get("active_window_id"),
+        session_metadata=data.get("session_metadata", {}),
+        created_at=datetime.fromisoformat(data["created_at"]),
+        last_accessed=datetime.fromisoformat(data["last_accessed"])
+    )
+
+
+def session_copy(session: ContextSession) -> ContextSession:
+    """Copy a session for serialization, taking each window under its lock
+
+    Background optimizations commit into windows under window.lock only, so
+    holding the state lock alone could serialize a window mid-commit.
+    """
+    return dataclasses.replace(session, windows=[window.snapshot() for window in session.windows])
+
+
+def apply_record(sessions: Dict[str, ContextSession],
+                 windows: Dict[str, ContextWindow],
+                 record: Dict[str, Any]):
+    """Apply one WAL record to in-memory state"""
+    op = record["op"]
+
+    if op == "create_session":
+        session = session_from_dict(record["session"])
+        sessions[session.id] = session
+        for window in session.windows:
+            windows[window.id] = window
+
+    elif op == "create_window":
+        window = window_from_dict(record["window"])
+        session = sessions[record["session_id"]]
+        session.windows.append(window)
+        session.active_window_id = window.id
+        windows[window.id] = window
+
+    elif op == "add_element":
+        windows[record["window_id"]].append_element(element_from_dict(record["element"]))
+
+    elif op == "update_window":
+        # Written after an optimization committed its changes to the window
+        data = record["window"]
+        window = windows[data["id"]]
+        window.elements = [element_from_dict(e) for e in data.get("elements", [])]
+        window.template_id = data.get("template_id")
+        window.quality_metrics = data.get("quality_metrics", {})
+        window.optimization_history = data.get("optimization_history", [])
+        window.version = data.get("version", window.version)
+
+    else:
+        raise ValueError(f"Unknown WAL operation: {op}")
+
+
+# --- WAL encoding ---
+
+def encode_record(record: Dict[str, Any]) -> bytes:
+    payload = dumps_bytes(record)
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def decode_record(line: bytes) -> Optional[Dict[str, Any]]:
+    """Decode a WAL line; None if it is torn or corrupt"""
+    if len(line) < 10 or line[8:9] != b" " or not line.endswith(b"\n"):
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return loads(payload)
+    except ValueError:
+        return None
+
+
+class StateStore:
+    """Snapshot + WAL persistence for sessions, windows and elements"""
+
+    def __init__(self,
+                 state_dir: Path,
+                 fsync_interval: float = 0.05,
+                 compact_every: int = 10000):
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+
+        self.seq = 0
+        self._lock = threading.Lock()
+        self._wal = None
+        self._wal_path: Optional[Path] = None
+        self._records_since_snapshot = 0
+        self._dirty = False
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+        # Supplied by attach(): how to capture a consistent view of the state
+        self._state_lock: Optional[ContextManager] = None
+        self._capture: Optional[Callable[[], List[ContextSession]]] = None
+
+    # --- recovery ---
+
+    def recover(self) -> Tuple[Dict[str, ContextSession], Dict[str, ContextWindow]]:
+        """Load the snapshot, replay the WAL tail and open the WAL for appends"""
+        # Recovery allocates only acyclic objects; cyclic GC passes over the
+        # growing heap would otherwise dominate the load time
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._recover()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _recover(self) -> Tuple[Dict[str, ContextSession], Dict[str, ContextWindow]]:
+        sessions: Dict[str, ContextSession] = {}
+        windows: Dict[str, ContextWindow] = {}
+
+        snapshot_path = self.state_dir / SNAPSHOT_FILE
+        if snapshot_path.exists():
+            snapshot = loads(snapshot_path.read_bytes())
+            if snapshot.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported snapshot version: {snapshot.get('version')}")
+            self.seq = snapshot["seq"]
+            for data in snapshot["sessions"]:
+                session = session_from_dict(data)
+                sessions[session.id] = session
+                for window in session.windows:
+                    windows[window.id] = window
+
+        replayed = 0
+        for wal_path in self._wal_segments():
+            good_offset = 0
+            with open(wal_path, "rb") as f:
+                for line in f:
+                    record = decode_record(line)
+                    if record is None:
+                        logger.warning(f"Truncating torn WAL tail in {wal_path.name} at byte {good_offset}")
+                        break
+                    good_offset += len(line)
+                    if record["seq"] <= self.seq:
+                        continue
+                    apply_record(sessions, windows, record)
+                    self.seq = record["seq"]
+                    replayed += 1
+            if good_offset < wal_path.stat().st_size:
+                with open(wal_path, "r+b") as f:
+                    f.truncate(good_offset)
+
+        self._records_since_snapshot = replayed
+        self._open_wal()
+        logger.info(f"Recovered {len(sessions)} sessions, {len(windows)} windows "
+                    f"(snapshot seq {self.seq - replayed}, {replayed} WAL records replayed)")
+        return sessions, windows
+
+    def attach(self, state_lock: ContextManager, capture: Callable[[], List[ContextSession]]):
+        """Register the state source used for compaction and start the fsync thread"""
+        self._state_lock = state_lock
+        self._capture = capture
+        self._flusher = threading.Thread(target=self._flush_loop, name="wal-fsync", daemon=True)
+        self._flusher.start()
+
+    def _wal_segments(self) -> List[Path]:
+        segments = self.state_dir.glob(f"{WAL_PREFIX}*{WAL_SUFFIX}")
+        return sorted(segments, key=lambda p: int(p.name[len(WAL_PREFIX):-len(WAL_SUFFIX)]))
+
+    def _open_wal(self):
+        segments = self._wal_segments()
+        self._wal_path = segments[-1] if segments else self.state_dir / f"{WAL_PREFIX}{self.seq + 1}{WAL_SUFFIX}"
+        self._wal = open(self._wal_path, "ab")
+
+    # --- appends ---
+
+    def append(self, op: str, **fields: Any):
+        """Append one mutation record (written to the OS before returning)"""
+        with self._lock:
+            self.seq += 1
+            record = {"seq": self.seq, "op": op}
+            record.update(fields)
+            self._wal.write(encode_record(record))
+            self._wal.flush()
+            self._dirty = True
+            self._records_since_snapshot += 1
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            try:
+                self.sync()
+                if self._records_since_snapshot >= self.compact_every:
+                    self.compact()
+            except Exception as e:
+                logger.error(f"State persistence failed: {e}")
+
+    def sync(self):
+        """fsync everything appended so far"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            wal = self._wal
+        os.fsync(wal.fileno())
+
+    # --- compaction ---
+
+    def compact(self):
+        """Write a snapshot of the current state and drop the WAL it covers"""
+        if self._capture is None:
+            return
+
+        with self._state_lock:
+            with self._lock:
+                # Start a new WAL segment; everything up to seq goes into the snapshot
+                seq = self.seq
+                self._wal.flush()
+                os.fsync(self._wal.fileno())
+                self._wal.close()
+                self._wal_path = self.state_dir / f"{WAL_PREFIX}{seq + 1}{WAL_SUFFIX}"
+                self._wal = open(self._wal_path, "ab")
+                self._records_since_snapshot = 0
+                self._dirty = False
+            data = dumps_bytes({
+                "version": SNAPSHOT_VERSION,
+                "seq": seq,
+                "sessions": [session_copy(session) for session in self._capture()]
+            })
+
+        snapshot_path = self.state_dir / SNAPSHOT_FILE
+        tmp_path = snapshot_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+        self._fsync_dir()
+
+        for segment in self._wal_segments():
+            if segment != self._wal_path and int(segment.name[len(WAL_PREFIX):-len(WAL_SUFFIX)]) <= seq:
+                segment.unlink()
+
+        logger.debug(f"Compacted state at seq {seq} ({len(data)} bytes)")
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(str(self.state_dir), os.O_RDONLY)
+        except OSError:
+            return  # not supported on this platform (e.g. Windows)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self, compact: bool = True):
+        """Stop the fsync thread, optionally compact, and close the WAL"""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        if compact and self._records_since_snapshot:
+            self.compact()
+        with self._lock:
+            if self._wal is not None:
+                self._wal.flush()
+                os.fsync(self._wal.fileno())
+                self._wal.close()
+                self._wal = None
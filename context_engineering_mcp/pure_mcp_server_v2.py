@@ -2,35 +2,111 @@
 """
 Pure Python MCP Server Implementation V2
 Fixed version with proper stdio handling for MCP protocol
+(event-driven transport, Content-Length and NDJSON framing)
 """
 
 import sys
-import json
 import uuid
+import asyncio
 import logging
-from typing import Any, Dict, List, Optional
-from datetime import datetime
-import os
-import select
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from typing import Any, Dict, List, Optional, Set
+
+from .engine_host import EngineHost
+from .engine_path import ensure_engine_path
+from .tool_registry import ToolRegistry, mcp_tool
+from .transport import CONTENT_LENGTH, StdioTransport
+
+ensure_engine_path()
+from context_config import get_settings  # noqa: E402
+from context_models import (  # noqa: E402
+    ContextElement, ContextSession, ContextType, PromptTemplate, PromptTemplateType
+)
+from context_serialization import dumps, dumps_bytes, loads  # noqa: E402
+from template_engine import MISSING_KEEP, MISSING_POLICIES  # noqa: E402
 
 # Setup logging to stderr only
 logging.basicConfig(
-    level=logging.DEBUG if os.environ.get('DEBUG') else logging.INFO,
+    level=logging.DEBUG if get_settings().debug else logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[logging.StreamHandler(sys.stderr)]
 )
 logger = logging.getLogger(__name__)
 
+INITIALIZE_RESULT = {
+    "protocolVersion": "0.1.0",
+    "capabilities": {
+        "tools": {}
+    },
+    "serverInfo": {
+        "name": "context-engineering-mcp",
+        "version": "2.0.0"
+    }
+}
+
+OPTIMIZATION_GOALS = [
+    "reduce_tokens", "improve_clarity", "enhance_relevance", "remove_redundancy", "improve_structure"
+]
+
+# Cancellation notifications: LSP-style and MCP-style
+CANCEL_METHODS = {"$/cancelRequest", "notifications/cancelled"}
+
+# JSON-RPC error code for requests aborted by $/cancelRequest
+REQUEST_CANCELLED = -32800
+
+def error_response(request_id: Any, code: int, message: str) -> Dict:
+    """Build a JSON-RPC error response"""
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {
+            "code": code,
+            "message": message
+        }
+    }
+
 class PurePythonMCPServer:
     """
     Pure Python implementation of MCP Server with proper stdio handling
+
+    With max_concurrency > 1 (the default), tools/call requests run on a
+    bounded thread pool and their responses are written as they complete;
+    other methods are answered in arrival order on the read loop.
     """
 
-    def __init__(self):
-        self.sessions = {}
-        self.windows = {}
-        self.templates = {}
-        self.elements = {}
+    def __init__(self,
+                 max_concurrency: Optional[int] = None,
+                 engines: Optional[EngineHost] = None,
+                 persist: bool = False,
+                 startup_profile=None):
+        self.engines = engines or EngineHost()
+        self.transport: Optional[StdioTransport] = None
+
+        if max_concurrency is None:
+            max_concurrency = self.engines.settings.max_concurrency
+        self.max_concurrency = max(1, max_concurrency)
+        self._state_lock = threading.RLock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._inflight: Dict[Any, asyncio.Task] = {}
+        self._reply_on_cancel: Set[Any] = set()
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._shutdown_requested = False
+        self.startup_profile = startup_profile
+
+        if persist:
+            self.engines.open_store(self._state_lock)
+            logger.info(f"Persisting server state under {self.engines.store.state_dir}")
+
+        # Tools are declared once with @mcp_tool; the static results are
+        # serialized here so initialize/tools/list never re-encode them
+        self.registry = ToolRegistry.from_object(self)
+        self.registry.list_result()
+        self._initialize_result = dumps_bytes(INITIALIZE_RESULT)
 
     def generate_id(self) -> str:
         """Generate unique ID"""
@@ -41,147 +117,16 @@ class PurePythonMCPServer:
         return {
             "jsonrpc": "2.0",
             "id": request.get("id"),
-            "result": {
-                "protocolVersion": "0.1.0",
-                "capabilities": {
-                    "tools": {}
-                },
-                "serverInfo": {
-                    "name": "context-engineering-mcp",
-                    "version": "2.0.0"
-                }
-            }
+            "result": INITIALIZE_RESULT
         }
 
     def handle_list_tools(self, request: Dict) -> Dict:
         """Handle tools/list request"""
-        tools = [
-            {
-                "name": "create_context_session",
-                "description": "Create a new context engineering session",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "name": {
-                            "type": "string",
-                            "description": "Session name",
-                            "default": "New Session"
-                        },
-                        "description": {
-                            "type": "string",
-                            "description": "Session description",
-                            "default": ""
-                        }
-                    }
-                }
-            },
-            {
-                "name": "create_context_window",
-                "description": "Create a new context window in a session",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "session_id": {
-                            "type": "string",
-                            "description": "The session ID"
-                        },
-                        "max_tokens": {
-                            "type": "integer",
-                            "description": "Maximum tokens",
-                            "default": 8192
-                        },
-                        "reserved_tokens": {
-                            "type": "integer",
-                            "description": "Reserved tokens",
-                            "default": 512
-                        }
-                    },
-                    "required": ["session_id"]
-                }
-            },
-            {
-                "name": "add_context_element",
-                "description": "Add an element to a context window",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "window_id": {
-                            "type": "string",
-                            "description": "The context window ID"
-                        },
-                        "content": {
-                            "type": "string",
-                            "description": "The content to add"
-                        },
-                        "type": {
-                            "type": "string",
-                            "enum": ["system", "user", "assistant"],
-                            "default": "user"
-                        },
-                        "priority": {
-                            "type": "integer",
-                            "minimum": 1,
-                            "maximum": 10,
-                            "default": 5
-                        }
-                    },
-                    "required": ["window_id", "content"]
-                }
-            },
-            {
-                "name": "get_context_stats",
-                "description": "Get statistics about the context engineering system",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {}
-                }
-            },
-            {
-                "name": "create_prompt_template",
-                "description": "Create a new prompt template",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "name": {
-                            "type": "string",
-                            "description": "Template name"
-                        },
-                        "description": {
-                            "type": "string",
-                            "description": "Template description"
-                        },
-                        "template": {
-                            "type": "string",
-                            "description": "Template content with {variables}"
-                        },
-                        "category": {
-                            "type": "string",
-                            "default": "general"
-                        }
-                    },
-                    "required": ["name", "description", "template"]
-                }
-            },
-            {
-                "name": "list_prompt_templates",
-                "description": "List available prompt templates",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "category": {
-                            "type": "string",
-                            "description": "Filter by category"
-                        }
-                    }
-                }
-            }
-        ]
-
         return {
             "jsonrpc": "2.0",
             "id": request.get("id"),
             "result": {
-                "tools": tools
+                "tools": self.registry.list_tools()
             }
         }
 
@@ -192,113 +137,13 @@ class PurePythonMCPServer:
         args = params.get("arguments", {})
 
         try:
-            result = None
-
-            if tool_name == "create_context_session":
-                session_id = self.generate_id()
-                self.sessions[session_id] = {
-                    "id": session_id,
-                    "name": args.get("name", "New Session"),
-                    "description": args.get("description", ""),
-                    "created_at": datetime.now().isoformat(),
-                    "windows": []
-                }
-                result = {
-                    "success": True,
-                    "session_id": session_id,
-                    "message": f"Session created: {self.sessions[session_id]['name']}"
-                }
-
-            elif tool_name == "create_context_window":
-                window_id = self.generate_id()
-                session_id = args.get("session_id")
-
-                if session_id not in self.sessions:
-                    raise ValueError(f"Session {session_id} not found")
-
-                self.windows[window_id] = {
-                    "id": window_id,
-                    "session_id": session_id,
-                    "max_tokens": args.get("max_tokens", 8192),
-                    "reserved_tokens": args.get("reserved_tokens", 512),
-                    "elements": [],
-                    "created_at": datetime.now().isoformat()
-                }
-
-                self.sessions[session_id]["windows"].append(window_id)
-
-                result = {
-                    "success": True,
-                    "window_id": window_id,
-                    "message": f"Context window created with {self.windows[window_id]['max_tokens']} max tokens"
-                }
-
-            elif tool_name == "add_context_element":
-                window_id = args.get("window_id")
-
-                if window_id not in self.windows:
-                    raise ValueError(f"Window {window_id} not found")
-
-                element_id = self.generate_id()
-                element = {
-                    "id": element_id,
-                    "content": args.get("content"),
-                    "type": args.get("type", "user"),
-                    "priority": args.get("priority", 5),
-                    "created_at": datetime.now().isoformat()
-                }
-
-                self.windows[window_id]["elements"].append(element_id)
-                self.elements[element_id] = element
-
-                result = {
-                    "success": True,
-                    "element_id": element_id,
-                    "message": "Element added to context window",
-                    "element_count": len(self.windows[window_id]["elements"])
-                }
-
-            elif tool_name == "get_context_stats":
-                result = {
-                    "sessions": len(self.sessions),
-                    "windows": len(self.windows),
-                    "templates": len(self.templates),
-                    "total_elements": len(self.elements),
-                    "status": "operational"
-                }
-
-            elif tool_name == "create_prompt_template":
-                template_id = self.generate_id()
-                self.templates[template_id] = {
-                    "id": template_id,
-                    "name": args.get("name"),
-                    "description": args.get("description"),
-                    "template": args.get("template"),
-                    "category": args.get("category", "general"),
-                    "created_at": datetime.now().isoformat()
-                }
-
-                result = {
-                    "success": True,
-                    "template_id": template_id,
-                    "message": f"Template created: {self.templates[template_id]['name']}"
-                }
-
-            elif tool_name == "list_prompt_templates":
-                category = args.get("category")
-                templates = list(self.templates.values())
-
-                if category:
-                    templates = [t for t in templates if t["category"] == category]
-
-                result = {
-                    "templates": templates,
-                    "total": len(templates)
-                }
-
-            else:
+            tool = self.registry.get(tool_name)
+            if tool is None:
                 raise ValueError(f"Unknown tool: {tool_name}")
 
+            with nullcontext() if tool.read_only else self._state_lock:
+                result = tool.handler(args)
+
             return {
                 "jsonrpc": "2.0",
                 "id": request.get("id"),
@@ -306,7 +151,7 @@ class PurePythonMCPServer:
                     "content": [
                         {
                             "type": "text",
-                            "text": json.dumps(result, indent=2)
+                            "text": dumps(result)
                         }
                     ]
                 }
@@ -320,16 +165,463 @@ class PurePythonMCPServer:
                     "content": [
                         {
                             "type": "text",
-                            "text": json.dumps({
+                            "text": dumps({
                                 "error": str(e),
                                 "tool": tool_name
-                            }, indent=2)
+                            })
                         }
                     ],
                     "isError": True
                 }
             }
 
+    @mcp_tool(
+        name="create_context_session",
+        description="Create a new context engineering session",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "name": {
+                    "type": "string",
+                    "description": "Session name",
+                    "default": "New Session"
+                },
+                "description": {
+                    "type": "string",
+                    "description": "Session description",
+                    "default": ""
+                }
+            }
+        }
+    )
+    def tool_create_context_session(self, args: Dict) -> Dict:
+        session = ContextSession(
+            name=args.get("name", "New Session"),
+            description=args.get("description", "")
+        )
+        self.engines.sessions[session.id] = session
+        self.engines.record("create_session", session=session)
+        return {
+            "success": True,
+            "session_id": session.id,
+            "message": f"Session created: {session.name}"
+        }
+
+    @mcp_tool(
+        name="create_context_window",
+        description="Create a new context window in a session",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "session_id": {
+                    "type": "string",
+                    "description": "The session ID"
+                },
+                "max_tokens": {
+                    "type": "integer",
+                    "description": "Maximum tokens",
+                    "default": 8192
+                },
+                "reserved_tokens": {
+                    "type": "integer",
+                    "description": "Reserved tokens",
+                    "default": 512
+                }
+            },
+            "required": ["session_id"]
+        }
+    )
+    def tool_create_context_window(self, args: Dict) -> Dict:
+        session = self.engines.get_session(args.get("session_id"))
+        window = session.create_window(args.get("max_tokens", 8192))
+        window.reserved_tokens = args.get("reserved_tokens", 512)
+        self.engines.windows[window.id] = window
+        self.engines.record("create_window", session_id=session.id, window=window)
+
+        return {
+            "success": True,
+            "window_id": window.id,
+            "message": f"Context window created with {window.max_tokens} max tokens"
+        }
+
+    @mcp_tool(
+        name="add_context_element",
+        description="Add an element to a context window",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "window_id": {
+                    "type": "string",
+                    "description": "The context window ID"
+                },
+                "content": {
+                    "type": "string",
+                    "description": "The content to add"
+                },
+                "type": {
+                    "type": "string",
+                    "enum": [context_type.value for context_type in ContextType],
+                    "default": "user"
+                },
+                "priority": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "maximum": 10,
+                    "default": 5
+                },
+                "tags": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "default": []
+                }
+            },
+            "required": ["window_id", "content"]
+        }
+    )
+    def tool_add_context_element(self, args: Dict) -> Dict:
+        window = self.engines.get_window(args.get("window_id"))
+
+        element = ContextElement(
+            content=args.get("content", ""),
+            type=ContextType(args.get("type", "user")),
+            priority=args.get("priority", 5),
+            tags=args.get("tags", [])
+        )
+
+        if not window.add_element(element):
+            raise ValueError(
+                f"Cannot add element: token limit exceeded "
+                f"({element.token_count:.0f} tokens requested, {window.available_tokens:.0f} available)"
+            )
+        self.engines.record("add_element", window_id=window.id, element=element)
+
+        return {
+            "success": True,
+            "element_id": element.id,
+            "message": "Element added to context window",
+            "element_count": len(window.elements),
+            "current_tokens": window.current_tokens,
+            "available_tokens": window.available_tokens
+        }
+
+    @mcp_tool(
+        name="get_context_window",
+        description="Get a context window with its elements and token usage",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "window_id": {
+                    "type": "string",
+                    "description": "The context window ID"
+                }
+            },
+            "required": ["window_id"]
+        },
+        read_only=True
+    )
+    def tool_get_context_window(self, args: Dict) -> Dict:
+        # Read-only tools run without the state lock; take only the snapshot under it
+        with self._state_lock:
+            window = self.engines.snapshot_window(args.get("window_id"))
+        return {
+            "id": window.id,
+            "max_tokens": window.max_tokens,
+            "current_tokens": window.current_tokens,
+            "available_tokens": window.available_tokens,
+            "utilization_ratio": window.utilization_ratio,
+            "reserved_tokens": window.reserved_tokens,
+            "elements": window.elements,
+            "quality_metrics": window.quality_metrics,
+            "created_at": window.created_at
+        }
+
+    @mcp_tool(
+        name="analyze_context",
+        description="Analyze a context window for quality and optimization opportunities",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "window_id": {
+                    "type": "string",
+                    "description": "The context window ID to analyze"
+                },
+                "force": {
+                    "type": "boolean",
+                    "description": "Re-run semantic analysis even if the window barely changed since the last analysis",
+                    "default": False
+                }
+            },
+            "required": ["window_id"]
+        },
+        read_only=True
+    )
+    def tool_analyze_context(self, args: Dict) -> Any:
+        # Analyze a snapshot so slow LLM stages do not hold the state lock
+        with self._state_lock:
+            window = self.engines.snapshot_window(args.get("window_id"))
+        analysis = self.engines.run(
+            self.engines.analyzer.analyze_context_window(window, force=bool(args.get("force", False)))
+        )
+        # Metrics are derived data: keep them on the live window (if it did not change meanwhile)
+        # without logging a mutation; they are persisted with the window's next update
+        with self._state_lock:
+            live = self.engines.windows.get(window.id)
+            if live is not None and live.version == window.version:
+                live.quality_metrics = dict(analysis.metrics, quality_score=analysis.quality_score)
+        return analysis
+
+    @mcp_tool(
+        name="optimize_context",
+        description="Optimize a context window using AI (runs in the background)",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "window_id": {
+                    "type": "string",
+                    "description": "The context window ID to optimize"
+                },
+                "goals": {
+                    "type": "array",
+                    "items": {
+                        "type": "string",
+                        "enum": OPTIMIZATION_GOALS
+                    },
+                    "description": "Optimization goals",
+                    "default": ["reduce_tokens", "improve_clarity"]
+                },
+                "constraints": {
+                    "type": "object",
+                    "description": "Optimization constraints (e.g. target_token_reduction, dedupe_mode: exact|near, simhash_threshold, compression_mode: llm|extractive|hybrid, compression_ratio)",
+                    "default": {}
+                },
+                "priority": {
+                    "type": "integer",
+                    "description": "Queue priority (1-10, higher runs first)",
+                    "minimum": 1,
+                    "maximum": 10,
+                    "default": 5
+                },
+                "timeout_seconds": {
+                    "type": "number",
+                    "description": "Fail the task if it runs longer than this"
+                }
+            },
+            "required": ["window_id"]
+        }
+    )
+    def tool_optimize_context(self, args: Dict) -> Dict:
+        window = self.engines.get_window(args.get("window_id"))
+        goals = args.get("goals") or ["reduce_tokens", "improve_clarity"]
+        task = self.engines.run(self.engines.optimizer.optimize_context_window(
+            window, goals, args.get("constraints") or {},
+            priority=args.get("priority", 5), timeout=args.get("timeout_seconds")
+        ))
+        return {
+            "task_id": task.id,
+            "status": task.status,
+            "goals": goals
+        }
+
+    @mcp_tool(
+        name="get_optimization_status",
+        description="Get the status and result of an optimization task",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "task_id": {
+                    "type": "string",
+                    "description": "The optimization task ID"
+                }
+            },
+            "required": ["task_id"]
+        },
+        read_only=True
+    )
+    def tool_get_optimization_status(self, args: Dict) -> Any:
+        optimizer = self.engines.optimizer
+
+        async def copy_task():
+            # The engine loop updates the task; copy it there rather than serialize it live
+            task = optimizer.get_optimization_task(args.get("task_id"))
+            return task.to_dict() if task is not None else None
+
+        status = self.engines.run(copy_task())
+        if status is None:
+            raise ValueError(f"Optimization task {args.get('task_id')} not found")
+        return status
+
+    @mcp_tool(
+        name="cancel_optimization",
+        description="Cancel a queued or running optimization task",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "task_id": {
+                    "type": "string",
+                    "description": "The optimization task ID"
+                }
+            },
+            "required": ["task_id"]
+        }
+    )
+    def tool_cancel_optimization(self, args: Dict) -> Dict:
+        optimizer = self.engines.optimizer
+        task = optimizer.get_optimization_task(args.get("task_id"))
+        if task is None:
+            raise ValueError(f"Optimization task {args.get('task_id')} not found")
+        cancelled = self.engines.run(optimizer.cancel_optimization_task(task.id))
+        return {
+            "task_id": task.id,
+            "cancelled": cancelled,
+            "status": task.status
+        }
+
+    @mcp_tool(
+        name="get_context_stats",
+        description="Get statistics about the context engineering system",
+        read_only=True
+    )
+    def tool_get_context_stats(self, args: Dict) -> Dict:
+        engines = self.engines
+        with self._state_lock:
+            sessions = len(engines.sessions)
+            windows = len(engines.windows)
+            total_elements = engines.total_elements
+        return {
+            "sessions": sessions,
+            "windows": windows,
+            "templates": len(engines.template_manager.templates),
+            "total_elements": total_elements,
+            "status": "operational"
+        }
+
+    @mcp_tool(
+        name="create_prompt_template",
+        description="Create a new prompt template",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "name": {
+                    "type": "string",
+                    "description": "Template name"
+                },
+                "description": {
+                    "type": "string",
+                    "description": "Template description"
+                },
+                "template": {
+                    "type": "string",
+                    "description": "Template content with {variables}"
+                },
+                "type": {
+                    "type": "string",
+                    "enum": [template_type.value for template_type in PromptTemplateType],
+                    "default": "completion"
+                },
+                "category": {
+                    "type": "string",
+                    "default": "general"
+                },
+                "tags": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "default": []
+                }
+            },
+            "required": ["name", "description", "template"]
+        }
+    )
+    def tool_create_prompt_template(self, args: Dict) -> Dict:
+        template = PromptTemplate(
+            name=args.get("name"),
+            description=args.get("description"),
+            template=args.get("template"),
+            type=PromptTemplateType(args.get("type", "completion")),
+            category=args.get("category", "general"),
+            tags=args.get("tags", [])
+        )
+        template_id = self.engines.template_manager.create_template(template)
+
+        return {
+            "success": True,
+            "template_id": template_id,
+            "variables": template.variables,
+            "message": f"Template created: {template.name}"
+        }
+
+    @mcp_tool(
+        name="list_prompt_templates",
+        description="List available prompt templates",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "category": {
+                    "type": "string",
+                    "description": "Filter by category"
+                },
+                "tags": {
+                    "type": "string",
+                    "description": "Filter by tags (comma-separated)"
+                }
+            }
+        },
+        read_only=True
+    )
+    def tool_list_prompt_templates(self, args: Dict) -> Dict:
+        tags = args.get("tags")
+        templates = self.engines.template_manager.list_templates(
+            args.get("category"), tags.split(",") if tags else None
+        )
+
+        return {
+            "templates": [
+                {
+                    "id": t.id,
+                    "name": t.name,
+                    "description": t.description,
+                    "type": t.type,
+                    "category": t.category,
+                    "tags": t.tags,
+                    "usage_count": t.usage_count,
+                    "variables": t.variables
+                }
+                for t in templates
+            ],
+            "total": len(templates)
+        }
+
+    @mcp_tool(
+        name="render_template",
+        description="Render a prompt template with variables",
+        input_schema={
+            "type": "object",
+            "properties": {
+                "template_id": {
+                    "type": "string",
+                    "description": "The template ID"
+                },
+                "variables": {
+                    "type": "object",
+                    "description": "Variables to substitute in the template"
+                },
+                "missing": {
+                    "type": "string",
+                    "enum": list(MISSING_POLICIES),
+                    "description": "Missing variables: keep the {placeholder}, render empty, or fail",
+                    "default": MISSING_KEEP
+                }
+            },
+            "required": ["template_id", "variables"]
+        }
+    )
+    def tool_render_template(self, args: Dict) -> Dict:
+        rendered = self.engines.template_manager.render_template(
+            args.get("template_id"), args.get("variables") or {}, args.get("missing", MISSING_KEEP)
+        )
+        if rendered is None:
+            raise ValueError(f"Template {args.get('template_id')} not found")
+        return {"rendered_content": rendered}
+
     def handle_request(self, request: Dict) -> Optional[Dict]:
         """Handle incoming JSON-RPC request"""
         method = request.get("method", "")
@@ -353,106 +645,225 @@ class PurePythonMCPServer:
             }
         else:
             # Unknown method
-            return {
-                "jsonrpc": "2.0",
-                "id": request.get("id"),
-                "error": {
-                    "code": -32601,
-                    "message": f"Method not found: {method}"
-                }
-            }
+            return error_response(request.get("id"), -32601, f"Method not found: {method}")
+
+    def send_message(self, message: Dict, framing: str = CONTENT_LENGTH):
+        """Send a message using the framing the client used"""
+        # Encode once straight to bytes; the tool result text is already compact JSON
+        self.transport.write(dumps_bytes(message), framing)
+
+    def send_result_bytes(self, request_id: Any, result: bytes, framing: str = CONTENT_LENGTH):
+        """Send a response whose result is already serialized"""
+        body = b'{"jsonrpc":"2.0","id":%s,"result":%s}' % (dumps_bytes(request_id), result)
+        self.transport.write(body, framing)
 
-    def read_message(self) -> Optional[Dict]:
-        """Read a single message from stdin with proper Content-Length handling"""
+    async def handle_frame(self, body: bytes, framing: str):
+        """Decode one frame (a request or a batch) and dispatch it"""
         try:
-            # Read headers
-            headers = {}
-            while True:
-                line = sys.stdin.readline()
-                if not line:
-                    return None
-
-                line = line.strip()
-                if not line:
-                    break
-
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    headers[key.strip()] = value.strip()
-
-            # Get content length
-            content_length = headers.get('Content-Length')
-            if not content_length:
-                # Try to read as plain JSON if no Content-Length
-                line = sys.stdin.readline()
-                if line:
-                    return json.loads(line)
-                return None
-
-            # Read content
-            content_length = int(content_length)
-            content = sys.stdin.read(content_length)
-
-            return json.loads(content)
-
-        except (json.JSONDecodeError, ValueError) as e:
+            message = loads(body)
+        except ValueError as e:
             logger.error(f"Failed to parse message: {e}")
-            return None
+            self.send_message(error_response(None, -32700, f"Parse error: {e}"), framing)
+            return
+
+        if isinstance(message, list) and message:
+            if self.max_concurrency > 1:
+                # Run the batch as a task so the read loop keeps accepting frames
+                task = asyncio.ensure_future(self.dispatch_batch(message, framing))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            else:
+                await self.dispatch_batch(message, framing)
+        elif isinstance(message, dict):
+            await self.dispatch(message, framing)
+        else:
+            self.send_message(error_response(None, -32600, "Invalid Request"), framing)
+
+    async def dispatch(self, message: Dict, framing: str):
+        """Dispatch a request: tools/call runs concurrently, the rest inline"""
+        method = message.get("method", "")
+        is_notification = "id" not in message
+
+        if method in CANCEL_METHODS:
+            self.cancel_request(message)
+            return
+
+        if method == "tools/call" and self.max_concurrency > 1:
+            task = self._start_tool_call(message)
+            task.add_done_callback(partial(self._send_task_response, message, framing))
+            return
+
+        if method == "initialize" and not is_notification:
+            self.send_result_bytes(message["id"], self._initialize_result, framing)
+            if self.startup_profile is not None:
+                self.startup_profile.finish()
+            return
+
+        if method == "tools/list" and not is_notification:
+            self.send_result_bytes(message["id"], self.registry.list_result(), framing)
+            return
+
+        if method == "shutdown":
+            # Let running tool calls finish before acknowledging shutdown
+            await self.drain()
+            self._shutdown_requested = True
+
+        response = self.handle_request(message)
+        if response and not is_notification:
+            self.send_message(response, framing)
+
+    async def dispatch_batch(self, batch: List[Any], framing: str):
+        """Dispatch a JSON-RPC batch and answer it with a single batch frame
+
+        Tool calls in the batch run concurrently (mutating tools still apply
+        in batch order); other methods are handled in order. Notifications
+        get no entry in the response, and an all-notification batch gets no
+        response at all.
+        """
+        entries = []
+        for member in batch:
+            if not isinstance(member, dict):
+                entries.append(error_response(None, -32600, "Invalid Request"))
+                continue
+
+            method = member.get("method", "")
+            if method in CANCEL_METHODS:
+                self.cancel_request(member)
+            elif method == "tools/call" and self.max_concurrency > 1:
+                entries.append((member, self._start_tool_call(member)))
+            else:
+                if method == "shutdown":
+                    await self.drain()
+                    self._shutdown_requested = True
+                response = self.handle_request(member)
+                if response and "id" in member:
+                    entries.append(response)
+
+        responses = []
+        for entry in entries:
+            if isinstance(entry, tuple):
+                member, task = entry
+                try:
+                    entry = await asyncio.shield(task)
+                except asyncio.CancelledError:
+                    entry = self._cancelled_response(member)
+                if entry is None or "id" not in member:
+                    continue
+            responses.append(entry)
+
+        if responses:
+            self.transport.write(dumps_bytes(responses), framing)
+
+    def _start_tool_call(self, request: Dict) -> asyncio.Task:
+        """Schedule a tool call and register it for cancellation"""
+        task = asyncio.ensure_future(self._execute_tool_call(request))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if "id" in request:
+            request_id = request["id"]
+            self._inflight[request_id] = task
+            task.add_done_callback(lambda t: self._forget(request_id, t))
+        return task
+
+    async def _execute_tool_call(self, request: Dict) -> Optional[Dict]:
+        """Run a tool call on the worker pool and return its response"""
+        loop = asyncio.get_running_loop()
+        tool = self.registry.get((request.get("params") or {}).get("name"))
+        try:
+            if tool is not None and not tool.read_only:
+                # Mutating calls queue on a FIFO lock so they apply in arrival
+                # order without holding a worker slot while they wait
+                async with self._write_lock:
+                    async with self._semaphore:
+                        return await loop.run_in_executor(self._executor, self.handle_tool_call, request)
+            async with self._semaphore:
+                return await loop.run_in_executor(self._executor, self.handle_tool_call, request)
+        except asyncio.CancelledError:
+            logger.debug(f"Tool call {request.get('id')} cancelled")
+            return self._cancelled_response(request)
         except Exception as e:
-            logger.error(f"Error reading message: {e}")
-            return None
+            logger.error(f"Tool call failed: {e}")
+            return error_response(request.get("id"), -32603, f"Internal error: {e}")
 
-    def send_message(self, message: Dict):
-        """Send a message with proper Content-Length header"""
-        content = json.dumps(message)
-        content_bytes = content.encode('utf-8')
+    def _send_task_response(self, request: Dict, framing: str, task: asyncio.Task):
+        if task.cancelled():
+            response = self._cancelled_response(request)
+        else:
+            response = task.result()
+        if response is not None and "id" in request:
+            self.send_message(response, framing)
+
+    def _cancelled_response(self, request: Dict) -> Optional[Dict]:
+        # LSP-style cancellation still expects an answer for the cancelled request
+        request_id = request.get("id")
+        if request_id in self._reply_on_cancel:
+            self._reply_on_cancel.discard(request_id)
+            return error_response(request_id, REQUEST_CANCELLED, "Request cancelled")
+        return None
+
+    def _forget(self, request_id: Any, task: asyncio.Task):
+        if self._inflight.get(request_id) is task:
+            del self._inflight[request_id]
+
+    def cancel_request(self, message: Dict):
+        """Handle $/cancelRequest and notifications/cancelled
+
+        A tool that is already executing cannot be interrupted, but its result
+        is discarded; calls still waiting for a worker never start.
+        """
+        params = message.get("params") or {}
+        request_id = params.get("requestId", params.get("id"))
+        task = self._inflight.pop(request_id, None)
+        if task is None or task.done():
+            return
+
+        if message.get("method") == "$/cancelRequest":
+            self._reply_on_cancel.add(request_id)
+        task.cancel()
+        logger.debug(f"Cancelled request {request_id}")
+
+    async def drain(self):
+        """Wait for all in-flight tool calls and batches to complete"""
+        pending = [task for task in self._tasks if not task.done()]
+        while pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            pending = [task for task in self._tasks if not task.done()]
+
+    async def serve(self, transport: Optional[StdioTransport] = None):
+        """Process frames until stdin is closed or shutdown is requested"""
+        self.transport = transport or StdioTransport()
+        await self.transport.start()
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._write_lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="mcp-tool"
+        )
+
+        try:
+            async for body, framing in self.transport.frames():
+                await self.handle_frame(body, framing)
+
+                # Check for shutdown
+                if self._shutdown_requested:
+                    logger.info("Shutdown requested")
+                    await self.drain()
+                    return
 
-        sys.stdout.write(f"Content-Length: {len(content_bytes)}\r\n")
-        sys.stdout.write("\r\n")
-        sys.stdout.write(content)
-        sys.stdout.flush()
+            logger.info("EOF reached, shutting down")
+            await self.drain()
+        finally:
+            self._executor.shutdown(wait=False)
+            self.engines.close()
 
     def run(self):
         """Main run loop for stdio communication"""
         logger.info("Starting Pure Python MCP Server V2 (stdio mode)")
 
-        # Set stdin to non-blocking mode if possible
-        try:
-            import fcntl
-            import os
-            flags = fcntl.fcntl(sys.stdin, fcntl.F_GETFL)
-            fcntl.fcntl(sys.stdin, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-            logger.debug("Set stdin to non-blocking mode")
-        except (ImportError, AttributeError, OSError):
-            logger.debug("Could not set stdin to non-blocking mode (normal on non-Unix)")
-
         try:
-            # Main message loop
-            while True:
-                # Try to read a message
-                message = self.read_message()
-
-                if message is None:
-                    # No message available, wait a bit
-                    import time
-                    time.sleep(0.01)
-                    continue
-
-                # Handle the request
-                response = self.handle_request(message)
-
-                if response:
-                    self.send_message(response)
-
-                # Check for shutdown
-                if message.get("method") == "shutdown":
-                    logger.info("Shutdown requested")
-                    break
-
+            asyncio.run(self.serve())
         except KeyboardInterrupt:
             logger.info("Interrupted by user")
-        except EOFError:
-            logger.info("EOF reached, shutting down")
         except Exception as e:
             logger.error(f"Server error: {e}")
             import traceback
@@ -461,7 +872,7 @@ class PurePythonMCPServer:
 def main():
     """Main entry point"""
     try:
-        server = PurePythonMCPServer()
+        server = PurePythonMCPServer(persist=True)
         server.run()
     except Exception as e:
         logger.error(f"Fatal error: {e}")
@@ -0,0 +1,113 @@
+"""
+Tool registry for the pure Python MCP server.
+
+Each tool is declared once, next to its handler, with the @mcp_tool
+decorator. The registry dispatches tools/call with a dict lookup and keeps
+the tools/list result pre-serialized, so listing tools costs one cached
+bytes object however many tools are registered.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .engine_path import ensure_engine_path
+
+ensure_engine_path()
+from context_serialization import dumps_bytes  # noqa: E402
+
+ToolHandler = Callable[[Dict[str, Any]], Any]
+
+_TOOL_ATTR = "_mcp_tool"
+
+
+@dataclass
+class Tool:
+    """A tool declaration: schema plus handler"""
+    name: str
+    description: str
+    input_schema: Dict[str, Any]
+    handler: Optional[ToolHandler] = None
+    read_only: bool = False  # True if the handler never mutates server state
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "inputSchema": self.input_schema
+        }
+
+
+def mcp_tool(name: str,
+             description: str,
+             input_schema: Optional[Dict[str, Any]] = None,
+             read_only: bool = False):
+    """Declare a method as an MCP tool handler"""
+    def decorator(func):
+        setattr(func, _TOOL_ATTR, Tool(
+            name=name,
+            description=description,
+            input_schema=input_schema or {"type": "object", "properties": {}},
+            read_only=read_only
+        ))
+        return func
+    return decorator
+
+
+class ToolRegistry:
+    """Name -> Tool mapping with a cached, pre-serialized tools/list result"""
+
+    def __init__(self):
+        self._tools: Dict[str, Tool] = {}
+        self._list_result: Optional[bytes] = None
+
+    @classmethod
+    def from_object(cls, obj: Any) -> "ToolRegistry":
+        """Build a registry from the @mcp_tool methods of an object"""
+        registry = cls()
+        for klass in reversed(type(obj).__mro__):
+            for attr_name, func in vars(klass).items():
+                declaration = getattr(func, _TOOL_ATTR, None)
+                if declaration is not None:
+                    registry.register(Tool(
+                        name=declaration.name,
+                        description=declaration.description,
+                        input_schema=declaration.input_schema,
+                        handler=getattr(obj, attr_name),
+                        read_only=declaration.read_only
+                    ))
+        return registry
+
+    def register(self, tool: Tool):
+        """Add or replace a tool"""
+        if tool.handler is None:
+            raise ValueError(f"Tool {tool.name} has no handler")
+        self._tools[tool.name] = tool
+        self._list_result = None
+
+    def unregister(self, name: str) -> bool:
+        """Remove a tool"""
+        if self._tools.pop(name, None) is None:
+            return False
+        self._list_result = None
+        return True
+
+    def get(self, name: str) -> Optional[Tool]:
+        return self._tools.get(name)
+
+    def list_tools(self) -> List[Dict[str, Any]]:
+        return [tool.to_dict() for tool in self._tools.values()]
+
+    def list_result(self) -> bytes:
+        """Serialized tools/list result (rebuilt only after registry changes)"""
+        if self._list_result is None:
+            self._list_result = dumps_bytes({"tools": self.list_tools()})
+        return self._list_result
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def __iter__(self) -> Iterator[Tool]:
+        return iter(self._tools.values())
+
+    def __len__(self) -> int:
+        return len(self._tools)
@@ -0,0 +1,237 @@
+"""
+Event-driven stdio transport for the MCP server.
+
+stdin is read as raw bytes and split into JSON-RPC frames by an incremental
+parser that accepts both Content-Length framed messages and newline-delimited
+JSON (NDJSON). The transport waits on the event loop instead of polling, so an
+idle server uses no CPU and a frame is dispatched as soon as its last byte
+arrives.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+from typing import AsyncIterator, BinaryIO, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Framing kinds; responses are written back with the framing of the request
+CONTENT_LENGTH = "content-length"
+NDJSON = "ndjson"
+
+Frame = Tuple[bytes, str]
+
+_WHITESPACE = b" \t\r\n"
+_JSON_START = b"{["
+_HEADER_TERMINATORS = (b"\r\n\r\n", b"\n\n")
+
+
+class FrameError(ValueError):
+    """Raised for a malformed frame header"""
+
+
+class FrameParser:
+    """Incremental parser for Content-Length and NDJSON framed messages"""
+
+    def __init__(self, max_frame_size: int = 64 * 1024 * 1024):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._body_length: Optional[int] = None  # set once headers are parsed
+        self._discard = 0  # bytes left of an oversized body being skipped
+        self._scan_from = 0  # resume offset for delimiter searches
+
+    def feed(self, data: bytes) -> List[Frame]:
+        """Feed received bytes and return every frame completed by them
+
+        Malformed frames are logged and dropped; parsing resumes after them.
+        """
+        self._buffer += data
+        frames = []
+        while True:
+            try:
+                frame = self._next_frame()
+            except FrameError as e:
+                logger.error(f"Dropping malformed frame: {e}")
+                continue
+            if frame is None:
+                return frames
+            frames.append(frame)
+
+    @property
+    def buffered(self) -> int:
+        """Number of bytes waiting for the rest of their frame"""
+        return len(self._buffer)
+
+    def _next_frame(self) -> Optional[Frame]:
+        buf = self._buffer
+
+        if self._discard:
+            dropped = min(self._discard, len(buf))
+            del buf[:dropped]
+            self._discard -= dropped
+            if self._discard:
+                return None
+
+        if self._body_length is not None:
+            if len(buf) < self._body_length:
+                return None
+            body = bytes(buf[:self._body_length])
+            del buf[:self._body_length]
+            self._body_length = None
+            return body, CONTENT_LENGTH
+
+        # Skip blank lines between frames
+        start = 0
+        while start < len(buf) and buf[start] in _WHITESPACE:
+            start += 1
+        if start:
+            del buf[:start]
+            self._scan_from = max(self._scan_from - start, 0)
+        if not buf:
+            return None
+
+        if buf[0] in _JSON_START:
+            end = buf.find(b"\n", self._scan_from)
+            if end < 0:
+                self._check_size(len(buf))
+                self._scan_from = len(buf)
+                return None
+            line = bytes(buf[:end]).rstrip(b"\r")
+            del buf[:end + 1]
+            self._scan_from = 0
+            return line, NDJSON
+
+        return self._parse_headers()
+
+    def _parse_headers(self) -> Optional[Frame]:
+        buf = self._buffer
+        search_from = max(self._scan_from - 3, 0)
+        matches = [
+            (pos, len(term)) for term in _HEADER_TERMINATORS
+            for pos in (buf.find(term, search_from),) if pos >= 0
+        ]
+        if not matches:
+            self._check_size(len(buf))
+            self._scan_from = len(buf)
+            return None
+
+        end, terminator_length = min(matches)
+        header_block = bytes(buf[:end]).decode("ascii", errors="replace")
+        del buf[:end + terminator_length]
+        self._scan_from = 0
+
+        length = None
+        for line in header_block.splitlines():
+            key, sep, value = line.partition(":")
+            if sep and key.strip().lower() == "content-length":
+                try:
+                    length = int(value.strip())
+                except ValueError:
+                    raise FrameError(f"Invalid Content-Length: {value.strip()!r}")
+
+        if length is None:
+            raise FrameError(f"Missing Content-Length header: {header_block!r}")
+        if length < 0:
+            raise FrameError(f"Invalid Content-Length: {length}")
+        if length > self.max_frame_size:
+            self._discard = length
+            raise FrameError(f"Frame exceeds {self.max_frame_size} bytes")
+
+        self._body_length = length
+        return self._next_frame()
+
+    def _check_size(self, size: int):
+        # An unterminated line or header block this large cannot be recovered
+        if size > self.max_frame_size:
+            self._buffer.clear()
+            self._scan_from = 0
+            raise FrameError(f"Frame exceeds {self.max_frame_size} bytes")
+
+
+def encode_frame(body: bytes, framing: str = CONTENT_LENGTH) -> bytes:
+    """Wrap a serialized JSON-RPC message for the given framing"""
+    if framing == NDJSON:
+        return body + b"\n"
+    return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+
+class _StdinProtocol(asyncio.Protocol):
+    def __init__(self, transport: "StdioTransport"):
+        self._owner = transport
+
+    def data_received(self, data: bytes):
+        self._owner._on_data(data)
+
+    def eof_received(self):
+        self._owner._on_eof()
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self._owner._on_eof()
+
+
+class StdioTransport:
+    """Asynchronous frame reader/writer over the process stdin/stdout"""
+
+    def __init__(self,
+                 stdin: Optional[BinaryIO] = None,
+                 stdout: Optional[BinaryIO] = None,
+                 chunk_size: int = 65536):
+        self._stdin = stdin if stdin is not None else sys.stdin.buffer
+        self._stdout = stdout if stdout is not None else sys.stdout.buffer
+        self.chunk_size = chunk_size
+        self.parser = FrameParser()
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._eof = False
+
+    async def start(self):
+        """Start reading stdin on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+        try:
+            pipe = os.fdopen(self._stdin.fileno(), "rb", buffering=0, closefd=False)
+            await self._loop.connect_read_pipe(lambda: _StdinProtocol(self), pipe)
+            logger.debug("Reading stdin through the event loop")
+        except (ValueError, OSError, NotImplementedError) as e:
+            # Regular files and Windows consoles cannot be registered with the loop;
+            # a blocking reader thread hands chunks over instead (still no polling)
+            logger.debug(f"Falling back to threaded stdin reader: {e}")
+            threading.Thread(target=self._read_blocking, name="mcp-stdin", daemon=True).start()
+
+    def _read_blocking(self):
+        fd = self._stdin.fileno()
+        while True:
+            try:
+                data = os.read(fd, self.chunk_size)
+            except OSError as e:
+                logger.error(f"Error reading stdin: {e}")
+                data = b""
+            if not data:
+                self._loop.call_soon_threadsafe(self._on_eof)
+                return
+            self._loop.call_soon_threadsafe(self._on_data, data)
+
+    def _on_data(self, data: bytes):
+        for frame in self.parser.feed(data):
+            self._queue.put_nowait(frame)
+
+    def _on_eof(self):
+        if not self._eof:
+            self._eof = True
+            self._queue.put_nowait(None)
+
+    async def frames(self) -> AsyncIterator[Frame]:
+        """Yield (body, framing) pairs until stdin is closed"""
+        while True:
+            frame = await self._queue.get()
+            if frame is None:
+                return
+            yield frame
+
+    def write(self, body: bytes, framing: str = CONTENT_LENGTH):
+        """Write one serialized message to stdout"""
+        self._stdout.write(encode_frame(body, framing))
+        self._stdout.flush()
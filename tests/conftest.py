@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# context_engineering modules import each other as top-level modules
+for path in (ROOT, os.path.join(ROOT, "context_engineering")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
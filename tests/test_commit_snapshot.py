@@ -0,0 +1,142 @@
+import pytest
+
+from context_models import ContextElement, ContextType, ContextWindow
+
+
+def _window(*contents):
+    window = ContextWindow(max_tokens=100000)
+    for content in contents:
+        window.add_element(ContextElement(id=content, content=content, type=ContextType.USER))
+    return window
+
+
+def _ids(window):
+    return [element.id for element in window.elements]
+
+
+def _contents(window):
+    return [element.content for element in window.elements]
+
+
+def test_commit_without_concurrent_changes_replaces_elements():
+    live = _window("a", "b", "c")
+    snapshot = live.snapshot()
+    snapshot.remove_element("b")
+    snapshot.replace_element(0, content="A")
+    result = live.commit_snapshot(snapshot)
+    assert not result["rebased"]
+    assert _contents(live) == ["A", "c"]
+
+
+def test_commit_requires_a_snapshot():
+    with pytest.raises(ValueError):
+        _window("a").commit_snapshot(_window("a"))
+
+
+def test_concurrent_appends_and_removals_are_kept():
+    live = _window("a", "b", "c")
+    snapshot = live.snapshot()
+    snapshot.replace_element(0, content="A")
+    live.add_element(ContextElement(id="d", content="d"))
+    live.remove_element("c")
+    result = live.commit_snapshot(snapshot)
+    assert result["rebased"]
+    assert result["concurrent_appends"] == 1 and result["concurrent_removals"] == 1
+    assert _contents(live) == ["A", "b", "d"]
+
+
+def test_live_replacement_wins_over_unchanged_snapshot_element():
+    live = _window("a", "b")
+    live.elements[1] = ContextElement(id="b", content="long original b", compressed_content="b")
+    live.use_compressed(1)
+    snapshot = live.snapshot()
+    snapshot.replace_element(0, content="A")
+    assert live.restore_original("b")  # concurrent: back to the original content
+    live.commit_snapshot(snapshot)
+    assert _contents(live) == ["A", "long original b"]
+
+
+def test_both_sides_changed_keeps_live_version_and_counts_conflict():
+    live = _window("a", "b")
+    snapshot = live.snapshot()
+    snapshot.replace_element(1, content="snapshot b")
+    with live.lock:
+        live.replace_element(1, content="live b")
+        live.version += 1
+    result = live.commit_snapshot(snapshot)
+    assert result["conflicts"] == 1
+    assert _contents(live) == ["a", "live b"]
+
+
+def test_snapshot_removal_of_a_concurrently_changed_element_is_undone():
+    live = _window("a", "b", "c")
+    snapshot = live.snapshot()
+    snapshot.remove_elements({"b"})
+    with live.lock:
+        live.replace_element(1, content="edited b")
+        live.version += 1
+    result = live.commit_snapshot(snapshot)
+    assert result["conflicts"] == 1
+    assert _contents(live) == ["a", "edited b", "c"]
+
+
+def test_duplicate_is_restored_when_its_kept_copy_was_removed_concurrently():
+    live = _window("x", "dup1", "y", "dup2", "dup3")
+    snapshot = live.snapshot()
+    snapshot.remove_elements({"dup2", "dup3"}, kept_in={"dup2": "dup1", "dup3": "dup1"})
+    live.remove_element("dup1")  # the user removes the copy dedupe kept
+    result = live.commit_snapshot(snapshot)
+    assert result["restored_duplicates"] == 1
+    assert _ids(live) == ["x", "y", "dup2"]
+
+
+def test_duplicate_removal_stands_when_kept_copy_survives():
+    live = _window("dup1", "dup2", "other")
+    snapshot = live.snapshot()
+    snapshot.remove_elements({"dup2"}, kept_in={"dup2": "dup1"})
+    live.remove_element("other")
+    result = live.commit_snapshot(snapshot)
+    assert result["restored_duplicates"] == 0
+    assert _ids(live) == ["dup1"]
+
+
+def test_duplicate_removal_stands_when_snapshot_itself_removed_kept_copy():
+    live = _window("dup1", "dup2", "other")
+    snapshot = live.snapshot()
+    snapshot.remove_elements({"dup2"}, kept_in={"dup2": "dup1"})
+    snapshot.remove_element("dup1")  # e.g. a later low-priority removal
+    live.add_element(ContextElement(id="new", content="new"))
+    live.commit_snapshot(snapshot)
+    assert _ids(live) == ["other", "new"]
+
+
+def test_merge_is_undone_when_merged_element_conflicts():
+    live = _window("p", "q")
+    snapshot = live.snapshot()
+    snapshot.replace_element(0, content="p + q")
+    snapshot.remove_element("q", kept_in="p")
+    with live.lock:
+        live.replace_element(0, content="live p")
+        live.version += 1
+    result = live.commit_snapshot(snapshot)
+    assert result["conflicts"] == 1 and result["restored_duplicates"] == 1
+    assert _contents(live) == ["live p", "q"]
+
+
+def test_window_fields_are_copied_only_when_the_snapshot_changed_them():
+    live = _window("a")
+    live.template_id = "t1"
+    snapshot = live.snapshot()
+    snapshot.optimization_history.append({"run": "snapshot"})
+    live.template_id = "t2"
+    live.quality_metrics = {"score": 0.9}
+    live.optimization_history.append({"run": "concurrent"})
+    live.commit_snapshot(snapshot)
+    assert live.template_id == "t2"
+    assert live.quality_metrics == {"score": 0.9}
+    assert live.optimization_history == [{"run": "concurrent"}, {"run": "snapshot"}]
+
+    snapshot = live.snapshot()
+    snapshot.quality_metrics = {"score": 0.1}
+    live.commit_snapshot(snapshot)
+    assert live.quality_metrics == {"score": 0.1}
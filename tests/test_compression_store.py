@@ -0,0 +1,90 @@
+from compression_store import CompressionStore, variant_key
+from context_models import ContextElement, ContextType, ContextWindow
+
+
+def test_variant_key_uses_exact_content_method_and_rounded_ratio():
+    assert variant_key("a b", "llm", 0.5) == variant_key("a b", "llm", 0.501)
+    assert variant_key("a b", "llm", 0.5) != variant_key("a  b", "llm", 0.5)
+    assert variant_key("a b", "llm", 0.5) != variant_key("a b", "extractive", 0.5)
+    assert variant_key("a b", "llm", 0.5) != variant_key("a b", "llm", 0.3)
+
+
+def test_least_recently_used_entries_are_evicted_by_count():
+    store = CompressionStore(max_entries=2)
+    store.put("a", "A")
+    store.put("b", "B")
+    assert store.get("a") == "A"  # b is now the oldest
+    store.put("c", "C")
+    assert store.get("b") is None
+    assert store.get("a") == "A" and store.get("c") == "C"
+    assert store.stats()["evictions"] == 1
+
+
+def test_entries_are_evicted_by_total_characters():
+    store = CompressionStore(max_chars=10)
+    store.put("a", "x" * 4)
+    store.put("b", "y" * 4)
+    store.put("c", "z" * 4)
+    assert len(store) == 2 and store.get("a") is None
+    assert store.stats()["chars"] == 8
+
+    store.put("b", "y")  # replacing frees the old value's characters
+    assert store.stats()["chars"] == 5
+
+    store.put("huge", "h" * 11)  # larger than the whole store: not kept, nothing evicted
+    assert store.get("huge") is None and len(store) == 2
+
+
+def test_stats_count_hits_and_misses():
+    store = CompressionStore()
+    store.put("a", "A")
+    store.get("a")
+    store.get("b")
+    stats = store.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+    store.clear()
+    assert len(store) == 0 and store.stats()["chars"] == 0
+
+
+def _window(max_tokens, *elements):
+    window = ContextWindow(max_tokens=max_tokens, reserved_tokens=0)
+    for content, priority, compressed in elements:
+        window.add_element(ContextElement(id=content.split()[0], content=content, type=ContextType.USER,
+                                          priority=priority, compressed_content=compressed))
+    return window
+
+
+def test_optimize_for_tokens_switches_to_compressed_variants_before_removing():
+    long = "alpha " + "word " * 19
+    window = _window(1000, (long, 5, "alpha short"), ("beta " + "word " * 19, 1, None))
+    window.max_tokens = 30  # 40 words; the variant brings it to 22
+    result = window.optimize_for_tokens()
+    assert result["compressed_elements"] == ["alpha"]
+    assert result["removed_elements"] == []
+    assert [element.content for element in window.elements] == ["alpha short", "beta " + "word " * 19]
+    assert window.elements[0].original_content == long
+    assert window.restore_original("alpha")
+    assert window.elements[0].content == long
+
+
+def test_optimize_for_tokens_removes_lowest_priority_when_variants_are_not_enough():
+    window = _window(1000,
+                     ("alpha " + "word " * 19, 5, "alpha short"),
+                     ("beta " + "word " * 19, 1, None),
+                     ("gamma " + "word " * 9, 3, None))
+    window.max_tokens = 20
+    result = window.optimize_for_tokens()
+    assert result["compressed_elements"] == ["alpha"]
+    assert result["removed_elements"] == ["beta"]
+    assert [element.id for element in window.elements] == ["alpha", "gamma"]
+    assert result["tokens_saved"] > 0
+
+
+def test_optimize_for_tokens_compresses_low_priority_elements_first():
+    window = _window(1000,
+                     ("alpha " + "word " * 19, 9, "alpha short"),
+                     ("beta " + "word " * 19, 1, "beta short"))
+    window.max_tokens = 40  # one variant is enough
+    result = window.optimize_for_tokens()
+    assert result["compressed_elements"] == ["beta"]
+    assert window.elements[0].original_content is None
@@ -0,0 +1,161 @@
+import pytest
+
+import content_fingerprint
+from content_fingerprint import (
+    DEDUPE_EXACT, DEDUPE_NEAR, MATCH_CONTAINED, MATCH_EXACT, MATCH_NEAR,
+    DuplicateDetector, content_hash, normalize, simhash
+)
+from context_models import ContextElement, ContextType, ContextWindow
+
+LONG = ("the deployment pipeline builds the image runs the integration tests "
+        "and pushes the release to the staging cluster before anyone approves it")
+
+
+def _near_detector(texts, threshold=6):
+    return DuplicateDetector(DEDUPE_NEAR, threshold, text_of=lambda key: texts[key])
+
+
+def _check(detector, texts, key, text):
+    texts[key] = normalized = normalize(text)
+    return detector.check(key, content_hash(normalized), simhash(normalized), normalized)
+
+
+def test_exact_duplicate_ignores_case_and_whitespace():
+    detector = DuplicateDetector()
+    assert detector.check("a", content_hash(normalize("Hello   World"))) is None
+    assert detector.check("b", content_hash(normalize("hello world\n"))) == (MATCH_EXACT, "a", 0)
+    assert detector.check("c", content_hash(normalize("hello there"))) is None
+
+
+def test_near_duplicate_within_threshold():
+    texts = {}
+    detector = _near_detector(texts)
+    assert _check(detector, texts, "a", LONG) is None
+    match = _check(detector, texts, "b", LONG.replace("tests", "specs"))
+    assert match[:2] == (MATCH_NEAR, "a")
+    assert 0 < match[2] <= 6
+
+
+def test_unrelated_text_is_not_matched():
+    texts = {}
+    detector = _near_detector(texts)
+    assert _check(detector, texts, "a", LONG) is None
+    assert _check(detector, texts, "b", "a completely different note about lunch plans for friday "
+                                        "and who is bringing the dessert this week") is None
+
+
+def test_prefix_and_suffix_are_contained():
+    texts = {}
+    detector = _near_detector(texts, threshold=0)
+    words = LONG.split()
+    assert _check(detector, texts, "a", LONG) is None
+    assert _check(detector, texts, "b", " ".join(words[:12])) == (MATCH_CONTAINED, "a", 0)
+    assert _check(detector, texts, "c", " ".join(words[-12:])) == (MATCH_CONTAINED, "a", 0)
+
+
+def test_short_texts_are_never_contained():
+    texts = {}
+    detector = _near_detector(texts, threshold=0)
+    words = LONG.split()
+    assert _check(detector, texts, "a", LONG) is None
+    assert _check(detector, texts, "b", " ".join(words[:content_fingerprint.CONTAINMENT_WORDS - 1])) is None
+
+
+def test_precomputed_containment_keys_fetch_text_only_for_candidates():
+    texts = {"a": normalize(LONG), "b": normalize(LONG.split(" and ")[0]), "c": normalize("x " * 20)}
+    fetched = []
+
+    def text_of(key):
+        fetched.append(key)
+        return texts[key]
+
+    detector = DuplicateDetector(DEDUPE_NEAR, 0, text_of=text_of)
+    for key in ("a", "b", "c"):
+        normalized = texts[key]
+        match = detector.check(key, content_hash(normalized), simhash(normalized),
+                               containment=content_fingerprint.containment_keys(normalized))
+        if key == "b":
+            assert match == (MATCH_CONTAINED, "a", 0)
+        else:
+            assert match is None
+    assert "c" not in fetched
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"mode": "fuzzy"},
+    {"mode": DEDUPE_NEAR, "threshold": 16, "text_of": str},
+    {"mode": DEDUPE_EXACT, "threshold": -1},
+    {"mode": DEDUPE_NEAR},
+])
+def test_invalid_settings_raise(kwargs):
+    with pytest.raises(ValueError):
+        DuplicateDetector(**kwargs)
+
+
+def _element_window(content):
+    window = ContextWindow(max_tokens=100000)
+    window.add_element(ContextElement(id="e", content=content, type=ContextType.USER))
+    return window
+
+
+def test_element_caches_fingerprints_for_its_content(monkeypatch):
+    window = _element_window(LONG)
+    element = window.elements[0]
+    digest = element.content_hash()
+    fingerprint = element.near_fingerprint()
+    assert digest == content_hash(normalize(LONG))
+    assert fingerprint[0] == simhash(normalize(LONG))
+
+    calls = []
+    monkeypatch.setattr(content_fingerprint, "simhash", lambda text: calls.append(text) or 0)
+    assert element.content_hash() == digest
+    assert element.near_fingerprint() == fingerprint
+    assert calls == []
+
+
+def test_replaced_elements_do_not_inherit_fingerprints():
+    window = _element_window(LONG)
+    window.elements[0].near_fingerprint()
+
+    replaced = window.replace_element(0, content="something else entirely")
+    assert replaced.content_hash() == content_hash("something else entirely")
+
+    compressed = window.use_compressed(0, "short")
+    assert compressed.content_hash() == content_hash("short")
+    assert compressed.near_fingerprint()[0] == simhash("short")
+
+    assert window.restore_original("e")
+    assert window.elements[0].content_hash() == content_hash("something else entirely")
+
+
+def test_fingerprints_follow_in_place_content_changes():
+    element = ContextElement(id="e", content="first text", type=ContextType.USER)
+    element.content_hash()
+    element.content = "second text"
+    assert element.content_hash() == content_hash("second text")
+
+
+def test_fingerprints_are_not_serialized():
+    window = _element_window(LONG)
+    window.elements[0].near_fingerprint()
+    assert "_fingerprints" not in window.elements[0].to_dict()
+
+
+def test_near_mode_work_per_element_is_bounded(monkeypatch):
+    comparisons = []
+    distance = content_fingerprint.hamming_distance
+    monkeypatch.setattr(content_fingerprint, "hamming_distance",
+                        lambda a, b: comparisons.append(1) or distance(a, b))
+    detector = DuplicateDetector(DEDUPE_NEAR, 6, text_of=lambda key: "")
+    bound = (6 + 1) * content_fingerprint.MAX_BAND_CANDIDATES
+    for key in range(10000):
+        digest = content_hash(str(key))
+        comparisons.clear()
+        detector.check(key, digest, digest >> 64)
+        assert len(comparisons) <= bound
+    assert all(len(bucket) <= content_fingerprint.MAX_BAND_CANDIDATES
+               for buckets in detector._band_index for bucket in buckets.values())
+
+    # a recent near duplicate is still found
+    fingerprint = content_hash("9999") >> 64
+    assert detector.check("late", content_hash("late"), fingerprint ^ 1)[:2] == (MATCH_NEAR, 9999)
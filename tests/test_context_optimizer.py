@@ -0,0 +1,109 @@
+import asyncio
+
+from context_models import ContextElement, ContextType, ContextWindow
+from context_optimizer import ContextOptimizer
+
+BOILERPLATE = "This message was generated by the nightly build system."
+
+
+class _FakeModel:
+    def __init__(self, text="short summary"):
+        self.text = text
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+
+        class Response:
+            text = self.text
+        return Response()
+
+
+def _optimizer(model=None):
+    optimizer = ContextOptimizer("test-key")
+    optimizer.model = model or _FakeModel()
+    return optimizer
+
+
+def _window(*contents, priority=9):
+    window = ContextWindow(max_tokens=100000)
+    for content in contents:
+        window.add_element(ContextElement(content=content, type=ContextType.USER, priority=priority))
+    return window
+
+
+def _optimize(optimizer, window, goals, constraints):
+    async def scenario():
+        task = await optimizer.optimize_context_window(window, goals, constraints)
+        while task.status.value in ("pending", "in_progress"):
+            await asyncio.sleep(0.001)
+        await optimizer.shutdown()
+        return task
+    return asyncio.run(scenario())
+
+
+def _unique_sentences(count):
+    return " ".join(" ".join(f"word{i}x{j}" for j in range(7)).capitalize() + "." for i in range(count))
+
+
+def test_hybrid_keeps_boilerplate_of_elements_sent_to_the_llm():
+    # The first element misses the extractive target and goes to the LLM, which drops the
+    # boilerplate; the second must therefore keep it.
+    deferred = BOILERPLATE + " " + (
+        "The deployment of the analytics service was postponed because the database migration that "
+        "reorganizes the reporting tables is still waiting for review by the platform team"
+    )
+    window = _window(deferred, BOILERPLATE + " " + _unique_sentences(6))
+    task = _optimize(_optimizer(), window, ["reduce_tokens"], {
+        "compression_mode": "hybrid", "compression_ratio": 0.2, "target_token_reduction": 0.9, "min_tokens": 1,
+        "preserve_element_types": ["user"]
+    })
+    assert task.error_message is None
+    assert [element.content for element in window.elements] == ["short summary", BOILERPLATE]
+
+
+def _compression_run(optimizer, content):
+    window = _window(content, content + " again")
+    task = _optimize(optimizer, window, ["reduce_tokens"], {
+        "target_token_reduction": 0.9, "min_tokens": 1, "preserve_element_types": ["user"]
+    })
+    assert task.error_message is None
+    return window, task.result["token_reduction"]["strategies_applied"]
+
+
+def _llm_strategy(strategies):
+    return next(strategy for strategy in strategies if strategy["strategy"] == "content_compression")
+
+
+def test_llm_compression_reuses_cached_variants():
+    model = _FakeModel()
+    content = _unique_sentences(6)
+    first = _optimizer(model)
+    window, strategies = _compression_run(first, content)
+    assert len(model.prompts) == 2
+    assert [element.content for element in window.elements] == ["short summary"] * 2
+
+    # Same contents in another window (and task): no model call
+    second = _optimizer(model)
+    second.compression_store = first.compression_store
+    window, strategies = _compression_run(second, content)
+    assert len(model.prompts) == 2
+    compression = _llm_strategy(strategies)
+    assert compression["model_calls"] == 0
+    assert [element["source"] for element in compression["compressed_elements"]] == ["cache", "cache"]
+    assert [element.content for element in window.elements] == ["short summary"] * 2
+
+
+def test_elements_holding_a_variant_switch_to_it_without_a_model_call():
+    model = _FakeModel()
+    content = _unique_sentences(6)
+    window = _window(content)
+    window.elements[0] = ContextElement(content=content, type=ContextType.USER, priority=9,
+                                        compressed_content="kept variant")
+    task = _optimize(_optimizer(model), window, ["reduce_tokens"], {
+        "target_token_reduction": 0.5, "min_tokens": 1, "preserve_element_types": ["user"]
+    })
+    assert task.error_message is None
+    assert model.prompts == []
+    assert window.elements[0].content == "kept variant"
+    assert window.elements[0].original_content == content
@@ -0,0 +1,100 @@
+import pytest
+
+from extractive_compression import ExtractiveCompressor, split_sentences, strip_fillers
+
+BOILERPLATE = "This message was generated by the nightly build system."
+
+
+@pytest.mark.parametrize("sentence", [
+    "Do you know the password for the staging server?",
+    "I mean what I say.",
+    "The sort of the list is stable.",
+    "Literally means word for word.",
+    "This kind of error is actually rare.",
+    "Simply put the tray on the table.",
+    "At the end of the day the shop closes.",
+    "The change is basically correct.",
+    "基本的な設定を確認してください。",
+])
+def test_meaningful_words_are_kept(sentence):
+    assert strip_fillers(sentence) == sentence
+
+
+@pytest.mark.parametrize("sentence, expected", [
+    ("We cached it in order to save time.", "We cached it to save time."),
+    ("In order to deploy, run make.", "To deploy, run make."),
+    ("Basically, the cache was cold.", "The cache was cold."),
+    ("We, basically, restarted the server.", "We restarted the server."),
+    ("It is worth noting that the limit is per user.", "The limit is per user."),
+    ("Please note that builds run nightly.", "Builds run nightly."),
+    ("At the end of the day, tests decide.", "Tests decide."),
+    ("まあ、問題はありません。", "問題はありません。"),
+])
+def test_fillers_are_stripped(sentence, expected):
+    assert strip_fillers(sentence) == expected
+
+
+def test_split_sentences_keeps_separators():
+    assert split_sentences("One. Two!\nThree。四") == [
+        ("One.", " "), ("Two!", "\n"), ("Three。", ""), ("四", " ")
+    ]
+
+
+def _text(count):
+    return " ".join(
+        f"Sentence {index} talks about the cache layer and request number {index} in detail."
+        for index in range(count)
+    )
+
+
+def test_compress_respects_ratio_and_order():
+    text = _text(20)
+    result = ExtractiveCompressor(0.5).compress(text)
+    assert result.met
+    assert result.length <= len(text) * 0.5
+    kept = [sentence for sentence, _ in split_sentences(result.content)]
+    assert kept == [sentence for sentence, _ in split_sentences(text) if sentence in kept]
+
+
+def test_code_fences_are_left_alone():
+    assert ExtractiveCompressor().compress("```python\nprint(1)\n```\n" + _text(10)) is None
+
+
+def test_small_reduction_returns_none():
+    assert ExtractiveCompressor(0.5).compress("A single sentence cannot lose any of its sentences") is None
+
+
+def test_BOILERPLATE_is_dropped_across_calls():
+    text = BOILERPLATE + " Short tail."
+    assert ExtractiveCompressor(0.9).compress(text).content == BOILERPLATE
+
+    compressor = ExtractiveCompressor(0.9)
+    compressor.accept(compressor.compress(text))
+    assert compressor.compress(BOILERPLATE + " Another tail.").content == "Another tail."
+
+
+def test_results_that_are_not_accepted_hide_nothing():
+    text = BOILERPLATE + " Short tail."
+    compressor = ExtractiveCompressor(0.9)
+    compressor.compress(text)
+    assert compressor.compress(BOILERPLATE + " Another tail.").content == BOILERPLATE
+
+
+def test_only_kept_sentences_count_as_repeats():
+    compressor = ExtractiveCompressor(0.3)
+    result = compressor.compress(_text(6) + " " + BOILERPLATE)
+    assert BOILERPLATE not in result.content
+    assert result.repeat_keys
+    assert all("nightly" not in key for key in result.repeat_keys)
+
+
+def test_japanese_text_is_compressed():
+    text = "".join(f"キャッシュ層の設計について説明します{index}。" for index in range(20))
+    result = ExtractiveCompressor(0.5).compress(text)
+    assert result is not None
+    assert result.length <= len(text) * 0.5
+
+
+def test_invalid_ratio_raises():
+    with pytest.raises(ValueError):
+        ExtractiveCompressor(1.5)
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+
+import pytest
+
+from compression_store import CompressionStore
+from context_models import ContextElement, ContextType
+from hierarchical_summary import FALLBACK_WORDS, MapReduceSummarizer, chunk_elements
+
+
+class _Model:
+    def __init__(self, fail_on=None):
+        self.prompts = []
+        self.fail_on = fail_on
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt):
+        with self._lock:
+            self.prompts.append(prompt)
+            number = len(self.prompts)
+        if self.fail_on is not None and self.fail_on in prompt:
+            raise RuntimeError("model unavailable")
+
+        class Response:
+            text = f"summary{number}"
+        return Response()
+
+
+def _elements(count, words=4, start=0):
+    return [ContextElement(content=" ".join(f"e{index}w{word}" for word in range(words)), type=ContextType.USER)
+            for index in range(start, start + count)]
+
+
+def _summarizer(model, **kwargs):
+    # 13 tokens = 10 words: two 5-word elements ("[user]" + 4 words) per chunk
+    return MapReduceSummarizer(model, chunk_tokens=13, store=CompressionStore(), **kwargs)
+
+
+def _summarize(summarizer, elements):
+    return asyncio.run(summarizer.summarize(elements))
+
+
+def test_chunks_stay_within_the_budget():
+    chunks = chunk_elements(_elements(5), budget_tokens=13)
+    assert len(chunks) == 3
+    assert all(len(chunk.split()) <= 10 for chunk in chunks)
+    assert chunks[0] == "[user] e0w0 e0w1 e0w2 e0w3\n\n[user] e1w0 e1w1 e1w2 e1w3"
+
+
+def test_oversized_elements_are_split_on_word_boundaries():
+    chunks = chunk_elements(_elements(1) + _elements(1, words=24, start=1) + _elements(1, start=2), 13)
+    assert [len(chunk.split()) for chunk in chunks] == [5, 10, 10, 5, 5]
+    assert chunks[1].startswith("[user] e1w0")
+
+
+def test_single_chunk_needs_no_reduce():
+    model = _Model()
+    summary = _summarize(_summarizer(model), _elements(2))
+    assert (summary.text, summary.chunks, summary.levels, summary.model_calls) == ("summary1", 1, 0, 1)
+
+
+def test_summaries_are_reduced_in_groups_of_fan_in():
+    model = _Model()
+    summary = _summarize(_summarizer(model, fan_in=8), _elements(40))
+    # 20 chunks -> 3 groups (8, 8, 4) -> 1
+    assert (summary.chunks, summary.levels, summary.model_calls, summary.cache_hits) == (20, 2, 24, 0)
+    reduce_prompts = model.prompts[20:23]
+    group_sizes = sorted(sum(f"({index}) " in prompt for index in range(1, 21)) for prompt in reduce_prompts)
+    assert group_sizes == [4, 8, 8]
+    assert any("(17) " in prompt and "(20) " in prompt and "(16) " not in prompt for prompt in reduce_prompts)
+    assert summary.text == "summary24"
+
+
+def test_appending_resummarizes_only_the_tail_and_its_reduce_path():
+    model = _Model()
+    summarizer = _summarizer(model, fan_in=8)
+    elements = _elements(40)
+    _summarize(summarizer, elements)
+
+    again = _summarize(summarizer, elements)
+    assert (again.model_calls, again.cache_hits) == (0, 24)
+
+    grown = _summarize(summarizer, elements + _elements(1, start=40))
+    # new chunk 21, its group (17-21) and the top reduce
+    assert (grown.chunks, grown.model_calls, grown.cache_hits) == (21, 3, 22)
+
+
+def test_failed_chunks_fall_back_to_leading_words_and_are_not_cached():
+    model = _Model(fail_on="e2w0")
+    summarizer = _summarizer(model)
+    summary = _summarize(summarizer, _elements(4))
+    assert summary.model_calls == 3
+    reduce_prompt = model.prompts[-1]
+    assert "[user] e2w0 e2w1 e2w2 e2w3 [user] e3w0" in reduce_prompt
+
+    again = _summarize(summarizer, _elements(4))
+    assert again.model_calls == 2  # the failed chunk and the reduce over it
+    assert again.cache_hits == 1
+
+
+def test_fallback_is_bounded():
+    model = _Model(fail_on="e0w0")
+    summarizer = MapReduceSummarizer(model, chunk_tokens=10 ** 6, store=CompressionStore())
+    summary = _summarize(summarizer, _elements(1, words=FALLBACK_WORDS * 2))
+    assert len(summary.text.split()) == FALLBACK_WORDS
+
+
+def test_fan_in_must_be_at_least_two():
+    with pytest.raises(ValueError):
+        MapReduceSummarizer(_Model(), fan_in=1)
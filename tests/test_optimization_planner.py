@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from context_models import ContextElement, ContextType, ContextWindow
+from optimization_planner import (
+    COMPRESSION_MIN_LENGTH, GOALS, STAGE_CLARITY, STAGE_COMPRESSION, STAGE_DEDUPE,
+    STAGE_EXTRACTIVE_COMPRESSION, STAGE_PRIORITY_REMOVAL, STAGE_RELEVANCE, STAGE_SEMANTIC_MERGE,
+    STAGE_STRUCTURE, STAGES, OptimizationPlan, WindowFeatures, estimate_llm_calls
+)
+
+LONG = "word " * (COMPRESSION_MIN_LENGTH // 5 + 10)
+
+
+def _window(*contents, type=ContextType.USER):
+    window = ContextWindow(max_tokens=10 ** 6)
+    for content in contents:
+        window.add_element(ContextElement(content=content, type=type))
+    return window
+
+
+def _plan(window, goals=GOALS, **constraints):
+    features = WindowFeatures(window.elements)
+    return OptimizationPlan(goals, constraints, window, features), features
+
+
+def _names(plan):
+    return [stage.name for stage in plan.stages]
+
+
+def test_local_stages_run_before_llm_stages():
+    plan, _ = _plan(_window(LONG, LONG, LONG))
+    names = _names(plan)
+    assert names[:3] == [STAGE_DEDUPE, STAGE_STRUCTURE, STAGE_PRIORITY_REMOVAL]
+    assert not any(stage.uses_llm for stage in plan.stages[:3])
+    assert all(stage.uses_llm for stage in plan.stages[3:])
+
+
+def test_llm_stages_are_ordered_by_estimated_calls():
+    # three long elements: compression 3, clarity 3, relevance 4, pairwise merge 7 calls
+    plan, _ = _plan(_window(LONG, LONG, LONG))
+    assert _names(plan)[3:] == [STAGE_COMPRESSION, STAGE_CLARITY, STAGE_RELEVANCE, STAGE_SEMANTIC_MERGE]
+
+    # one long element: nothing to merge, relevance now costs the most
+    plan, _ = _plan(_window(LONG))
+    assert _names(plan)[3:] == [STAGE_SEMANTIC_MERGE, STAGE_COMPRESSION, STAGE_CLARITY, STAGE_RELEVANCE]
+
+
+def test_compression_mode_selects_the_compression_stages():
+    window = _window(LONG)
+    assert STAGE_EXTRACTIVE_COMPRESSION not in _names(_plan(window, ["reduce_tokens"])[0])
+    assert _names(_plan(window, ["reduce_tokens"], compression_mode="extractive")[0]) == [
+        STAGE_DEDUPE, STAGE_EXTRACTIVE_COMPRESSION, STAGE_PRIORITY_REMOVAL
+    ]
+    assert _names(_plan(window, ["reduce_tokens"], compression_mode="hybrid")[0]) == [
+        STAGE_DEDUPE, STAGE_EXTRACTIVE_COMPRESSION, STAGE_PRIORITY_REMOVAL, STAGE_COMPRESSION
+    ]
+    with pytest.raises(ValueError):
+        _plan(window, ["reduce_tokens"], compression_mode="magic")
+
+
+def test_stages_are_planned_once_and_unknown_goals_are_ignored():
+    plan, _ = _plan(_window(LONG, LONG), ["remove_redundancy", "reduce_tokens", "no_such_goal"])
+    assert plan.goals == ["reduce_tokens", "remove_redundancy"]
+    assert _names(plan).count(STAGE_DEDUPE) == 1
+
+
+def test_target_tokens():
+    window = _window(*["word " * 100] * 4)
+    plan, features = _plan(window, ["reduce_tokens"], target_token_reduction=0.5, min_tokens=10)
+    assert plan.target_tokens == int(features.total_tokens * 0.5)
+    plan, _ = _plan(window, ["reduce_tokens"], target_token_reduction=0.99, min_tokens=100)
+    assert plan.target_tokens == 100
+
+
+def _stage(name):
+    return next(stage for stage in STAGES if stage.name == name)
+
+
+def test_skip_reasons():
+    single = _window("short")
+    plan, features = _plan(single, ["reduce_tokens"])  # below min_tokens already
+    assert plan.skip_reason(_stage(STAGE_DEDUPE), single, features) == "goal already met"
+    plan, features = _plan(single)
+    assert plan.skip_reason(_stage(STAGE_STRUCTURE), single, features) == "fewer than two elements"
+    assert plan.skip_reason(_stage(STAGE_CLARITY), single, features) == "no element long enough to rewrite"
+
+    window = _window("short", "also short", type=ContextType.SYSTEM)
+    plan, features = _plan(window, min_tokens=0, target_token_reduction=0.5,
+                           preserve_element_types=["system"])
+    assert plan.skip_reason(_stage(STAGE_PRIORITY_REMOVAL), window, features) == "no removable elements"
+    assert plan.skip_reason(_stage(STAGE_COMPRESSION), window, features) == "no uncompressed element long enough"
+    assert plan.skip_reason(_stage(STAGE_DEDUPE), window, features) is None
+
+    empty = _window()
+    plan, features = _plan(empty, ["enhance_relevance"])
+    assert plan.skip_reason(_stage(STAGE_RELEVANCE), empty, features) == "no elements"
+
+
+def test_estimated_llm_calls():
+    window = _window(LONG, LONG, "short")
+    features = WindowFeatures(window.elements)
+    assert estimate_llm_calls(_stage(STAGE_COMPRESSION), window, features) == 2
+    assert estimate_llm_calls(_stage(STAGE_RELEVANCE), window, features) == 4
+    assert estimate_llm_calls(_stage(STAGE_SEMANTIC_MERGE), window, features) == 7
+    assert estimate_llm_calls(_stage(STAGE_DEDUPE), window, features) == 0
+    features.compressed.add(window.elements[0].id)
+    assert estimate_llm_calls(_stage(STAGE_COMPRESSION), window, features) == 1
+
+
+def test_execute_skips_stages_once_the_goal_is_met():
+    window = _window(LONG, LONG, LONG)
+    plan, features = _plan(window, ["reduce_tokens"], target_token_reduction=0.5, min_tokens=0)
+    calls = []
+
+    async def dedupe(window, features, plan):
+        calls.append(STAGE_DEDUPE)
+        for element in window.elements[1:]:
+            features.removed(element)
+        window.remove_elements([element.id for element in window.elements[1:]])
+        return {"removed": 2}
+
+    async def unexpected(window, features, plan):
+        raise AssertionError("stage should have been skipped")
+
+    runners = {STAGE_DEDUPE: dedupe, STAGE_PRIORITY_REMOVAL: unexpected, STAGE_COMPRESSION: unexpected}
+    progress = []
+    outcomes, pipeline = asyncio.run(plan.execute(window, features, runners, lambda: progress.append(1)))
+
+    assert calls == [STAGE_DEDUPE]
+    assert outcomes == {STAGE_DEDUPE: {"removed": 2}}
+    assert len(progress) == 3
+    reports = pipeline["stages"]
+    assert [(report["stage"], report["status"]) for report in reports] == [
+        (STAGE_DEDUPE, "completed"), (STAGE_PRIORITY_REMOVAL, "skipped"), (STAGE_COMPRESSION, "skipped")
+    ]
+    assert reports[0]["tokens_before"] == pipeline["original_tokens"]
+    assert reports[0]["tokens_after"] == pipeline["final_tokens"] == pipeline["original_tokens"] / 3
+    assert reports[2]["reason"] == "goal already met"
+    assert pipeline["stages_run"] == 1 and pipeline["stages_skipped"] == 2
+    assert pipeline["estimated_llm_calls"] == 0
+
+
+def test_execute_reports_estimated_llm_calls_of_stages_that_run():
+    window = _window(LONG, LONG)
+    plan, features = _plan(window, ["reduce_tokens"], target_token_reduction=0.5, min_tokens=0,
+                           preserve_element_types=["user"])
+
+    async def noop(window, features, plan):
+        return {}
+
+    runners = {STAGE_DEDUPE: noop, STAGE_COMPRESSION: noop}
+    outcomes, pipeline = asyncio.run(plan.execute(window, features, runners))
+    assert sorted(outcomes) == [STAGE_COMPRESSION, STAGE_DEDUPE]
+    assert [report["status"] for report in pipeline["stages"]] == ["completed", "skipped", "completed"]
+    assert pipeline["stages"][2]["estimated_llm_calls"] == 2
+    assert pipeline["estimated_llm_calls"] == 2
@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+import optimization_scheduler
+from context_models import ContextWindow, OptimizationStatus, OptimizationTask
+from optimization_scheduler import OptimizationScheduler, QueueFullError
+
+
+class _Harness:
+    def __init__(self, delay=0.0, **options):
+        self.tasks = {}
+        self.order = []
+        self.events = []
+        self.delay = delay
+        self.interrupted = []
+        self.scheduler = OptimizationScheduler(
+            self.tasks, self.execute, self.on_interrupted, self.emit, **options
+        )
+
+    async def execute(self, task, window):
+        self.order.append(task.optimization_type)
+        await asyncio.sleep(self.delay)
+        task.status = OptimizationStatus.COMPLETED
+
+    def on_interrupted(self, task, window):
+        self.interrupted.append(task.id)
+
+    def emit(self, event, task):
+        self.events.append((event, task.optimization_type))
+
+    def submit(self, name, tenant="default", priority=5, timeout=None):
+        task = OptimizationTask(optimization_type=name)
+        self.scheduler.submit(task, ContextWindow(), tenant=tenant, priority=priority, timeout=timeout)
+        return task
+
+    async def drain(self):
+        while self.scheduler._workers:
+            await asyncio.gather(*list(self.scheduler._workers))
+
+
+def test_tenants_are_served_round_robin():
+    async def scenario():
+        harness = _Harness(max_workers=1)
+        for i in range(3):
+            harness.submit(f"a{i}", tenant="a")
+        harness.submit("b0", tenant="b")
+        harness.submit("c0", tenant="c")
+        await harness.drain()
+        return harness.order
+
+    assert asyncio.run(scenario()) == ["a0", "b0", "c0", "a1", "a2"]
+
+
+def test_priority_then_submission_order_within_a_tenant():
+    async def scenario():
+        harness = _Harness(max_workers=1)
+        harness.submit("low", priority=1)
+        harness.submit("high1", priority=9)
+        harness.submit("mid", priority=5)
+        harness.submit("high2", priority=9)
+        await harness.drain()
+        return harness.order
+
+    assert asyncio.run(scenario()) == ["high1", "high2", "mid", "low"]
+
+
+def test_worker_count_is_bounded():
+    async def scenario():
+        harness = _Harness(delay=0.01, max_workers=2)
+        for i in range(6):
+            harness.submit(str(i))
+        assert harness.scheduler._worker_count == 2
+        await asyncio.sleep(0)
+        assert harness.scheduler.running == 2
+        await harness.drain()
+        return harness.scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler.running == 0 and scheduler.queued == 0
+
+
+def test_queue_limit():
+    async def scenario():
+        harness = _Harness(max_workers=1, max_queued=2)
+        harness.submit("a")
+        harness.submit("b")
+        with pytest.raises(QueueFullError):
+            harness.submit("c")
+        await harness.drain()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_queued_and_running():
+    async def scenario():
+        harness = _Harness(delay=10, max_workers=1)
+        running = harness.submit("running")
+        queued = harness.submit("queued")
+        while not harness.order:  # let the first job start
+            await asyncio.sleep(0)
+        assert harness.scheduler.cancel(queued.id)
+        assert harness.scheduler.cancel(running.id)
+        assert not harness.scheduler.cancel(running.id)
+        await harness.drain()
+        return harness, running, queued
+
+    harness, running, queued = asyncio.run(scenario())
+    assert running.status == queued.status == OptimizationStatus.CANCELLED
+    assert harness.order == ["running"]
+    assert harness.interrupted == [running.id]
+
+
+def test_timeout_fails_the_task():
+    async def scenario():
+        harness = _Harness(delay=10, max_workers=1)
+        task = harness.submit("slow", timeout=0.01)
+        await harness.drain()
+        return task
+
+    task = asyncio.run(scenario())
+    assert task.status == OptimizationStatus.FAILED
+    assert "Timed out" in task.error_message
+
+
+def test_finished_tasks_are_evicted_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(optimization_scheduler.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        harness = _Harness(max_workers=1, task_ttl=60)
+        first = harness.submit("first")
+        await harness.drain()
+        assert first.id in harness.tasks
+
+        now[0] += 61
+        second = harness.submit("second")
+        assert first.id not in harness.tasks
+        await harness.drain()
+        assert second.id in harness.tasks
+
+    asyncio.run(scenario())
+
+
+def test_max_finished_bounds_the_task_table():
+    async def scenario():
+        harness = _Harness(max_workers=1, max_finished=2)
+        tasks = [harness.submit(str(i)) for i in range(4)]
+        await harness.drain()
+        return harness, tasks
+
+    harness, tasks = asyncio.run(scenario())
+    assert set(harness.tasks) == {tasks[2].id, tasks[3].id}
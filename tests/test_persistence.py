@@ -0,0 +1,123 @@
+import threading
+
+from context_engineering_mcp.persistence import StateStore, decode_record, encode_record
+from context_models import ContextElement, ContextSession, ContextType
+
+
+def _populate(store, elements=3):
+    """Log a session with one window and `elements` elements; returns (session, window)"""
+    session = ContextSession(name="s")
+    store.append("create_session", session=session)
+    window = session.create_window(max_tokens=10000)
+    store.append("create_window", session_id=session.id, window=window)
+    for i in range(elements):
+        element = ContextElement(content=f"element {i}", type=ContextType.USER)
+        window.append_element(element)
+        store.append("add_element", window_id=window.id, element=element)
+    return session, window
+
+
+def _wal_path(state_dir):
+    (path,) = state_dir.glob("wal-*.log")
+    return path
+
+
+def test_encode_decode_round_trip():
+    record = {"seq": 1, "op": "add_element", "value": "ü"}
+    line = encode_record(record)
+    assert decode_record(line) == record
+    assert decode_record(line[:-1]) is None  # no newline: torn
+    assert decode_record(b"00000000" + line[8:]) is None  # CRC mismatch
+
+
+def test_replay_without_snapshot(tmp_path):
+    store = StateStore(tmp_path)
+    store.recover()
+    _, window = _populate(store)
+    store.close(compact=False)
+
+    sessions, windows = StateStore(tmp_path).recover()
+    assert len(sessions) == 1
+    assert [e.content for e in windows[window.id].elements] == ["element 0", "element 1", "element 2"]
+
+
+def test_truncated_last_record_is_dropped_and_wal_truncated(tmp_path):
+    store = StateStore(tmp_path)
+    store.recover()
+    _, window = _populate(store)
+    store.close(compact=False)
+
+    wal = _wal_path(tmp_path)
+    data = wal.read_bytes()
+    wal.write_bytes(data[:-7])  # crash in the middle of the last append
+
+    recovered = StateStore(tmp_path)
+    _, windows = recovered.recover()
+    assert [e.content for e in windows[window.id].elements] == ["element 0", "element 1"]
+    last_line_start = data.rstrip(b"\n").rfind(b"\n") + 1
+    assert wal.stat().st_size == last_line_start
+
+    # Appends after recovery continue the sequence and replay cleanly
+    element = ContextElement(content="after crash", type=ContextType.USER)
+    recovered.append("add_element", window_id=window.id, element=element)
+    recovered.close(compact=False)
+    _, windows = StateStore(tmp_path).recover()
+    assert [e.content for e in windows[window.id].elements] == ["element 0", "element 1", "after crash"]
+
+
+def test_corrupt_record_stops_replay(tmp_path):
+    store = StateStore(tmp_path)
+    store.recover()
+    _, window = _populate(store)
+    store.close(compact=False)
+
+    wal = _wal_path(tmp_path)
+    lines = wal.read_bytes().splitlines(keepends=True)
+    lines[3] = lines[3].replace(b"element 1", b"element X")  # payload no longer matches its CRC
+    wal.write_bytes(b"".join(lines))
+
+    _, windows = StateStore(tmp_path).recover()
+    assert [e.content for e in windows[window.id].elements] == ["element 0"]
+
+
+def test_snapshot_plus_wal_tail(tmp_path):
+    store = StateStore(tmp_path)
+    sessions, _ = store.recover()
+    lock = threading.RLock()
+    session, window = _populate(store)
+    sessions[session.id] = session
+    store.attach(lock, lambda: list(sessions.values()))
+    store.compact()
+
+    element = ContextElement(content="tail", type=ContextType.USER)
+    window.append_element(element)
+    store.append("add_element", window_id=window.id, element=element)
+    store.close(compact=False)
+
+    assert (tmp_path / "snapshot.json").exists()
+    _, windows = StateStore(tmp_path).recover()
+    assert [e.content for e in windows[window.id].elements][-2:] == ["element 2", "tail"]
+    assert len(windows[window.id].elements) == 4
+
+
+def test_compaction_waits_for_a_commit_in_progress(tmp_path):
+    store = StateStore(tmp_path)
+    sessions, _ = store.recover()
+    session, window = _populate(store, elements=1)
+    sessions[session.id] = session
+    store.attach(threading.RLock(), lambda: list(sessions.values()))
+
+    # A commit holds only the window lock (not the state lock) while it swaps elements
+    with window.lock:
+        compaction = threading.Thread(target=store.compact)
+        compaction.start()
+        window.elements = []
+        compaction.join(0.2)
+        assert compaction.is_alive()
+        window.elements = [ContextElement(content="committed", type=ContextType.USER)]
+        window.version += 1
+    compaction.join()
+    store.close(compact=False)
+
+    _, windows = StateStore(tmp_path).recover()
+    assert [e.content for e in windows[window.id].elements] == ["committed"]
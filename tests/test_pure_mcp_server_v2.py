@@ -0,0 +1,165 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from context_engineering_mcp.engine_host import EngineHost
+from context_engineering_mcp.pure_mcp_server_v2 import PurePythonMCPServer
+from context_engineering_mcp.transport import NDJSON
+from context_models import OptimizationTask
+
+
+def _call(server, tool, **arguments):
+    response = server.handle_tool_call({"id": 1, "params": {"name": tool, "arguments": arguments}})
+    return json.loads(response["result"]["content"][0]["text"])
+
+
+def test_read_only_tools_see_consistent_state_during_mutations(tmp_path):
+    server = PurePythonMCPServer(max_concurrency=8, engines=EngineHost(data_dir=tmp_path))
+    session_id = _call(server, "create_context_session", name="s")["session_id"]
+    window_id = _call(server, "create_context_window", session_id=session_id, max_tokens=10 ** 7)["window_id"]
+    errors = []
+    done = threading.Event()
+
+    def mutate():
+        for _ in range(300):
+            _call(server, "create_context_window", session_id=session_id)
+            _call(server, "add_context_element", window_id=window_id, content="word " * 5)
+        done.set()
+
+    def read():
+        while not done.is_set():
+            for name, arguments in (("get_context_stats", {}), ("get_context_window", {"window_id": window_id})):
+                result = _call(server, name, **arguments)
+                if "error" in result:
+                    errors.append(result["error"])
+
+    threads = [threading.Thread(target=mutate)] + [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    stats = _call(server, "get_context_stats")
+    assert stats["windows"] == 301
+    assert stats["total_elements"] == 300
+    assert len(_call(server, "get_context_window", window_id=window_id)["elements"]) == 300
+
+
+class _FakeTransport:
+    def __init__(self, *messages):
+        self.frames_in = [(json.dumps(message).encode(), NDJSON) for message in messages]
+        self.written = []
+
+    async def start(self):
+        pass
+
+    async def frames(self):
+        for frame in self.frames_in:
+            yield frame
+
+    def write(self, body, framing=NDJSON):
+        self.written.append(json.loads(body))
+
+
+def _serve(server, *messages):
+    transport = _FakeTransport(*messages)
+    asyncio.run(server.serve(transport))
+    return transport.written
+
+
+def _request(request_id, method, **params):
+    message = {"jsonrpc": "2.0", "method": method, "params": params}
+    if request_id is not None:
+        message["id"] = request_id
+    return message
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_batch_gets_one_reply_array_without_notifications(tmp_path, max_concurrency):
+    server = PurePythonMCPServer(max_concurrency=max_concurrency, engines=EngineHost(data_dir=tmp_path))
+    written = _serve(server, [
+        _request(1, "tools/list"),
+        _request(None, "notifications/initialized"),
+        _request(2, "tools/call", name="get_context_stats", arguments={}),
+        _request(None, "tools/call", name="create_context_session", arguments={"name": "quiet"}),
+        7,
+        _request(3, "no/such/method"),
+    ])
+    assert len(written) == 1
+    replies = written[0]
+    assert [reply.get("id") for reply in replies] == [1, 2, None, 3]
+    assert "tools" in replies[0]["result"]
+    assert "result" in replies[1]
+    assert replies[2]["error"]["code"] == -32600
+    assert replies[3]["error"]["code"] == -32601
+    assert len(server.engines.sessions) == 1  # the notification still ran
+
+
+def test_empty_batch_is_an_invalid_request(tmp_path):
+    server = PurePythonMCPServer(max_concurrency=4, engines=EngineHost(data_dir=tmp_path))
+    written = _serve(server, [])
+    assert len(written) == 1
+    assert written[0]["id"] is None and written[0]["error"]["code"] == -32600
+
+
+def test_batch_of_notifications_gets_no_reply(tmp_path):
+    server = PurePythonMCPServer(max_concurrency=4, engines=EngineHost(data_dir=tmp_path))
+    written = _serve(server, [
+        _request(None, "notifications/initialized"),
+        _request(None, "tools/call", name="create_context_session", arguments={"name": "a"}),
+    ])
+    assert written == []
+    assert len(server.engines.sessions) == 1
+
+
+def test_batch_tool_calls_run_concurrently_and_reply_in_order(tmp_path):
+    server = PurePythonMCPServer(max_concurrency=4, engines=EngineHost(data_dir=tmp_path))
+    second_started = threading.Event()
+    overlapped = []
+    handle_tool_call = server.handle_tool_call
+
+    def handle(request):
+        if request["id"] == 1:
+            overlapped.append(second_started.wait(timeout=5))
+        else:
+            second_started.set()
+        return handle_tool_call(request)
+
+    server.handle_tool_call = handle
+    written = _serve(server, [
+        _request(1, "tools/call", name="get_context_stats", arguments={}),
+        _request(2, "tools/call", name="get_context_stats", arguments={}),
+    ])
+    assert overlapped == [True]  # the first call finished only after the second had started
+    assert [reply["id"] for reply in written[0]] == [1, 2]
+
+
+def test_mutating_batch_calls_apply_in_batch_order(tmp_path):
+    server = PurePythonMCPServer(max_concurrency=4, engines=EngineHost(data_dir=tmp_path))
+    names = [f"s{index}" for index in range(10)]
+    written = _serve(server, [
+        _request(index, "tools/call", name="create_context_session", arguments={"name": name})
+        for index, name in enumerate(names)
+    ])
+    assert [reply["id"] for reply in written[0]] == list(range(10))
+    assert [session.name for session in server.engines.sessions.values()] == names
+
+
+def test_optimization_status_is_copied_on_the_engine_loop(tmp_path, monkeypatch):
+    engines = EngineHost(gemini_api_key="test-key", data_dir=tmp_path)
+    server = PurePythonMCPServer(engines=engines)
+    task = OptimizationTask(context_id="w", optimization_type="reduce_tokens", progress=0.5)
+    engines.optimizer.optimization_tasks[task.id] = task
+    threads = []
+    to_dict = OptimizationTask.to_dict
+    monkeypatch.setattr(OptimizationTask, "to_dict",
+                        lambda self: threads.append(threading.current_thread().name) or to_dict(self))
+
+    status = _call(server, "get_optimization_status", task_id=task.id)
+    assert status == json.loads(json.dumps(to_dict(task)))
+    assert threads == ["engine-loop"]
+    assert "error" in _call(server, "get_optimization_status", task_id="no-such-task")
+    engines.close()
@@ -0,0 +1,55 @@
+import pytest
+
+from template_engine import (
+    MISSING_EMPTY, MISSING_ERROR, MISSING_KEEP, MissingVariableError, compile_template, render
+)
+
+
+def test_substitution_and_variable_order():
+    template = compile_template("Hello {name}, {greeting} {name}!")
+    assert template.variables == ("name", "greeting")
+    assert template.render({"name": "Ann", "greeting": "hi"}) == "Hello Ann, hi Ann!"
+
+
+def test_double_braces_escape_placeholders():
+    assert render("{{name}} is {name}", {"name": "x"}) == "{name} is x"
+
+
+def test_other_braces_are_literal():
+    source = 'JSON: {"key": 1} {} { name } {name}'
+    assert render(source, {"name": "v"}) == 'JSON: {"key": 1} {} { name } v'
+
+
+def test_values_are_not_rescanned():
+    assert render("{a} {b}", {"a": "{b}", "b": "B"}) == "{b} B"
+
+
+def test_missing_keep_leaves_placeholder():
+    assert render("a {x} b", {}, MISSING_KEEP) == "a {x} b"
+
+
+def test_missing_empty_substitutes_nothing():
+    assert render("a {x} b", {}, MISSING_EMPTY) == "a  b"
+
+
+def test_missing_error_lists_each_variable_once():
+    with pytest.raises(MissingVariableError) as info:
+        render("{x} {y} {x} {z}", {"y": 1}, MISSING_ERROR)
+    assert info.value.missing == ["x", "z"]
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        render("{x}", {}, "ignore")
+
+
+@pytest.mark.parametrize("source, variables, missing", [
+    ("word{a}word {b}", {"a": "X", "b": "two words"}, MISSING_KEEP),
+    ("{a} {b}", {"a": " leading", "b": ""}, MISSING_KEEP),
+    ("x {a} y {missing}", {"a": "v"}, MISSING_EMPTY),
+    ("x {a} y {missing}", {"a": "v"}, MISSING_KEEP),
+    ("{{esc}} {a}", {"a": 3}, MISSING_KEEP),
+])
+def test_word_count_matches_rendering(source, variables, missing):
+    template = compile_template(source)
+    assert template.word_count(variables, missing) == len(template.render(variables, missing).split())
@@ -0,0 +1,83 @@
+from context_models import PromptTemplate
+from template_index import TemplateIndex, tokenize
+
+
+def _template(name, description="", tags=(), category="general", usage=0, quality=0.0):
+    return PromptTemplate(name=name, description=description, tags=list(tags), category=category,
+                          usage_count=usage, quality_score=quality)
+
+
+def _index(*templates):
+    index = TemplateIndex()
+    index.add_many(templates)
+    return index
+
+
+def test_tokenize_words_and_cjk_bigrams():
+    assert tokenize("Code Review, v2") == ["code", "review", "v2"]
+    assert tokenize("要約する") == ["要約", "約す", "する"]
+
+
+def test_name_matches_outrank_description_matches():
+    in_name = _template("summary helper")
+    in_description = _template("helper", description="writes a summary")
+    index = _index(in_description, in_name)
+    assert [template_id for template_id, _ in index.search("summary")] == [in_name.id, in_description.id]
+
+
+def test_rare_terms_weigh_more():
+    common = [_template(f"review {i}") for i in range(5)]
+    rare = _template("security review")
+    index = _index(*common, rare)
+    assert index.search("security review")[0][0] == rare.id
+
+
+def test_prefix_matches_at_a_discount():
+    exact = _template("sum")
+    prefixed = _template("summarize")
+    index = _index(prefixed, exact)
+    results = dict(index.search("sum"))
+    assert set(results) == {exact.id, prefixed.id}
+    assert results[exact.id] > results[prefixed.id]
+    assert index.search("xyz") == []
+
+
+def test_prefix_search_sees_terms_added_later():
+    index = _index(_template("alpha"))
+    index.search("al")  # builds the sorted term list
+    added = _template("almanac")
+    index.add(added)
+    assert added.id in dict(index.search("alm"))
+
+
+def test_search_limit_and_tie_order():
+    first, second = _template("same"), _template("same")
+    index = _index(first, second)
+    assert [template_id for template_id, _ in index.search("same")] == [first.id, second.id]
+    assert len(index.search("same", limit=1)) == 1
+
+
+def test_reindexing_replaces_old_text():
+    template = _template("old name")
+    index = _index(template)
+    template.name = "new name"
+    index.add(template)
+    assert index.search("old") == []
+    assert index.search("new")[0][0] == template.id
+
+
+def test_ordered_by_usage_then_quality_with_filters():
+    a = _template("a", usage=5, quality=0.1, tags=["x"])
+    b = _template("b", usage=5, quality=0.9, category="special")
+    c = _template("c", usage=9, tags=["x", "y"])
+    index = _index(a, b, c)
+    assert index.ordered() == [c.id, b.id, a.id]
+    assert index.ordered(category="special") == [b.id]
+    assert index.ordered(tags=["x"]) == [c.id, a.id]
+
+    a.usage_count = 20
+    index.update_rank(a)
+    assert index.ordered() == [a.id, c.id, b.id]
+    index.remove(c.id)
+    assert index.ordered(tags=["y"]) == []
+    assert index.stats()["total_templates"] == 2
@@ -0,0 +1,145 @@
+import pytest
+
+import template_batch
+from context_models import ContextWindow, PromptTemplate
+from template_batch import read_rows
+from template_engine import MISSING_EMPTY, MISSING_ERROR, MISSING_KEEP
+from template_manager import ContextTemplateIntegrator, TemplateManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = TemplateManager(storage_path=str(tmp_path), usage_flush_interval=0)
+    yield manager
+    manager.close()
+
+
+def _create(manager, source):
+    return manager.create_template(PromptTemplate(name="t", description="", template=source))
+
+
+def _lines(*lines):
+    return [line + "\n" for line in lines]
+
+
+def _batch(manager, template_id, lines, format="ndjson", **kwargs):
+    return [result.to_dict() for result in
+            manager.render_batch(template_id, read_rows(lines, format), **kwargs)]
+
+
+def test_ndjson_rows(manager):
+    template_id = _create(manager, "Hello {name}")
+    results = _batch(manager, template_id, _lines('{"name": "Ann"}', "", '{"name": "Bob "}'))
+    assert results == [
+        {"index": 0, "rendered_content": "Hello Ann"},
+        {"index": 1, "rendered_content": "Hello Bob "},
+    ]
+    assert manager.get_template(template_id).usage_count == 2
+
+
+def test_csv_rows(manager):
+    template_id = _create(manager, "{greeting}, {name}")
+    results = _batch(manager, template_id, _lines("greeting,name", "Hi,Ann", '"Hello, there",Bob'), "csv")
+    assert [result["rendered_content"] for result in results] == ["Hi, Ann", "Hello, there, Bob"]
+
+
+def test_invalid_rows_yield_errors_and_the_batch_goes_on(manager):
+    template_id = _create(manager, "Hello {name}")
+    results = _batch(manager, template_id, _lines('{"name": "Ann"}', "{not json", "[1, 2]", '{"name": "Cy"}'))
+    assert results[0] == {"index": 0, "rendered_content": "Hello Ann"}
+    assert results[1]["index"] == 1 and results[1]["error"].startswith("Invalid JSON on line 2")
+    assert results[2] == {"index": 2, "error": "Row is not an object"}
+    assert results[3] == {"index": 3, "rendered_content": "Hello Cy"}
+    assert manager.get_template(template_id).usage_count == 2
+
+
+@pytest.mark.parametrize("missing, expected", [
+    (MISSING_KEEP, {"index": 0, "rendered_content": "a {x} b"}),
+    (MISSING_EMPTY, {"index": 0, "rendered_content": "a  b"}),
+])
+def test_missing_variable_modes(manager, missing, expected):
+    template_id = _create(manager, "a {x} b")
+    assert _batch(manager, template_id, _lines("{}"), missing=missing) == [expected]
+
+
+def test_missing_error_reports_the_variables(manager):
+    template_id = _create(manager, "{x} {y}")
+    [result] = _batch(manager, template_id, _lines('{"y": 1}'), missing=MISSING_ERROR)
+    assert result["index"] == 0 and result["missing"] == ["x"]
+    assert manager.get_template(template_id).usage_count == 0
+
+
+def test_unknown_missing_mode_and_template(manager):
+    template_id = _create(manager, "{x}")
+    with pytest.raises(ValueError):
+        manager.render_batch(template_id, [], "ignore")
+    assert manager.render_batch("no-such-template", []) is None
+
+
+def test_workers_keep_input_order(manager, monkeypatch):
+    monkeypatch.setattr(template_batch.os, "cpu_count", lambda: 4)  # use the pool on small machines too
+    template_id = _create(manager, "row {n}")
+    rows = [{"n": n} for n in range(50)]
+    results = list(manager.render_batch(template_id, rows, workers=2, chunk_size=4))
+    assert [result.content for result in results] == [f"row {n}" for n in range(50)]
+    assert manager.get_template(template_id).usage_count == 50
+
+
+def test_usage_counts_rows_rendered_before_the_stream_is_cut_off(manager):
+    template_id = _create(manager, "row {n}")
+    results = manager.render_batch(template_id, ({"n": n} for n in range(100)), chunk_size=10)
+    for _ in range(3):
+        next(results)
+    results.close()
+    assert manager.get_template(template_id).usage_count == 3
+
+
+def _apply(manager, source, variables, max_tokens, **kwargs):
+    template_id = _create(manager, source)
+    window = ContextWindow(max_tokens=max_tokens, reserved_tokens=0)
+    ContextTemplateIntegrator(manager).apply_template_to_context(window, template_id, variables, **kwargs)
+    return window
+
+
+def _words(count, prefix="w"):
+    return " ".join(f"{prefix}{index}" for index in range(count))
+
+
+def test_fit_fail_raises_without_adding(manager):
+    template_id = _create(manager, "A {doc}")
+    window = ContextWindow(max_tokens=10, reserved_tokens=0)
+    with pytest.raises(ValueError, match="token limit exceeded"):
+        ContextTemplateIntegrator(manager).apply_template_to_context(window, template_id, {"doc": _words(20)})
+    assert window.elements == []
+    assert manager.get_template(template_id).usage_count == 0
+
+
+def test_fit_truncate_cuts_the_overflow_from_the_end(manager):
+    # 24 words fit in 32 tokens; 1 + 30 words must lose 7
+    window = _apply(manager, "A {doc}", {"doc": _words(30)}, 32, fit="truncate", truncatable=["doc"])
+    [element] = window.elements
+    assert element.content == "A " + _words(23)
+    assert element.metadata["truncated_variables"] == {"doc": 7}
+    assert element.token_count <= 32
+
+
+def test_fit_truncate_shares_the_overflow_between_occurrences(manager):
+    # 2 + 2 * 20 words, 24 fit: each occurrence loses 9 words, not 18
+    window = _apply(manager, "A {doc} B {doc}", {"doc": _words(20)}, 32, fit="truncate", truncatable=["doc"])
+    [element] = window.elements
+    assert element.metadata["truncated_variables"] == {"doc": 9}
+    assert len(element.content.split()) == 24
+
+
+def test_fit_truncate_goes_through_variables_in_order(manager):
+    variables = {"first": _words(10, "f"), "second": _words(30, "s"), "absent": _words(50, "x")}
+    window = _apply(manager, "{first} {second}", variables, 32, fit="truncate",
+                    truncatable=["absent", "second", "first"])
+    [element] = window.elements
+    assert element.metadata["truncated_variables"] == {"second": 16}
+    assert element.content == _words(10, "f") + " " + _words(14, "s")
+
+
+def test_fit_truncate_fails_when_truncatable_variables_are_not_enough(manager):
+    with pytest.raises(ValueError, match="token limit exceeded"):
+        _apply(manager, _words(30) + " {doc}", {"doc": "short"}, 32, fit="truncate", truncatable=["doc"])
@@ -0,0 +1,141 @@
+import json
+
+import pytest
+
+from context_models import PromptTemplate, PromptTemplateType
+from template_manager import TemplateManager
+from template_store import DB_FILE_NAME, TemplateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TemplateStore(tmp_path / DB_FILE_NAME)
+    yield store
+    store.close()
+
+
+def _template(name="t", body="Hello {name}", **fields):
+    template = PromptTemplate(name=name, description=f"{name} description", template=body,
+                              type=PromptTemplateType.CHAT, tags=["a", "b"], created_by="user", **fields)
+    template.variables = template.extract_variables()
+    return template
+
+
+def _reopen(store):
+    store.close()
+    return TemplateStore(store.path)
+
+
+def test_round_trip_keeps_metadata_and_body(store):
+    original = _template(usage_count=3, quality_score=0.5, category="qa")
+    store.save(original)
+    store = _reopen(store)
+    [loaded] = store.load_all()
+    for field in ("id", "name", "description", "variables", "type", "category", "tags",
+                  "usage_count", "quality_score", "created_by", "created_at", "updated_at"):
+        assert getattr(loaded, field) == getattr(original, field)
+    assert loaded.template == "Hello {name}"
+    store.close()
+
+
+def test_bodies_load_on_first_access(store):
+    store.save(_template())
+    [loaded] = store.load_all()
+    assert not loaded.body_loaded
+
+    calls = []
+    load_body = loaded._body_loader
+    loaded._body_loader = lambda template_id: calls.append(template_id) or load_body(template_id)
+    assert loaded.template == "Hello {name}"
+    assert loaded.template == "Hello {name}"
+    assert loaded.body_loaded
+    assert calls == [loaded.id]
+
+
+def test_setting_the_body_does_not_load_it(store):
+    store.save(_template())
+    [loaded] = store.load_all()
+    loaded._body_loader = None  # would fail if called
+    loaded.template = "Bye {name}"
+    assert loaded.template == "Bye {name}"
+
+
+def test_update_usage_and_delete_survive_reopen(store):
+    kept, updated, deleted = _template("kept"), _template("updated"), _template("deleted")
+    store.save_many([kept, updated, deleted])
+
+    updated.template = "Changed {x}"
+    updated.usage_count = 7
+    store.save(updated)
+    kept.usage_count = 2
+    store.save_usage([kept])
+    store.delete(deleted.id)
+
+    store = _reopen(store)
+    loaded = {template.name: template for template in store.load_all()}
+    assert sorted(loaded) == ["kept", "updated"]
+    assert loaded["updated"].template == "Changed {x}"
+    assert loaded["updated"].usage_count == 7
+    assert loaded["kept"].usage_count == 2
+    assert loaded["kept"].template == "Hello {name}"
+    store.close()
+
+
+def test_missing_body_raises(store):
+    with pytest.raises(ValueError):
+        store.load_body("no-such-template")
+
+
+def test_meta_values(store):
+    assert store.get_meta("json_imported_at") is None
+    store.set_meta("json_imported_at", "now")
+    store = _reopen(store)
+    assert store.get_meta("json_imported_at") == "now"
+    store.close()
+
+
+def _write_json_template(directory, template):
+    manager_dict = TemplateManager._template_to_dict(None, template)
+    (directory / f"{template.id}.json").write_text(json.dumps(manager_dict), encoding="utf-8")
+
+
+def test_json_templates_are_imported_once(tmp_path):
+    legacy = _template("legacy", usage_count=4)
+    _write_json_template(tmp_path, legacy)
+
+    manager = TemplateManager(storage_path=str(tmp_path), usage_flush_interval=0)
+    imported = manager.get_template(legacy.id)
+    assert imported.name == "legacy" and imported.usage_count == 4
+    assert imported.template == "Hello {name}"
+    assert manager.store.get_meta("json_imported_at") is not None
+    manager.delete_template(legacy.id)
+    manager.close()
+
+    # The JSON file is left in place but not imported again
+    assert (tmp_path / f"{legacy.id}.json").exists()
+    manager = TemplateManager(storage_path=str(tmp_path), usage_flush_interval=0)
+    assert manager.get_template(legacy.id) is None
+    manager.close()
+
+
+def test_manager_changes_survive_reopen(tmp_path):
+    manager = TemplateManager(storage_path=str(tmp_path), usage_flush_interval=0)
+    template_id = manager.create_template(_template("mine"))
+    defaults = len(manager.templates) - 1
+    manager.update_template(template_id, template="Now {a} and {b}")
+    manager.render_template(template_id, {"a": 1, "b": 2})
+    manager.close()
+
+    manager = TemplateManager(storage_path=str(tmp_path), usage_flush_interval=0)
+    template = manager.get_template(template_id)
+    assert not template.body_loaded
+    assert template.variables == ["a", "b"]
+    assert template.usage_count == 1
+    assert template.template == "Now {a} and {b}"
+    assert len(manager.templates) == defaults + 1  # defaults are not created again
+    assert manager.delete_template(template_id)
+    manager.close()
+
+    manager = TemplateManager(storage_path=str(tmp_path), usage_flush_interval=0)
+    assert manager.get_template(template_id) is None
+    manager.close()
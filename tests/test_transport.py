@@ -0,0 +1,61 @@
+import json
+
+from context_engineering_mcp.transport import CONTENT_LENGTH, NDJSON, FrameParser, encode_frame
+
+
+def _message(id_):
+    return json.dumps({"jsonrpc": "2.0", "id": id_, "method": "ping"}).encode()
+
+
+def test_content_length_frame_split_across_reads():
+    parser = FrameParser()
+    data = encode_frame(_message(1))
+    frames = []
+    for i in range(len(data)):
+        frames.extend(parser.feed(data[i:i + 1]))
+    assert frames == [(_message(1), CONTENT_LENGTH)]
+    assert parser.buffered == 0
+
+
+def test_partial_frame_is_kept_until_complete():
+    parser = FrameParser()
+    data = encode_frame(_message(1))
+    assert parser.feed(data[:-5]) == []
+    assert parser.buffered > 0
+    assert parser.feed(data[-5:]) == [(_message(1), CONTENT_LENGTH)]
+
+
+def test_several_frames_in_one_read():
+    parser = FrameParser()
+    data = encode_frame(_message(1)) + encode_frame(_message(2), NDJSON) + encode_frame(_message(3))
+    assert parser.feed(data) == [
+        (_message(1), CONTENT_LENGTH),
+        (_message(2), NDJSON),
+        (_message(3), CONTENT_LENGTH),
+    ]
+
+
+def test_ndjson_line_split_and_crlf():
+    parser = FrameParser()
+    assert parser.feed(_message(1)[:10]) == []
+    assert parser.feed(_message(1)[10:] + b"\r\n\n") == [(_message(1), NDJSON)]
+
+
+def test_lf_only_header_terminator():
+    parser = FrameParser()
+    body = _message(1)
+    assert parser.feed(b"Content-Length: %d\n\n" % len(body) + body) == [(body, CONTENT_LENGTH)]
+
+
+def test_malformed_header_is_dropped_and_parsing_resumes():
+    parser = FrameParser()
+    data = b"Content-Length: abc\r\n\r\n" + encode_frame(_message(2))
+    assert parser.feed(data) == [(_message(2), CONTENT_LENGTH)]
+
+
+def test_oversized_frame_is_skipped():
+    parser = FrameParser(max_frame_size=16)
+    big = b"x" * 40
+    data = b"Content-Length: 40\r\n\r\n" + big + encode_frame(b"{}", NDJSON)
+    assert parser.feed(data[:30]) == []
+    assert parser.feed(data[30:]) == [(b"{}", NDJSON)]